@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Build artifact cache of the cross-compile jobs (build_scheduler.py).
+
+Every build job (workload, benchmark, ABI) is keyed by the SHA-256 of what
+its binaries are made of:
+
+    - the compile script, its base and the job's step (e.g. `525`),
+    - the sources: the SPEC src folders of the benchmark (and of the _r
+      benchmark a _s one shares them with), or the workload's source tree,
+    - the patch files the compile script copies into the sources for the
+      benchmark (519.lbm_r-lbm.c.org, 557.xz_r-pxz.c.org, ...),
+    - the cfg files of the ABI (configs/speccpu/*.cfg, configs/*.cfg),
+    - the compiler binary (clang of LLVM_DIR or of the cfg's llvm_dir).
+
+After a successful build the job's outputs (SPEC exe/ binaries and run
+folders of the label, the build-cheribsd-morello-<abi> folders of the other
+workloads) are stored in `<cache>/objects/<sha256>-<mode>` with an entry
+`<cache>/entries/<key>.json` listing them. A job whose key has an entry is
+not built: its outputs are restored from the cache, so only the jobs whose
+inputs changed are compiled again. File digests are cached by size and mtime
+(distribute.py), so computing the keys of an unchanged tree is cheap.
+
+    python3 build_cache.py [--cache DIR] status|clear
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from distribute import hash_files, sha256
+from metric_store import ABIS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.environ.get('BUILD_CACHE', os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'morello-build'))
+
+# Source folder variable of every workload's cross-compile/base
+SOURCE_VARS = {
+    'speccpu': '_SPECCPU_PATH',
+    'sqlite-bench': '_SQLITE_BENCH_PATH',
+    'quickjs': '_QUICKJS_PATH',
+    'llama-cpp': '_LLAMA_CPP_PATH',
+    'matrix-multiply': '_MATRIX_MULTIPLY_PATH',
+}
+# Files copied from the repository into the workload's source folder by its compile script
+REPO_SOURCES = {
+    'quickjs': ['quickjs/src'],
+    'llama-cpp': ['llama-cpp/Makefile'],
+    'matrix-multiply': ['matrix-multiply/src'],
+}
+# Build products left out of the source trees and of the stored outputs
+SKIPPED = re.compile(r'^(build-cheribsd-|CMakeFiles$|CMakeCache\.txt$|\.git$)|\.o$')
+SPEC_LABEL = 'cheribsd-morello-{abi}-cheribuild_llvm'
+
+
+def cross_compile_file(workload, name):
+    return os.path.join(PROJECT_ROOT, workload, 'cross-compile', name)
+
+
+def base_vars(workload):
+    """The NAME="value" variables of the workload's cross-compile/base, expanded."""
+    values = {}
+    with open(cross_compile_file(workload, 'base'), 'r') as f:
+        for line in f:
+            match = re.match(r'^([A-Z_]+)="?([^"\s]*)"?\s*(#.*)?$', line.strip())
+            if match:
+                values[match.group(1)] = re.sub(r'\$\{(\w+)\}', lambda m: values.get(m.group(1), ''), match.group(2))
+    return values
+
+
+def spec_patches():
+    """{benchmark: [(patch file, target relative to the SPEC path)]} of speccpu/cross-compile/compile."""
+    with open(cross_compile_file('speccpu', 'compile'), 'r') as f:
+        text = f.read().replace('\\\n', ' ')
+    patches, labels = {}, []
+    for line in text.split('case "$benchmark" in', 1)[1].split('esac', 1)[0].splitlines():
+        case = re.match(r'^\s*("[^"]+"(\s*\|\s*"[^"]+")*)\)', line)
+        if case:
+            labels = re.findall(r'"([^"]+)"', case.group(1))
+        copy = re.search(r'cp -f "\$\(dirname "\$0"\)/([^"]+)"\s+"\$\{_SPECCPU_PATH\}/([^"]+)"', line)
+        if copy:
+            for label in labels:
+                patches.setdefault(label, []).append((copy.group(1), copy.group(2)))
+    return patches
+
+
+def walk(path):
+    """
+    Files below path (or path itself), without build products: the tracked
+    files of a git checkout, every file but the build folders otherwise.
+    """
+    if os.path.isfile(path):
+        return [path]
+    if os.path.isdir(os.path.join(path, '.git')):
+        tracked = subprocess.run(['git', '-C', path, 'ls-files', '-z'], stdout=subprocess.PIPE, check=True).stdout
+        return [os.path.join(path, name) for name in sorted(tracked.decode().split('\0')) if name]
+    files = []
+    for folder, subdirs, names in os.walk(path):
+        subdirs[:] = sorted(d for d in subdirs if not SKIPPED.search(d))
+        files += [os.path.join(folder, name) for name in sorted(names) if not SKIPPED.search(name)]
+    return files
+
+
+def compiler(workload, abi):
+    """The clang binary a job compiles with."""
+    llvm_dir = base_vars(workload).get('LLVM_DIR')
+    if workload == 'speccpu':
+        with open(os.path.join(PROJECT_ROOT, 'configs', 'speccpu', f'morello-{abi}-clang-linux-x86.cfg'), 'r') as f:
+            match = re.search(r'^%\s*define\s+llvm_dir\s+"([^"]+)"', f.read(), re.M)
+        llvm_dir = match.group(1) if match else llvm_dir
+    return os.path.realpath(os.path.join(llvm_dir or '', 'bin', 'clang'))
+
+
+def job_inputs(workload, bench, abi):
+    """
+    The input files of one build job (abi None for the '525' jobs). The
+    patch targets in the SPEC src folders are left out, their patch files
+    stand for them.
+    """
+    abis = [abi] if abi else list(ABIS)
+    files = [cross_compile_file(workload, 'compile'), cross_compile_file(workload, 'base')]
+    files += [os.path.join(PROJECT_ROOT, 'configs', f'cheribsd-morello-{a}.cfg') for a in abis]
+    files += [compiler(workload, a) for a in abis]
+    if workload == 'speccpu':
+        spec = base_vars('speccpu')['_SPECCPU_PATH']
+        if not abi:  # the '525' file builds every label, from the FreeBSD cfg run folders
+            files += [cross_compile_file('speccpu', '525'), os.path.join(PROJECT_ROOT, 'configs', 'speccpu', 'clang-linux-x86.cfg')]
+        files += [os.path.join(PROJECT_ROOT, 'configs', 'speccpu', f'morello-{a}-clang-linux-x86.cfg') for a in abis]
+        patches = spec_patches()
+        files += [cross_compile_file('speccpu', patch) for patch, _ in patches.get(bench, [])]
+        excluded = {os.path.join(spec, target) for entries in patches.values() for _, target in entries}
+        speed = re.match(r'^6(\d\d)\.(\w+)_s$', bench)
+        benches = [bench] + ([f"5{speed.group(1)}.{speed.group(2)}_r"] if speed else [])
+        for name in benches:
+            files += [path for path in walk(os.path.join(spec, name, 'src')) if path not in excluded]
+            files.append(os.path.join(spec, name, 'Spec', 'object.pm'))
+    else:
+        # the copies of the repository files in the source tree are represented by the originals
+        tree = base_vars(workload)[SOURCE_VARS[workload]]
+        overlay = [path for source in REPO_SOURCES.get(workload, []) for path in walk(os.path.join(PROJECT_ROOT, source))]
+        copies = {os.path.join(tree, os.path.basename(path)) for path in overlay}
+        files += [path for path in walk(tree) if path not in copies] + overlay
+    return files
+
+
+def job_outputs(workload, bench, abi):
+    """Glob patterns of the files and folders a build job produces."""
+    if workload != 'speccpu':
+        return [os.path.join(base_vars(workload)[SOURCE_VARS[workload]], f'build-cheribsd-morello-{abi}')]
+    spec = base_vars('speccpu')['_SPECCPU_PATH']
+    labels = [SPEC_LABEL.format(abi=abi)] if abi else \
+        [SPEC_LABEL.format(abi=a) for a in ABIS] + ['ubuntu-x86-llvm14']
+    patterns = []
+    for label in labels:
+        patterns += [os.path.join(spec, bench, 'exe', f'*.{label}'), os.path.join(spec, bench, 'run', f'run_base_*_{label}.0000')]
+    return patterns
+
+
+def job_key(workload, bench, step, files, digests):
+    """SHA-256 of a job's step and the contents of its input files."""
+    digest = hashlib.sha256(json.dumps([workload, bench, step]).encode())
+    for path in files:
+        digest.update(f"{path}\0{digests.get(path, 'missing')}\n".encode())
+    return digest.hexdigest()
+
+
+def input_digests(files, jobs=None):
+    """{file: sha256} of the input files that exist."""
+    return hash_files(sorted({path for path in files if os.path.isfile(path)}), jobs)
+
+
+class BuildCache:
+    """Content-addressed store of the outputs of build jobs."""
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        self.entries = os.path.join(root, 'entries')
+
+    def lookup(self, key):
+        try:
+            with open(os.path.join(self.entries, key + '.json'), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if all(os.path.exists(os.path.join(self.objects, obj)) for obj in entry['files'].values()):
+            return entry
+        return None
+
+    def store(self, key, name, patterns):
+        """Store the outputs of a finished job; returns their number of files."""
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.entries, exist_ok=True)
+        files, links = {}, {}
+        for pattern in patterns:
+            for output in sorted(glob.glob(pattern)):
+                for path in ([output] if not os.path.isdir(output) else self._tree(output)):
+                    if os.path.islink(path):
+                        links[path] = os.readlink(path)
+                        continue
+                    obj = f"{sha256(path)}-{stat.S_IMODE(os.stat(path).st_mode):o}"
+                    target = os.path.join(self.objects, obj)
+                    if not os.path.exists(target):
+                        self._put(path, target)
+                    files[path] = obj
+        entry = {'job': name, 'patterns': patterns, 'files': files, 'links': links,
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(os.path.join(self.entries, key + '.json.tmp'), 'w') as f:
+            json.dump(entry, f, indent=1, sort_keys=True)
+        os.replace(os.path.join(self.entries, key + '.json.tmp'), os.path.join(self.entries, key + '.json'))
+        return len(files) + len(links)
+
+    def _put(self, path, target):
+        """
+        Copy path to the object target through a temporary file of its own:
+        jobs running at the same time store identical outputs (e.g. the run
+        folders of the three ABIs), and whichever copy lands last is the same.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.objects, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f, open(path, 'rb') as source:
+                shutil.copyfileobj(source, f)
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @staticmethod
+    def _tree(folder):
+        paths = []
+        for parent, subdirs, names in os.walk(folder):
+            subdirs[:] = sorted(d for d in subdirs if not SKIPPED.search(d) or os.path.islink(os.path.join(parent, d)))
+            paths += [os.path.join(parent, name) for name in sorted(names) if not SKIPPED.search(name)]
+            paths += [os.path.join(parent, d) for d in subdirs if os.path.islink(os.path.join(parent, d))]
+        return paths
+
+    def restore(self, entry):
+        """Replace the outputs of a job by the ones of a cache entry."""
+        for pattern in entry['patterns']:
+            for output in glob.glob(pattern):
+                if os.path.isdir(output) and not os.path.islink(output):
+                    shutil.rmtree(output)
+                else:
+                    os.remove(output)
+        for path, obj in entry['files'].items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(os.path.join(self.objects, obj), path)
+            os.chmod(path, int(obj.rsplit('-', 1)[1], 8))
+        for path, target in entry['links'].items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.symlink(target, path)
+        return len(entry['files']) + len(entry['links'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or clear the build artifact cache')
+    parser.add_argument('command', choices=['status', 'clear'])
+    parser.add_argument('--cache', default=CACHE_DIR, help='Cache folder ($BUILD_CACHE)')
+    args = parser.parse_args()
+
+    cache = BuildCache(args.cache)
+    if args.command == 'clear':
+        shutil.rmtree(args.cache, ignore_errors=True)
+        print(f"Cleared {args.cache}", file=sys.stderr)
+        return
+    entries = glob.glob(os.path.join(cache.entries, '*.json'))
+    objects = glob.glob(os.path.join(cache.objects, '*'))
+    size = sum(os.path.getsize(path) for path in objects)
+    print(f"{len(entries)} cached jobs, {len(objects)} objects ({size / 2**20:.1f} MiB) in {args.cache}", file=sys.stderr)
+    for path in sorted(entries, key=os.path.getmtime):
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        print(f"  {entry['time']}  {entry['job']:<40} {len(entry['files'])} files", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Parallel cross-compilation of every workload and ABI.
+
+The `cross-compile/compile` scripts build their three ABIs one after the
+other, and `speccpu/cross-compile/compile all` builds the SPEC benchmarks one
+after the other as well. This script expands (workload x ABI config) into a
+graph of jobs
+
+    speccpu/<benchmark>/trash -> speccpu/<benchmark>/<abi>
+    <workload>/prepare        -> <workload>/<abi>
+
+and runs it with at most -j jobs at a time, every job being one call of the
+workload's compile script restricted to one step (`compile <benchmark> <abi>`
+for SPEC, BUILD_STEPS="<abi>" for the others). Jobs that write the same
+source tree never run together: the SPEC benchmarks whose patch files are
+copied into a shared src folder (519/619, 520/620, 523/623, 557/657), and the
+in-tree builds of sqlite-bench and quickjs. Every job gets BUILD_JOBS make
+threads (--threads), its output in <logs>/<job>.log, and its time in
+<logs>/timings.tsv.
+
+Jobs whose sources, patch files, cfg files and compiler are unchanged since a
+cached build are not compiled: their binaries are restored from the build
+cache (build_cache.py, --no-cache disables it), and the trash or prepare step
+runs only when one of its jobs is compiled.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from build_cache import BuildCache, CACHE_DIR, input_digests, job_inputs, job_key, job_outputs, spec_patches
+from metric_store import ABIS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKLOADS = ('speccpu', 'sqlite-bench', 'quickjs', 'llama-cpp', 'matrix-multiply')
+
+# Workloads with a shared step before their ABIs (BUILD_STEPS=prepare)
+PREPARED = ('llama-cpp', 'matrix-multiply')
+# Workloads building every ABI in the same source tree
+IN_TREE = ('sqlite-bench', 'quickjs')
+# SPEC benchmarks built by the '525' file, as one job
+WHOLE = ('525.x264_r', '625.x264_s')
+
+
+@dataclass
+class Job:
+    name: str
+    command: list
+    env: dict = field(default_factory=dict)
+    after: list = field(default_factory=list)
+    lock: str = None
+    workload: str = None
+    bench: str = None
+    step: str = None  # ABI, 'trash', 'prepare', or None for a whole '525' build
+    key: str = None
+    cached: dict = None  # build cache entry restoring the job
+    status: str = 'pending'
+    seconds: float = 0.0
+
+
+def command_line(job):
+    return ' '.join([f'{k}={v}' for k, v in job.env.items()] + job.command)
+
+
+def compile_script(workload):
+    return os.path.join(PROJECT_ROOT, workload, 'cross-compile', 'compile')
+
+
+def spec_benchmarks():
+    """The benchmarks array of speccpu/cross-compile/compile."""
+    with open(compile_script('speccpu'), 'r') as f:
+        text = f.read()
+    return re.findall(r'"([^"]+)"', re.search(r'benchmarks=\((.*?)\)', text, re.S).group(1))
+
+
+def expand(workloads, abis, benchmarks=None, board=None):
+    """The jobs building `abis` of every workload, in submission order."""
+    jobs = []
+    for workload in workloads:
+        script = compile_script(workload)
+        if workload == 'speccpu':
+            # benchmarks patching the same src folder share its lock
+            locks = {bench: patches[0][1].split('/')[0] for bench, patches in spec_patches().items()}
+            for bench in benchmarks or spec_benchmarks():
+                lock = locks.get(bench)
+                if bench in WHOLE:
+                    jobs.append(Job(f"speccpu/{bench}", [script, bench], workload=workload, bench=bench))
+                    continue
+                trash = Job(f"speccpu/{bench}/trash", [script, bench, 'trash'], lock=lock,
+                            workload=workload, bench=bench, step='trash')
+                jobs.append(trash)
+                jobs += [Job(f"speccpu/{bench}/{abi}", [script, bench, abi], after=[trash.name], lock=lock,
+                             workload=workload, bench=bench, step=abi) for abi in abis]
+            continue
+        args = [board] if workload == 'quickjs' and board else []
+        lock = workload if workload in IN_TREE else None
+        after = []
+        if workload in PREPARED:
+            jobs.append(Job(f"{workload}/prepare", [script] + args, {'BUILD_STEPS': 'prepare'},
+                            workload=workload, step='prepare'))
+            after = [f"{workload}/prepare"]
+        jobs += [Job(f"{workload}/{abi}", [script] + args, {'BUILD_STEPS': abi}, after, lock,
+                     workload=workload, step=abi) for abi in abis]
+    return jobs
+
+
+def look_up(jobs, cache, hash_jobs=None):
+    """
+    Key every build job and attach the cache entries of the unchanged ones;
+    a trash or prepare step whose jobs are all cached is marked cached too.
+    """
+    builds = [job for job in jobs if job.step not in ('trash', 'prepare')]
+    inputs = {job.name: job_inputs(job.workload, job.bench, job.step) for job in builds}
+    digests = input_digests([path for files in inputs.values() for path in files], hash_jobs)
+    for job in builds:
+        job.key = job_key(job.workload, job.bench, job.step, inputs[job.name], digests)
+        job.cached = cache.lookup(job.key)
+    for job in jobs:
+        if job.step in ('trash', 'prepare'):
+            dependents = [other for other in builds if job.name in other.after]
+            if dependents and all(other.cached for other in dependents):
+                job.status = 'cached'
+
+
+def run_job(job, logs, threads, cache=None):
+    """
+    Run one job with its output in <logs>/<job>.log, or restore it from the
+    build cache; True if it succeeded.
+    """
+    log = os.path.join(logs, job.name + '.log')
+    os.makedirs(os.path.dirname(log), exist_ok=True)
+    env = {**os.environ, 'BUILD_JOBS': str(threads), **job.env}
+    start = time.time()
+    with open(log, 'w') as f:
+        if job.cached:
+            count = cache.restore(job.cached)
+            f.write(f"# restored {count} files of {job.cached['time']} from the build cache ({job.key})\n")
+            job.seconds = time.time() - start
+            return True
+        f.write(f"# {command_line(job)}\n")
+        f.flush()
+        returncode = subprocess.run(job.command, stdout=f, stderr=subprocess.STDOUT, env=env,
+                                    cwd=os.path.dirname(job.command[0])).returncode
+        if returncode == 0 and cache and job.key:
+            count = cache.store(job.key, job.name, job_outputs(job.workload, job.bench, job.step))
+            f.write(f"# stored {count} files in the build cache ({job.key})\n")
+    job.seconds = time.time() - start
+    return returncode == 0
+
+
+def schedule(jobs, logs, jobs_limit, threads, keep_going=False, cache=None):
+    """Run the job graph, at most jobs_limit at a time; True if every job succeeded."""
+    by_name = {job.name: job for job in jobs}
+    locks = set()
+    running = {}
+    failed = False
+    finished = sum(job.status != 'pending' for job in jobs)
+    with ThreadPoolExecutor(max_workers=jobs_limit) as pool:
+        while True:
+            for job in jobs:
+                if job.status != 'pending':
+                    continue
+                states = [by_name[name].status for name in job.after if name in by_name]
+                if any(state in ('failed', 'skipped') for state in states):
+                    job.status = 'skipped'
+                    finished += 1
+                    print(f"[{finished}/{len(jobs)}] {job.name} skipped", file=sys.stderr)
+                    continue
+                if (failed and not keep_going) or len(running) >= jobs_limit or \
+                        any(state not in ('ok', 'cached') for state in states) or (job.lock and job.lock in locks):
+                    continue
+                job.status = 'running'
+                if job.lock:
+                    locks.add(job.lock)
+                running[pool.submit(run_job, job, logs, threads, cache)] = job
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    succeeded = future.result()
+                except Exception as e:
+                    print(f"{job.name}: {type(e).__name__}: {e}", file=sys.stderr)
+                    succeeded = False
+                job.status = ('cached' if job.cached else 'ok') if succeeded else 'failed'
+                failed = failed or job.status == 'failed'
+                locks.discard(job.lock)
+                finished += 1
+                print(f"[{finished}/{len(jobs)}] {job.name} {job.status} {job.seconds:.1f} s", file=sys.stderr)
+    return all(job.status in ('ok', 'cached') for job in jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-compile every workload and ABI in parallel')
+    parser.add_argument('workloads', nargs='*', default=list(WORKLOADS), help=f"Workloads (default: {' '.join(WORKLOADS)})")
+    parser.add_argument('--abis', nargs='+', default=list(ABIS), choices=ABIS, help='ABIs to build')
+    parser.add_argument('--benchmarks', nargs='+', help='SPEC benchmarks (default: all of speccpu/cross-compile/compile)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Jobs running at the same time')
+    parser.add_argument('--threads', type=int, help='Make threads of every job (default: cores / jobs)')
+    parser.add_argument('--board', help='Morello board IP, for the quickjs build')
+    parser.add_argument('--logs', default=os.path.join(PROJECT_ROOT, 'build-logs'), help='Folder of the job logs')
+    parser.add_argument('--cache', default=CACHE_DIR, help='Build cache folder ($BUILD_CACHE)')
+    parser.add_argument('--no-cache', action='store_true', help='Compile every job, without reading or filling the cache')
+    parser.add_argument('--keep-going', '-k', action='store_true', help='Start new jobs after a failure')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the job graph')
+    args = parser.parse_args()
+
+    for workload in args.workloads:
+        if workload not in WORKLOADS:
+            parser.error(f"unknown workload {workload}")
+    threads = args.threads or max(1, os.cpu_count() // args.jobs)
+    jobs = expand(args.workloads, args.abis, args.benchmarks, args.board)
+    cache = None if args.no_cache else BuildCache(args.cache)
+    if cache:
+        look_up(jobs, cache, args.jobs)
+        print(f"{sum(bool(job.cached) for job in jobs)}/{sum(bool(job.key) for job in jobs)} "
+              f"builds unchanged, restored from {args.cache}", file=sys.stderr)
+    if args.dry_run:
+        for job in jobs:
+            after = f" after {' '.join(job.after)}" if job.after else ''
+            lock = f" lock {job.lock}" if job.lock else ''
+            cached = ' (cached)' if job.cached or job.status == 'cached' else ''
+            print(f"{job.name}:{after}{lock}{cached}\n    {command_line(job)}")
+        return
+
+    os.makedirs(args.logs, exist_ok=True)
+    start = time.time()
+    ok = schedule(jobs, args.logs, args.jobs, threads, args.keep_going, cache)
+    elapsed = time.time() - start
+    with open(os.path.join(args.logs, 'timings.tsv'), 'w') as f:
+        f.write("job\tstatus\tseconds\n")
+        for job in jobs:
+            f.write(f"{job.name}\t{job.status}\t{job.seconds:.1f}\n")
+    busy = sum(job.seconds for job in jobs)
+    print(f"{sum(job.status == 'ok' for job in jobs)}/{len(jobs)} jobs built, "
+          f"{sum(job.status == 'cached' for job in jobs)} restored from the cache in {elapsed:.0f} s "
+          f"({busy:.0f} s of jobs, {busy / max(elapsed, 1e-9):.1f}x), logs in {args.logs}", file=sys.stderr)
+    for job in sorted(jobs, key=lambda job: job.seconds, reverse=True)[:5]:
+        print(f"  {job.name:<40} {job.status:<8} {job.seconds:8.1f} s", file=sys.stderr)
+    if not ok:
+        for job in jobs:
+            if job.status == 'failed':
+                print(f"  failed: {job.name} (see {os.path.join(args.logs, job.name + '.log')})", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
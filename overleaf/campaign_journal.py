@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Journal of the pmcstat passes already measured, so that an interrupted
+campaign resumes where it stopped instead of starting over.
+
+A unit is one pass (the warm-up + timing pass, or pmcstat pass SN) of one
+result folder, keyed by the folder relative to the results root, e.g.
+
+    round-1/505.mcf_r/run_base_train_cheribsd-morello-purecap-cheribuild_llvm.0000/S3
+
+which spells (round, benchmark, ABI, size, group). Units are appended to
+`<results>/campaign.journal` (JSON lines) with the SHA-256 of their files:
+by result_stream.py as soon as every file of a pass has arrived, and by
+campaign_scheduler.py after fetching a unit. `run/launch` asks for the
+passes of a folder already measured and hands them to the board
+(DONE=" timing S1 ..."), where the launch script skips them, and skips
+folders that are complete. A measured unit is never measured again until it
+is invalidated, which also deletes its local files:
+
+    python3 campaign_journal.py <journal> status [--verify]
+    python3 campaign_journal.py <journal> invalidate 'round-1/505.mcf_r/*' ...
+    python3 campaign_journal.py <journal> todo <folder key> [--script <launch script>]
+
+`todo` exits with COMPLETE (3) when every pass of the folder is measured,
+so that the launch scripts never take a failure of this script (exit 1) for
+a measured folder.
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+JOURNAL_FILE = 'campaign.journal'
+TIMING_FILE = 'pmcstat.timing.out'
+# Exit status of `todo` for a folder whose passes are all measured
+COMPLETE = 3
+
+PASS_FILE = re.compile(r'^pmcstat\.(S\d+)\.(\w+)$')
+# Passes written by a generated launch script
+SCRIPT_PASS = re.compile(r'-[oO] pmcstat\.(S\d+)\.')
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pass_label(name):
+    """The pass a result file belongs to ('timing', 'S3'), or None."""
+    if name == TIMING_FILE:
+        return 'timing'
+    match = PASS_FILE.match(name)
+    return match.group(1) if match else None
+
+
+def complete(label, names):
+    """
+    The files of pass `label` among names once the pass is complete (None
+    before): the counting totals, the sampling callgraph, or the raw log with
+    its events.
+    """
+    if label == 'timing':
+        return [TIMING_FILE] if TIMING_FILE in names else None
+    files = sorted(name for name in names if pass_label(name) == label)
+    suffixes = {name.rsplit('.', 1)[1] for name in files}
+    if 'count' in suffixes or 'gmon' in suffixes or {'events', 'out'} <= suffixes:
+        return files
+    return None
+
+
+def script_passes(path):
+    """The passes of a generated launch script, None when it cannot be read."""
+    try:
+        with open(path, 'r') as f:
+            text = f.read()
+    except OSError:
+        return None
+    passes = ['timing'] if TIMING_FILE in text else []
+    for label in SCRIPT_PASS.findall(text):
+        if label not in passes:
+            passes.append(label)
+    return passes
+
+
+class Journal:
+    """The measured units of a campaign, replayed from an append-only file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.units = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by an interrupted write
+                    if entry.get('invalidated'):
+                        self.units.pop(entry['unit'], None)
+                    else:
+                        self.units[entry['unit']] = entry['files']
+
+    def _append(self, entry):
+        os.makedirs(self.root, exist_ok=True)
+        with self.lock, open(self.path, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def done(self, folder):
+        """Passes of a result folder (key relative to the root) already measured."""
+        prefix = folder.rstrip('/') + '/'
+        return [unit[len(prefix):] for unit in self.units if unit.startswith(prefix) and '/' not in unit[len(prefix):]]
+
+    def record(self, folder, label, names):
+        """Journal pass `label` of a folder from its files (names relative to the folder)."""
+        unit = f"{folder.rstrip('/')}/{label}"
+        directory = os.path.join(self.root, folder)
+        files = {name: sha256(os.path.join(directory, name)) for name in names}
+        self._append({'unit': unit, 'files': files, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        self.units[unit] = files
+        return unit
+
+    def invalidate(self, patterns):
+        """Forget the units matching any glob pattern and delete their local files."""
+        matched = [unit for unit in self.units if any(fnmatch.fnmatch(unit, pattern) for pattern in patterns)]
+        for unit in matched:
+            directory = os.path.join(self.root, os.path.dirname(unit))
+            for name in self.units.pop(unit):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+            self._append({'unit': unit, 'invalidated': True, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        return matched
+
+    def verify(self):
+        """{unit: [files missing or changed since they were journaled]}."""
+        changed = {}
+        for unit, files in self.units.items():
+            directory = os.path.join(self.root, os.path.dirname(unit))
+            for name, digest in files.items():
+                path = os.path.join(directory, name)
+                if not os.path.exists(path) or sha256(path) != digest:
+                    changed.setdefault(unit, []).append(name)
+        return changed
+
+
+class PassTracker:
+    """
+    Journals the passes of one result folder as their files arrive
+    (result_stream.py); only the files received in this session count, so
+    stale files of an earlier campaign are never mistaken for a new pass.
+    """
+
+    def __init__(self, journal, folder):
+        self.journal = journal
+        self.folder = folder
+        self.received = set()
+
+    def received_file(self, name):
+        """Note a received file (relative to the folder); returns the unit it completed, if any."""
+        label = pass_label(name)
+        if label is None or name in self.received:
+            return None
+        self.received.add(name)
+        files = complete(label, self.received)
+        if files is None:
+            return None
+        return self.journal.record(self.folder, label, files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or edit a campaign journal')
+    parser.add_argument('journal', help=f'Journal file (<results>/{JOURNAL_FILE})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    status = commands.add_parser('status', help='Count the measured units')
+    status.add_argument('--verify', action='store_true', help='Check the files of every unit against their hashes')
+    invalidate = commands.add_parser('invalidate', help='Forget units (glob patterns) and delete their files')
+    invalidate.add_argument('patterns', nargs='+')
+    todo = commands.add_parser('todo', help=f'Print the measured passes of a folder, exit {COMPLETE} when none is left')
+    todo.add_argument('folder', help='Result folder relative to the results root')
+    todo.add_argument('--script', help='Launch script listing the passes of the folder')
+    args = parser.parse_args()
+
+    journal = Journal(args.journal)
+    if args.command == 'status':
+        folders = {os.path.dirname(unit) for unit in journal.units}
+        print(f"{len(journal.units)} units measured in {len(folders)} result folders", file=sys.stderr)
+        if args.verify:
+            changed = journal.verify()
+            for unit, names in sorted(changed.items()):
+                print(f"  {unit}: {' '.join(names)} missing or changed", file=sys.stderr)
+            sys.exit(1 if changed else 0)
+    elif args.command == 'invalidate':
+        for unit in journal.invalidate(args.patterns):
+            print(f"  invalidated {unit}", file=sys.stderr)
+    else:
+        done = journal.done(args.folder)
+        print(f" {' '.join(sorted(done))} ")
+        expected = script_passes(args.script) if args.script else None
+        sys.exit(COMPLETE if expected and set(expected) <= set(done) else 0)
+
+
+if __name__ == '__main__':
+    main()
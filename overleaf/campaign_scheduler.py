@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Multi-board pmcstat campaign scheduler.
+
+`run/launch` runs every benchmark x ABI of a workload serially on one board.
+This script splits a campaign into units
+
+    (benchmark, ABI, size, group, round)
+
+where group 0 is the timing pass (pmcstat.timing.out, after an untimed
+warm-up run where the workload's run/setup has one) and group N
+the N-th pmcstat pass of pmcstat_groups.py (pmcstat.SN.*), and dispatches
+them from one work queue to a pool of boards: every board runs one unit at a
+time and takes the next unit as soon as it is idle. A failed unit is queued
+again up to --retries times, and a board that fails --max-failures units in
+a row is retired. The files of every finished unit are copied into the
+standard results tree (<results>/round-N/<run folder>/...), so that
+run/verbose and pmcstat_ingest.py read a scheduled campaign like a launched
+one. Every fetched unit is entered in the campaign journal of the results
+tree (campaign_journal.py), and units already journaled are not measured
+again, so an interrupted campaign is resumed by running it again.
+
+Boards must have been prepared with run/setup and run/distribute. With
+--fake every board is a local stand-in (fake_board.py) that runs the units on
+this machine, e.g. to check a campaign layout without hardware.
+"""
+
+import argparse
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+from campaign_journal import JOURNAL_FILE, Journal
+from metric_store import ABIS
+from pmcstat_groups import CORRELATED, DEFAULT_EVENTS, launch_script, pack, pause
+
+# Remote working folder (holding the launch command), results subfolder and
+# local results folder of every workload, as laid out by run/setup and run/launch,
+# and whether the timing pass of its _launch_pmcstat starts with a warm-up run
+WORKLOADS = {
+    'speccpu': {
+        'remote': '{bench}/run_base_{size}_cheribsd-morello-{abi}-cheribuild_llvm.0000',
+        'results': '.',
+        'local': '{bench}/run_base_{size}_cheribsd-morello-{abi}-cheribuild_llvm.0000',
+        'command': './_launch_raw',
+        'run_dir': '/home/iiswc/spec_run',
+        'warmup': False,
+    },
+    'sqlite-bench': {
+        'remote': 'build-cheribsd-morello-{abi}',
+        'results': 'results',
+        'local': 'build-cheribsd-morello-{abi}/results',
+        'command': './_launch_raw',
+        'run_dir': '/home/iiswc/sqlite-bench',
+        'warmup': True,
+    },
+    'quickjs': {
+        'remote': 'build-cheribsd-morello-{abi}/bin',
+        'results': 'results',
+        'local': 'build-cheribsd-morello-{abi}/results',
+        'command': './_launch',
+        'run_dir': '/home/iiswc/quickjs',
+        'warmup': True,
+    },
+    'llama-cpp': {
+        'remote': 'build-cheribsd-morello-{abi}',
+        'results': 'results_{bench}',
+        'local': 'build-cheribsd-morello-{abi}/results_{bench}',
+        'command': './_launch_{bench}',
+        'run_dir': '/home/iiswc/llama-cpp',
+        'warmup': True,
+    },
+}
+
+DEFAULT_BENCHMARKS = {'sqlite-bench': ['sqlite-bench'], 'quickjs': ['quickjs'], 'llama-cpp': ['raw', 'matmult']}
+
+FAKE_BOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_board.py')
+
+
+@dataclass
+class Unit:
+    bench: str
+    abi: str
+    size: str
+    group: int
+    round: int
+    attempts: int = 0
+
+    @property
+    def label(self):
+        return 'timing' if self.group == 0 else f"S{self.group}"
+
+    def __str__(self):
+        size = '' if self.size == '-' else f" {self.size}"
+        return f"round {self.round} {self.bench}{size} {self.abi} {self.label}"
+
+
+class Transport:
+    """
+    ssh/scp to the boards, or to the local fake_board.py stand-in. Unless
+    mux is False, all sessions to a board share one master connection, in
+    the same control folder as the ssh of run/base.
+    """
+
+    def __init__(self, user='root', fake=False, mux=True, control_dir=None, persist=600):
+        self.user = user
+        self.fake = fake
+        self.options = ['-o', 'BatchMode=yes']
+        if mux:
+            control_dir = control_dir or os.environ.get('SSH_CONTROL_DIR', os.path.expanduser('~/.ssh/morello-mux'))
+            os.makedirs(control_dir, mode=0o700, exist_ok=True)
+            self.options += ['-o', 'ControlMaster=auto', '-o', f"ControlPath={control_dir}/%C",
+                             '-o', f"ControlPersist={persist}"]
+
+    def _ssh(self, host):
+        if self.fake:
+            return [sys.executable, FAKE_BOARD, 'ssh', host]
+        return ['ssh'] + self.options + [f"{self.user}@{host}"]
+
+    def _scp(self):
+        return [sys.executable, FAKE_BOARD, 'scp'] if self.fake else ['scp', '-q'] + self.options
+
+    def run(self, host, script, log):
+        """Run a shell script on host (fed to `sh -s`), output appended to log."""
+        return subprocess.run(self._ssh(host) + ['sh', '-s'], input=script.encode(),
+                              stdout=log, stderr=subprocess.STDOUT).returncode == 0
+
+    def fetch(self, host, remote_files, local_dir, log):
+        """Copy the remote files (shell patterns) of host into local_dir."""
+        os.makedirs(local_dir, exist_ok=True)
+        target = host if self.fake else f"{self.user}@{host}"
+        sources = [f"{target}:{path}" for path in remote_files]
+        return subprocess.run(self._scp() + sources + [local_dir],
+                              stdout=log, stderr=subprocess.STDOUT).returncode == 0
+
+
+class Campaign:
+    """The units of a workload campaign and the shell script of each unit."""
+
+    def __init__(self, workload, run_dir, results, groups, settle=15, cool=10, mode='sampling', cooldown=0):
+        self.layout = WORKLOADS[workload]
+        self.run_dir = run_dir
+        self.results = results
+        self.groups = groups
+        self.settle, self.cool, self.mode = settle, cool, mode
+        self.cooldown = cooldown
+
+    def units(self, benchmarks, abis, sizes, rounds):
+        """Round-major, so that early rounds complete first."""
+        return [
+            Unit(bench, abi, size, group, round_)
+            for round_ in range(1, rounds + 1)
+            for bench in benchmarks
+            for size in sizes
+            for abi in abis
+            for group in range(len(self.groups) + 1)
+        ]
+
+    def _fields(self, unit):
+        return {'bench': unit.bench, 'abi': unit.abi, 'size': unit.size}
+
+    def remote_results(self, unit):
+        fields = self._fields(unit)
+        remote = self.layout['remote'].format(**fields)
+        return os.path.normpath(os.path.join(self.run_dir, remote, self.layout['results'].format(**fields)))
+
+    def local_results(self, unit):
+        local = self.layout['local'].format(**self._fields(unit))
+        return os.path.join(self.results, f"round-{unit.round}", local)
+
+    def journal_key(self, unit):
+        """The unit in the campaign journal: result folder relative to the results root, and pass."""
+        return os.path.relpath(self.local_results(unit), self.results) + '/' + unit.label
+
+    def outputs(self, unit):
+        """Remote files produced by a unit."""
+        folder = self.remote_results(unit)
+        if unit.group == 0:
+            return [f"{folder}/pmcstat.timing.out"]
+        suffixes = {'counting': ['count'], 'raw': ['events', 'out']}.get(self.mode, ['out', 'gmon'])
+        return [f"{folder}/pmcstat.S{unit.group}.{suffix}" for suffix in suffixes]
+
+    def script(self, unit):
+        fields = self._fields(unit)
+        command = self.layout['command'].format(**fields)
+        results = self.layout['results'].format(**fields)
+        lines = [f"cd {shlex.quote(os.path.join(self.run_dir, self.layout['remote'].format(**fields)))} || exit 1"]
+        if results != '.':
+            copied = f"{command} ./_launch_cooldown" if self.cooldown else command
+            lines.append(f"mkdir -p {results} && cp {copied} {results}/ && cd {results} || exit 1")
+        lines.append(f"rm -f {' '.join(os.path.basename(path) for path in self.outputs(unit))}")
+        if unit.group == 0:
+            if self.cooldown:
+                lines.append(f"{pause(0, 'baseline', self.cooldown)} && \\")
+            if self.layout['warmup']:
+                lines.append(f"{command} && {pause(self.settle, 'warmup', self.cooldown)} && \\")
+            lines.append(f"time {command} > pmcstat.timing.out 2>&1 && {pause(self.settle, 'timing', self.cooldown)}")
+        else:
+            block = launch_script([self.groups[unit.group - 1]], command, self.settle, self.cool, self.mode,
+                                  self.cooldown)
+            lines.append(block.replace('pmcstat.S1.', f"pmcstat.S{unit.group}."))
+        return "\n".join(lines) + "\n"
+
+
+class Scheduler:
+    """One worker thread per board pulling units from a shared queue."""
+
+    def __init__(self, campaign, transport, boards, retries=2, max_failures=3, log_dir=None, journal=None):
+        self.campaign = campaign
+        self.journal = journal
+        self.transport = transport
+        self.boards = boards
+        self.retries = retries
+        self.max_failures = max_failures
+        self.log_dir = log_dir
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.done, self.failed = [], []
+        self.busy = 0
+
+    def _log(self, message):
+        with self.lock:
+            print(message, flush=True)
+
+    def _attempt(self, board, unit):
+        log_path = os.path.join(self.log_dir, f"{board}.log") if self.log_dir else os.devnull
+        with open(log_path, 'a') as log:
+            if log_path != os.devnull:
+                log.write(f"### {unit}\n")
+                log.flush()
+            return (self.transport.run(board, self.campaign.script(unit), log) and
+                    self.transport.fetch(board, self.campaign.outputs(unit), self.campaign.local_results(unit), log))
+
+    def _next(self):
+        """
+        Next unit, counted as busy in the same critical section as the
+        dequeue, or None once the queue is empty and no retry can come back.
+        """
+        while True:
+            with self.lock:
+                try:
+                    unit = self.pending.get_nowait()
+                except queue.Empty:
+                    if self.busy == 0:
+                        return None
+                else:
+                    self.busy += 1
+                    return unit
+            time.sleep(0.1)
+
+    def _worker(self, board):
+        failures = 0
+        while failures < self.max_failures:
+            unit = self._next()
+            if unit is None:
+                return
+            start = time.time()
+            ok = self._attempt(board, unit)
+            unit.attempts += 1
+            if ok:
+                failures = 0
+                self.done.append(unit)
+                if self.journal:
+                    folder, label = self.campaign.journal_key(unit).rsplit('/', 1)
+                    self.journal.record(folder, label, [os.path.basename(path) for path in self.campaign.outputs(unit)])
+                self._log(f"[{board}] {unit} ok ({time.time() - start:.1f} s)")
+            else:
+                failures += 1
+                if unit.attempts <= self.retries:
+                    self._log(f"[{board}] {unit} failed, queued again ({unit.attempts}/{self.retries} retries)")
+                    self.pending.put(unit)
+                else:
+                    self.failed.append(unit)
+                    self._log(f"[{board}] {unit} failed after {unit.attempts} attempts")
+            with self.lock:
+                self.busy -= 1
+        self._log(f"[{board}] retired after {failures} consecutive failures")
+
+    def run(self, units):
+        for unit in units:
+            self.pending.put(unit)
+        workers = [threading.Thread(target=self._worker, args=(board,), daemon=True) for board in self.boards]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # Units left behind when every board was retired
+        while not self.pending.empty():
+            self.failed.append(self.pending.get())
+        return self.done, self.failed
+
+
+def _list(text):
+    return [item for item in text.replace(',', ' ').split() if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a pmcstat campaign over a pool of Morello boards')
+    parser.add_argument('workload', choices=sorted(WORKLOADS))
+    parser.add_argument('--boards', type=_list, required=True, help='Board hosts, comma or space separated')
+    parser.add_argument('--results', required=True, help='Local results folder, e.g. results/speccpu')
+    parser.add_argument('--run-dir', help='Remote run folder (default: the one of run/base)')
+    parser.add_argument('--benchmarks', type=_list, help='Benchmarks (required for speccpu)')
+    parser.add_argument('--abis', type=_list, default=ABIS, help='ABIs (default: all three)')
+    parser.add_argument('--sizes', type=_list, default=['test'], help='SPEC sizes (default: test)')
+    parser.add_argument('--rounds', type=int, default=1, help='Rounds (default: 1)')
+    parser.add_argument('--counters', type=int, default=6, help='Counters per pass (default: 6)')
+    parser.add_argument('--mode', choices=['sampling', 'counting', 'raw'], default='sampling')
+    parser.add_argument('--anchor', type=str.lower, default=None, help='Event counted in every pass')
+    parser.add_argument('--settle', type=int, default=15, help='Sleep after each pass (s)')
+    parser.add_argument('--cool', type=int, default=10, help='Sleep after each decode (s)')
+    parser.add_argument('--cooldown', type=int, default=0,
+                        help='Wait at most this long (s) for an idle board instead of the sleeps (0: sleeps)')
+    parser.add_argument('--retries', type=int, default=2, help='Retries of a failed unit (default: 2)')
+    parser.add_argument('--max-failures', type=int, default=3,
+                        help='Consecutive failures after which a board is retired (default: 3)')
+    parser.add_argument('--user', default='root', help='Remote user (default: root)')
+    parser.add_argument('--no-mux', action='store_true',
+                        help='Open a new ssh connection per command (default with SSH_MUX=0)')
+    parser.add_argument('--log-dir', help='Folder of the per-board unit logs')
+    parser.add_argument('--fake', action='store_true', help='Run every board as a local stand-in (fake_board.py)')
+    parser.add_argument('--journal', help=f'Campaign journal (default: <results>/{JOURNAL_FILE})')
+    parser.add_argument('--dry-run', action='store_true', help='Print the units and their scripts only')
+    args = parser.parse_args()
+
+    benchmarks = args.benchmarks or DEFAULT_BENCHMARKS.get(args.workload)
+    if not benchmarks:
+        parser.error(f"--benchmarks is required for {args.workload}")
+    sizes = args.sizes if args.workload == 'speccpu' else ['-']
+    groups = pack(DEFAULT_EVENTS, args.counters, CORRELATED, anchor=args.anchor, strict=False)
+    campaign = Campaign(args.workload, args.run_dir or WORKLOADS[args.workload]['run_dir'],
+                        args.results, groups, args.settle, args.cool, args.mode, args.cooldown)
+    units = campaign.units(benchmarks, args.abis, sizes, args.rounds)
+    journal = Journal(args.journal or os.path.join(args.results, JOURNAL_FILE))
+    pending = [unit for unit in units if campaign.journal_key(unit) not in journal.units]
+    if len(pending) < len(units):
+        print(f"Skipping {len(units) - len(pending)} units already in {journal.path}")
+        units = pending
+
+    if args.dry_run:
+        for unit in units:
+            print(f"# {unit} -> {campaign.local_results(unit)}")
+            print(campaign.script(unit))
+        return
+
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+    print(f"Scheduling {len(units)} units ({len(groups)} passes + timing) on {len(args.boards)} boards")
+    start = time.time()
+    mux = not (args.no_mux or args.fake or os.environ.get('SSH_MUX') == '0')
+    scheduler = Scheduler(campaign, Transport(args.user, args.fake, mux), args.boards,
+                          args.retries, args.max_failures, args.log_dir, journal)
+    done, failed = scheduler.run(units)
+    print(f"Finished {len(done)} of {len(units)} units in {(time.time() - start) / 60:.1f} min, {len(failed)} failed")
+    for unit in failed:
+        print(f"  failed: {unit}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
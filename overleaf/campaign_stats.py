@@ -0,0 +1,214 @@
+"""
+Multi-round campaign statistics.
+
+Summarizes every (benchmark, ABI) cell of a metric store over its round axis
+(see `ROUNDS=N ./<workload>/run/launch`) into mean, sample standard
+deviation, coefficient of variation and a percentile bootstrap confidence
+interval of the mean, for
+
+    - the raw PMU events                       -> pmu-event-stats.txt
+    - the Figure 1 macroscopic rates           -> macroscopic-performance-stats.txt
+    - the derived top-down metrics (topdown.py) -> top-down-analysis-stats.txt
+
+Top-down metrics are computed per round first and then summarized, so their
+intervals include the run-to-run variation of every input counter. The
+output files are Python literals {benchmark: {metric: {stat: (hybrid,
+purecap-benchmark, purecap)}}} read back by the figures with `load_stats`.
+"""
+
+import argparse
+import os
+import warnings
+from ast import literal_eval
+
+import numpy as np
+
+from metric_store import ABIS, open_store
+from topdown import TOPDOWN_EVENTS, TOPDOWN_METRICS, top_down_matrix
+
+STATS = ['n', 'mean', 'std', 'cv', 'ci_low', 'ci_high']
+
+# Benchmark labels written by pmcstat_ingest.py -> labels of the figure data files
+FIGURE_NAMES = {
+    'sqlite-bench': 'SQLite-Bench',
+    'quickjs': 'QuickJS',
+    'llama.cpp-raw': 'LLaMA.cpp-inference',
+    'llama.cpp-matmult': 'LLaMA.cpp-matmult',
+}
+
+# Figure 1 metrics as (numerator, denominator, scale)
+RATES = {
+    'Execution Time': ('time_real_ms', None, 1e-3),
+    'IPC': ('inst_retired', 'cpu_cycles', 1.0),
+    'Branch MR': ('br_mis_pred_retired', 'br_retired', 100.0),
+    'L1I MR': ('l1i_cache_refill', 'l1i_cache', 100.0),
+    'L1D MR': ('l1d_cache_refill', 'l1d_cache', 100.0),
+    'L2D MR': ('l2d_cache_refill', 'l2d_cache', 100.0),
+    'LLC Read MR': ('ll_cache_miss_rd', 'll_cache_rd', 100.0),
+}
+
+# Bootstrap resamples drawn per batch, bounds memory to (cells x batch x rounds)
+BOOT_BATCH = 100
+
+
+def summarize(samples, n_boot=2000, confidence=0.95, seed=0):
+    """
+    Summarize samples of shape (..., rounds), NaN where a round is missing.
+    Returns {stat: array of shape (...)} for every stat of STATS. Cells with
+    fewer than two rounds get std = cv = 0 and a degenerate interval.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    rounds = samples.shape[-1]
+    n = np.count_nonzero(~np.isnan(samples), axis=-1)
+    rng = np.random.default_rng(seed)
+    alpha = (1.0 - confidence) / 2
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(samples, axis=-1)
+        std = np.where(n > 1, np.nanstd(samples, axis=-1, ddof=1), 0.0)
+
+        boot = []
+        for start in range(0, n_boot, BOOT_BATCH):
+            idx = rng.integers(0, rounds, size=(min(BOOT_BATCH, n_boot - start), rounds))
+            boot.append(np.nanmean(samples[..., idx], axis=-1))
+        boot = np.concatenate(boot, axis=-1)
+        ci_low = np.nanpercentile(boot, 100 * alpha, axis=-1)
+        ci_high = np.nanpercentile(boot, 100 * (1 - alpha), axis=-1)
+
+    mean = np.nan_to_num(mean)
+    cv = np.divide(std, np.abs(mean), out=np.zeros_like(mean), where=mean != 0)
+    single = n < 2
+    ci_low = np.where(single, mean, np.nan_to_num(ci_low))
+    ci_high = np.where(single, mean, np.nan_to_num(ci_high))
+    return {'n': n, 'mean': mean, 'std': std, 'cv': cv, 'ci_low': ci_low, 'ci_high': ci_high}
+
+
+def _samples(store, events):
+    """(benchmarks, abis, len(events), rounds) float array, NaN where not recorded."""
+    values = store.take(events)
+    present = np.zeros(values.shape, dtype=bool)
+    for i, event in enumerate(events):
+        if event in store.events:
+            present[..., i] = store.present[..., store.position('event', event)]
+    values[~present] = np.nan
+    return np.moveaxis(values, 2, -1)
+
+
+def event_stats(store, **kwargs):
+    return summarize(_samples(store, store.events), **kwargs), list(store.events)
+
+
+def rate_stats(store, rates=RATES, **kwargs):
+    """Statistics of the Figure 1 rates, each computed per round."""
+    samples = []
+    for num, den, scale in rates.values():
+        n = _samples(store, [num])[:, :, 0]
+        if den is None:
+            samples.append(n * scale)
+            continue
+        d = _samples(store, [den])[:, :, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            samples.append(np.where(d > 0, scale * n / d, np.nan))
+    return summarize(np.stack(samples, axis=2), **kwargs), list(rates)
+
+
+def topdown_stats(store, **kwargs):
+    """Statistics of the top-down metrics, each computed per round."""
+    metrics = top_down_matrix(store.take(TOPDOWN_EVENTS), verbose=False)
+    metrics[np.isnan(_samples(store, ['cpu_cycles'])[:, :, 0])] = np.nan
+    return summarize(np.moveaxis(metrics, 2, -1), **kwargs), list(TOPDOWN_METRICS)
+
+
+def as_dict(store, names, stats, decimals=6):
+    """
+    {benchmark: {name: {stat: (hybrid, purecap-benchmark, purecap)}}}, with
+    benchmarks renamed with FIGURE_NAMES.
+    """
+    order = [store.position('abi', abi) for abi in ABIS if abi in store.abis]
+    order += [a for a, abi in enumerate(store.abis) if abi not in ABIS]
+    data = {}
+    for b, benchmark in enumerate(store.benchmarks):
+        data[FIGURE_NAMES.get(benchmark, benchmark)] = {
+            name: {
+                stat: tuple(int(v) if stat == 'n' else round(float(v), decimals) for v in stats[stat][b, order, m])
+                for stat in STATS
+            }
+            for m, name in enumerate(names)
+        }
+    return data
+
+
+def write_stats(path, data):
+    with open(path, 'w') as f:
+        f.write("{\n")
+        for benchmark, metrics in data.items():
+            f.write(f"'{benchmark}': {{\n")
+            for name, stats in metrics.items():
+                f.write(f"'{name}': {stats},\n")
+            f.write("},\n")
+        f.write("}\n")
+
+
+def load_stats(path):
+    """Statistics written by this script, or None when no multi-round data was summarized."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return literal_eval(f.read())
+
+
+def error_bars(stats, benchmarks, metric, abi, scale=1.0):
+    """
+    Asymmetric (2, len(benchmarks)) yerr of the confidence interval around
+    the mean for matplotlib, or None without statistics. Benchmarks missing
+    from stats get zero-length bars.
+    """
+    if stats is None:
+        return None
+    yerr = np.zeros((2, len(benchmarks)))
+    for j, benchmark in enumerate(benchmarks):
+        s = stats.get(benchmark, {}).get(metric)
+        if s is None:
+            continue
+        yerr[0, j] = (s['mean'][abi] - s['ci_low'][abi]) * scale
+        yerr[1, j] = (s['ci_high'][abi] - s['mean'][abi]) * scale
+    return np.maximum(yerr, 0.0)
+
+
+def print_summary(data, metric):
+    print(f"{metric}: mean [CI] (CV%) per ABI")
+    for benchmark, metrics in data.items():
+        s = metrics[metric]
+        cells = [
+            f"{m:.3f} [{lo:.3f}, {hi:.3f}] ({100 * cv:.1f}%, n={n})"
+            for m, lo, hi, cv, n in zip(s['mean'], s['ci_low'], s['ci_high'], s['cv'], s['n'])
+        ]
+        print(f"  {benchmark}: " + " | ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a multi-round metric store')
+    parser.add_argument('store', help='Metric store, e.g. ../results/pmu-event-data.store')
+    parser.add_argument('--boot', type=int, default=2000, help='Bootstrap resamples (default: 2000)')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level (default: 0.95)')
+    parser.add_argument('--out-dir', default='.', help='Folder of the *-stats.txt files')
+    args = parser.parse_args()
+
+    store = open_store(args.store)
+    kwargs = {'n_boot': args.boot, 'confidence': args.confidence}
+    outputs = {
+        'pmu-event-stats.txt': event_stats(store, **kwargs),
+        'macroscopic-performance-stats.txt': rate_stats(store, **kwargs),
+        'top-down-analysis-stats.txt': topdown_stats(store, **kwargs),
+    }
+    for name, (stats, names) in outputs.items():
+        data = as_dict(store, names, stats)
+        write_stats(os.path.join(args.out_dir, name), data)
+        print(f"Wrote {name}: {len(data)} benchmarks x {len(names)} metrics over {len(store.rounds)} rounds")
+        if name == 'macroscopic-performance-stats.txt':
+            print_summary(data, 'Execution Time')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Local ABI check of the cross-compiled binaries.
+
+The `run/check-abi` scripts ran `file` on the board for every binary and
+grepped its output ('A64, version 1 (FreeBSD)', 'C64, CheriABI, version 1
+(SYSV)', 'pure-capability benchmark ABI'). This script reads the same facts
+from the ELF files on the development machine (elf_sections.ElfFile):
+
+    - e_machine: an AArch64 binary,
+    - EI_OSABI or the FreeBSD ABI tag of .note.tag: a CheriBSD binary,
+    - e_flags & EF_AARCH64_CHERI_PURECAP: C64 (purecap) rather than A64 (hybrid),
+    - the CHERI note of .note.cheri telling the Morello purecap benchmark ABI
+      (descriptor 1) from the CheriABI (descriptor 0).
+
+Every binary is classified as hybrid, purecap or purecap-benchmark in
+parallel, and compared with the ABI its path names (build-cheribsd-morello-<abi>,
+cheribsd-morello-<abi>-cheribuild_llvm, <name>-<abi>):
+
+    python3 check_abi.py [workloads] [--abis ...] [--benchmarks ...]
+    python3 check_abi.py --map LOCAL=REMOTE ...
+
+The first form checks the binaries elf_sections.py finds, plus every SPEC run
+folder; the second the executables of distribute.py mappings, which
+distribute.py itself checks before sending anything (--no-check-abi skips
+it). The exit status is 1 when a binary is missing or has another ABI.
+"""
+
+import argparse
+import glob
+import os
+import re
+import stat
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from build_cache import SPEC_LABEL, base_vars
+from build_scheduler import WORKLOADS, spec_benchmarks
+from distribute import walk
+from elf_sections import ELF_MAGIC, SHT_NOTE, ElfFile, discover
+from metric_store import ABIS
+
+EM_AARCH64 = 183
+ELFOSABI_FREEBSD = 9
+EF_AARCH64_CHERI_PURECAP = 0x10000
+NT_FREEBSD_ABI_TAG = 1
+NT_CHERI_MORELLO_PURECAP_BENCHMARK_ABI = 0x80000000
+
+# ABI named by a path, the last match wins
+PATH_ABI = re.compile(r'(?:cheribsd-morello-|-)(purecap-benchmark|purecap|hybrid)(?=$|[-./])')
+# Build folders whose executables are not shipped binaries
+SKIPPED = re.compile(r'(^|/)CMakeFiles(/|$)')
+
+
+def classify(path):
+    """(hybrid, purecap, purecap-benchmark or None, description as `file` would put it) of a binary."""
+    try:
+        with ElfFile(path) as elf:
+            if elf.machine != EM_AARCH64:
+                return None, f"not AArch64 (e_machine {elf.machine})"
+            notes = [note for section in elf.sections if section.type == SHT_NOTE for note in elf.notes(section)]
+            freebsd = elf.osabi == ELFOSABI_FREEBSD or any(
+                owner == 'FreeBSD' and kind == NT_FREEBSD_ABI_TAG for owner, kind, _ in notes)
+            if not freebsd:
+                return None, "AArch64, not a CheriBSD binary"
+            if not elf.flags & EF_AARCH64_CHERI_PURECAP:
+                return 'hybrid', "A64, version 1 (FreeBSD)"
+            benchmark = any(owner == 'CHERI' and kind == NT_CHERI_MORELLO_PURECAP_BENCHMARK_ABI
+                            and len(desc) >= 4 and int.from_bytes(desc[:4], 'little' if elf.order == '<' else 'big')
+                            for owner, kind, desc in notes)
+            return ('purecap-benchmark', "C64, pure-capability benchmark ABI") if benchmark else ('purecap', "C64, CheriABI")
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+
+def path_abi(path):
+    """The ABI a path names, or None."""
+    matches = PATH_ABI.findall(path)
+    return matches[-1] if matches else None
+
+
+def is_elf(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(4) == ELF_MAGIC
+    except OSError:
+        return False
+
+
+def spec_paths(bench, abi):
+    """Every binary of a SPEC benchmark built for abi: exe/ and the run folders of every size."""
+    spec = base_vars('speccpu')['_SPECCPU_PATH']
+    label = SPEC_LABEL.format(abi=abi)
+    return sorted(glob.glob(os.path.join(spec, bench, 'exe', f'*_base.{label}')) +
+                  glob.glob(os.path.join(spec, bench, 'run', f'run_base_*_{label}.0000', f'*_base.{label}')))
+
+
+def workload_binaries(workloads, abis, benchmarks=None):
+    """([(path, expected abi)], [missing (workload, name, abi)]) of the workloads' binaries."""
+    others = [workload for workload in workloads if workload != 'speccpu']
+    found, missing = discover(others, abis)
+    binaries = [(path, abi) for _, _, abi, path in found]
+    if 'speccpu' in workloads:
+        for bench in benchmarks or spec_benchmarks():
+            for abi in abis:
+                paths = spec_paths(bench, abi)
+                binaries += [(path, abi) for path in paths]
+                if not paths:
+                    missing.append(('speccpu', bench, abi))
+    return binaries, missing
+
+
+def mapped_binaries(files):
+    """[(local path, expected abi)] of the ELF executables of distribute.py's (local, remote, mode) files."""
+    binaries = []
+    for local, remote, mode in files:
+        abi = path_abi(remote)
+        if abi and mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) and not SKIPPED.search(remote) and is_elf(local):
+            binaries.append((local, abi))
+    return binaries
+
+
+def check(binaries, jobs=None, verbose=False):
+    """Classify the binaries in parallel, print the ones with another ABI and return how many there are."""
+    paths = [path for path, _ in binaries]
+    if jobs == 1 or len(paths) < 2:
+        results = [classify(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(classify, paths, chunksize=max(1, len(paths) // (4 * (jobs or os.cpu_count() or 1)))))
+    wrong = 0
+    for (path, expected), (abi, description) in zip(binaries, results):
+        if abi != expected:
+            wrong += 1
+            print(f"{path}: {description}, expected {expected}. It may suffer wrong abis.", file=sys.stderr)
+        elif verbose:
+            print(f"{path}: {description}")
+    return wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the ABI of the cross-compiled binaries locally')
+    parser.add_argument('workloads', nargs='*', help=f"Workloads (default: {' '.join(WORKLOADS)}, none with --map)")
+    parser.add_argument('--abis', nargs='+', default=list(ABIS), choices=ABIS, help='ABIs to check')
+    parser.add_argument('--benchmarks', nargs='+', help='SPEC benchmarks (default: all of speccpu/cross-compile/compile)')
+    parser.add_argument('--map', nargs='+', default=[], metavar='LOCAL=REMOTE', help='Check the binaries of distribute.py mappings')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Processes reading binaries')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Print the ABI of every binary')
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads {' '.join(sorted(unknown))}")
+
+    binaries, missing = [], []
+    if args.workloads or not args.map:
+        binaries, missing = workload_binaries(args.workloads or list(WORKLOADS), args.abis, args.benchmarks)
+    if args.map:
+        for mapping in args.map:
+            local, sep, remote = mapping.partition('=')
+            if not sep or not os.path.exists(local):
+                parser.error(f"not an existing LOCAL=REMOTE mapping: {mapping}")
+            binaries += mapped_binaries(walk(local, os.path.normpath(remote))[0])
+    for workload, name, abi in missing:
+        print(f"{workload}/{name} ({abi}): binary not found", file=sys.stderr)
+
+    wrong = check(binaries, args.jobs, args.verbose)
+    if wrong or missing:
+        sys.exit(f"\n{wrong} of {len(binaries)} binaries have a wrong ABI, {len(missing)} missing")
+    print(f"\nAll {len(binaries)} binaries have checked ABIs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Correlation matrices with permutation p-values and bootstrap intervals.
+
+`correlate` takes a (samples, variables) matrix, e.g. the benchmarks x
+metrics frame of one ABI in figure7, and computes the Pearson or Spearman
+correlation of every pair of variables at once, over the samples where both
+variables are defined (pairwise complete, as DataFrame.corr), optionally with
+
+    - a two-sided permutation p-value per pair: each resample permutes every
+      column independently, which breaks all pairings at once, and the
+      p-value is the share of resamples with |r| at least the observed one;
+    - a percentile bootstrap confidence interval per pair, resampling rows.
+
+Resamples are drawn BATCH at a time as one (batch, samples, variables) array
+and reduced with a single batched matrix product. Every batch has its own
+seed spawned from `seed`, so the results are the same whether the batches
+run in this process or in `jobs` worker processes.
+"""
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.stats import rankdata
+
+METHODS = ('pearson', 'spearman')
+
+# Resamples per batch, bounds memory to (batch x samples x variables)
+BATCH = 100
+
+
+def _ranks(x):
+    """Average ranks along the sample axis (-2), ties sharing their mean rank."""
+    return rankdata(x, axis=-2)
+
+
+def _corr(x):
+    """(..., samples, variables) -> (..., variables, variables) Pearson matrix, NaN for constant variables."""
+    x = x - x.mean(axis=-2, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = x / np.sqrt((x * x).sum(axis=-2, keepdims=True))
+    r = np.clip(np.matmul(np.swapaxes(x, -1, -2), x), -1.0, 1.0)
+    diagonal = np.arange(r.shape[-1])
+    r[..., diagonal, diagonal] = np.where(np.isnan(r[..., diagonal, diagonal]), np.nan, 1.0)
+    return r
+
+
+def _resample(task):
+    """
+    One batch of resamples: the number of permuted |r| >= |r observed| per
+    pair, or the bootstrap correlation matrices (float32, one per resample).
+    """
+    kind, x, r, method, size, seed = task
+    rng = np.random.default_rng(seed)
+    n, k = x.shape
+    if kind == 'permutation':
+        # x is already ranked for spearman, permuting ranks keeps them ranks
+        order = np.argsort(rng.random((size, n, k)), axis=1)
+        null = _corr(np.take_along_axis(np.broadcast_to(x, (size, n, k)), order, axis=1))
+        with np.errstate(invalid='ignore'):
+            return np.count_nonzero(np.abs(null) >= np.abs(r) - 1e-12, axis=0)
+    sample = x[rng.integers(0, n, size=(size, n))]
+    if method == 'spearman':
+        sample = _ranks(sample)
+    return _corr(sample).astype(np.float32)
+
+
+def _prepare(x, method, permutations, bootstrap, sequence):
+    """Correlation matrix of complete data x and the resampling tasks of its batches."""
+    ranked = _ranks(x) if method == 'spearman' else x
+    r = _corr(ranked)
+    tasks = []
+    sizes = {'permutation': permutations, 'bootstrap': bootstrap}
+    seeds = iter(sequence.spawn(sum(-(-size // BATCH) for size in sizes.values())))
+    for kind, total in sizes.items():
+        data = ranked if kind == 'permutation' else x
+        tasks += [(kind, data, r, method, min(BATCH, total - start), next(seeds)) for start in range(0, total, BATCH)]
+    return r, tasks
+
+
+def _summarize(r, tasks, results, permutations, bootstrap, confidence):
+    """p-values and bootstrap intervals of one correlation matrix from the results of its tasks."""
+    stats = {}
+    kinds = [task[0] for task in tasks]
+    if permutations:
+        exceed = sum(result for kind, result in zip(kinds, results) if kind == 'permutation')
+        stats['p'] = np.where(np.isnan(r), np.nan, (1.0 + exceed) / (1.0 + permutations))
+    if bootstrap:
+        boot = np.concatenate([result for kind, result in zip(kinds, results) if kind == 'bootstrap'])
+        alpha = (1.0 - confidence) / 2
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low, high = np.nanpercentile(boot, [100 * alpha, 100 * (1 - alpha)], axis=0)
+        stats['ci_low'] = np.where(np.isnan(r), np.nan, low)
+        stats['ci_high'] = np.where(np.isnan(r), np.nan, high)
+    return stats
+
+
+def correlate(x, method='pearson', permutations=0, bootstrap=0, confidence=0.95, seed=0, jobs=1):
+    """
+    Correlation matrix of the columns of x (samples, variables), pairwise
+    complete as DataFrame.corr: every pair uses the samples where both of its
+    variables are defined. Returns {'n': samples used per pair, 'r': matrix}
+    plus 'p' with permutations, and 'ci_low'/'ci_high' with bootstrap
+    resamples; pairs involving a constant column or fewer than 2 samples are NaN.
+
+    Pairs sharing the same samples are computed together, as one complete
+    matrix; without NaN there is a single group, resampled from `seed`.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown correlation method {method}")
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    k = x.shape[1]
+    groups = {}
+    for i in range(k):
+        for j in range(i, k):
+            rows = valid[:, i] & valid[:, j]
+            groups.setdefault(rows.tobytes(), (rows, []))[1].append((i, j))
+
+    root = np.random.SeedSequence(seed)
+    sequences = [root] if len(groups) == 1 else root.spawn(len(groups))
+    plans = []
+    for (rows, pairs), sequence in zip(groups.values(), sequences):
+        if rows.sum() < 2:
+            continue
+        columns = sorted({column for pair in pairs for column in pair})
+        r, tasks = _prepare(x[np.ix_(rows, columns)], method, permutations, bootstrap, sequence)
+        plans.append((pairs, columns, r, tasks))
+
+    tasks = [task for plan in plans for task in plan[3]]
+    if jobs > 1 and tasks:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_resample, tasks))
+    else:
+        results = [_resample(task) for task in tasks]
+
+    stats = {'n': valid.T.astype(np.int64) @ valid, 'r': np.full((k, k), np.nan)}
+    if permutations:
+        stats['p'] = np.full((k, k), np.nan)
+    if bootstrap:
+        stats['ci_low'], stats['ci_high'] = np.full((k, k), np.nan), np.full((k, k), np.nan)
+    offset = 0
+    for pairs, columns, r, group in plans:
+        part = {'r': r, **_summarize(r, group, results[offset:offset + len(group)], permutations, bootstrap, confidence)}
+        offset += len(group)
+        index = {column: position for position, column in enumerate(columns)}
+        a, b = np.array([index[i] for i, _ in pairs]), np.array([index[j] for _, j in pairs])
+        i, j = np.array([i for i, _ in pairs]), np.array([j for _, j in pairs])
+        for key, value in part.items():
+            stats[key][i, j] = stats[key][j, i] = value[a, b]
+    return stats
+
+
+def adjust(p):
+    """Benjamini-Hochberg adjusted p-values of a symmetric p-value matrix, over its distinct pairs."""
+    i, j = np.triu_indices(p.shape[0], 1)
+    flat = p[i, j]
+    valid = np.flatnonzero(~np.isnan(flat))
+    order = valid[np.argsort(flat[valid], kind='stable')]
+    scaled = flat[order] * len(order) / np.arange(1, len(order) + 1)
+    q = np.full(flat.shape, np.nan)
+    q[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    adjusted = np.full(p.shape, np.nan)
+    adjusted[i, j] = adjusted[j, i] = q
+    return adjusted
+
+
+def significant(stats, alpha=0.05):
+    """
+    Pairs whose correlation is significant: p < alpha with permutations, else
+    a bootstrap interval excluding 0, else every defined pair. The diagonal is
+    always kept.
+    """
+    r = stats['r']
+    with np.errstate(invalid='ignore'):
+        if 'p' in stats:
+            keep = stats['p'] < alpha
+        elif 'ci_low' in stats:
+            keep = (stats['ci_low'] > 0) | (stats['ci_high'] < 0)
+        else:
+            keep = ~np.isnan(r)
+    np.fill_diagonal(keep, True)
+    return keep
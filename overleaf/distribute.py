@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Content-addressed, incremental distribution of run folders to a board.
+
+`run/distribute` used to remove the run folders on the board and copy them
+again with scp -r, including the SPEC inputs that are identical across the
+three cheribsd-morello-* labels and the test/train/ref sizes. This script
+
+    python3 distribute.py <user@board> <remote root> LOCAL=REMOTE ...
+
+hashes every file of the LOCAL trees (SHA-256, cached by size and mtime),
+asks the board which contents it already holds, and sends only the missing
+ones, as one compressed tar over ssh. The board keeps one copy of every
+content in `<remote root>/.objects/<sha256>-<mode>`, and every distributed
+path is a hardlink to its object, so identical files of different ABIs and
+sizes share their blocks. `<remote root>/.distribute.manifest` records the
+distributed paths, so that a later run only relinks the paths whose content
+changed and removes the files that disappeared locally; anything else on the
+board (e.g. result folders) is left alone. After a one-benchmark rebuild,
+only the new binary is transferred.
+
+Linked files share their content, so a benchmark rewriting a distributed
+file in place changes it for every label. Objects modified after the last
+distribution (newer than the manifest) are therefore removed, sent again and
+relinked by the next one.
+
+Before hashing, the ABI of every executable whose REMOTE path names one
+(build-cheribsd-morello-<abi>, cheribsd-morello-<abi>-cheribuild_llvm) is
+checked locally by check_abi.py, and nothing is sent if one of them has
+another ABI.
+SSH options of the multiplexed connection are taken from $_SSH_MUX_OPTS
+(see run/base).
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import stat
+import subprocess
+import sys
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+OBJECTS = '.objects'
+MANIFEST = '.distribute.manifest'
+CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'morello-distribute.json')
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_cache():
+    try:
+        with open(CACHE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    os.makedirs(os.path.dirname(CACHE), exist_ok=True)
+    with open(CACHE + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(CACHE + '.tmp', CACHE)
+
+
+def walk(local, remote):
+    """([(local file, remote path, mode)], [remote directories]) of one LOCAL=REMOTE mapping."""
+    if os.path.isfile(local):
+        return [(local, remote, stat.S_IMODE(os.stat(local).st_mode))], [os.path.dirname(remote) or '.']
+    files, dirs = [], []
+    for folder, subdirs, names in os.walk(local, followlinks=True):
+        subdirs.sort()
+        relative = os.path.relpath(folder, local)
+        target = os.path.normpath(os.path.join(remote, relative))
+        dirs.append(target)
+        for name in sorted(names):
+            path = os.path.join(folder, name)
+            files.append((path, os.path.join(target, name), stat.S_IMODE(os.stat(path).st_mode)))
+    return files, dirs
+
+
+def hash_files(paths, jobs=None):
+    """{file: sha256}, reusing the cached digests of files with the same size and mtime."""
+    cache = load_cache()
+    digests, todo = {}, []
+    for path in paths:
+        info = os.stat(path)
+        key = os.path.abspath(path)
+        entry = cache.get(key)
+        if entry and entry[0] == info.st_size and entry[1] == info.st_mtime_ns:
+            digests[path] = entry[2]
+        else:
+            todo.append((path, key, info))
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for (path, key, info), digest in zip(todo, pool.map(sha256, [path for path, _, _ in todo])):
+            digests[path] = digest
+            cache[key] = [info.st_size, info.st_mtime_ns, digest]
+    if todo:
+        save_cache(cache)
+    return digests
+
+
+class Board:
+    """ssh access to the remote root of a board."""
+
+    def __init__(self, host, root):
+        self.host = host
+        self.root = root
+        self.ssh = ['ssh'] + shlex.split(os.environ.get('_SSH_MUX_OPTS', '')) + [host]
+
+    def state(self):
+        """
+        (objects on the board, objects written in place since the last
+        distribution, {remote path: object} of the last distribution).
+        """
+        root = shlex.quote(self.root)
+        command = (f"mkdir -p {root}/{OBJECTS} && ls {root}/{OBJECTS} && echo '--' && "
+                   f"if [ -f {root}/{MANIFEST} ]; then "
+                   f"find {root}/{OBJECTS} -type f -newer {root}/{MANIFEST} && echo '--' && cat {root}/{MANIFEST}; "
+                   f"else echo '--'; fi")
+        output = subprocess.run(self.ssh + [command], stdout=subprocess.PIPE, check=True, text=True).stdout
+        objects, modified, manifest = output.split('--\n', 2)
+        entries = {}
+        for line in manifest.splitlines():
+            obj, _, path = line.partition(' ')
+            if path:
+                entries[path] = obj
+        return set(objects.split()), {os.path.basename(path) for path in modified.split()}, entries
+
+    def send(self, objects, replaced=()):
+        """
+        Write {object: local file} into the object store, as one gzip-compressed
+        tar. The replaced objects (modified in place) are removed first, so that
+        they get fresh inodes instead of rewriting the linked ones.
+        """
+        store = f"{shlex.quote(self.root)}/{OBJECTS}"
+        command = f"tar -xzf - -C {store}"
+        if replaced:
+            command = f"cd {store} && rm -f {' '.join(sorted(replaced))} && {command}"
+        with subprocess.Popen(self.ssh + [command], stdin=subprocess.PIPE) as proc:
+            with gzip.GzipFile(fileobj=proc.stdin, mode='wb', compresslevel=1) as gz, \
+                    tarfile.open(fileobj=gz, mode='w|') as tar:
+                for name, path in sorted(objects.items()):
+                    tar.add(path, arcname=name, recursive=False)
+            proc.stdin.close()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, command)
+
+    def run(self, script):
+        subprocess.run(self.ssh + ['/bin/sh -s'], input=script, text=True, check=True)
+
+
+def link_script(root, dirs, paths, previous, removed, manifest, modified=()):
+    """Shell script linking the distributed paths to their objects and writing the new manifest."""
+    lines = [f"cd {shlex.quote(root)} || exit 1"]
+    lines += [f"rm -f {shlex.quote(path)}" for path in sorted(removed)]
+    lines += [f"mkdir -p {' '.join(shlex.quote(d) for d in sorted(dirs)[i:i + 64])}" for i in range(0, len(dirs), 64)]
+    for path, obj in sorted(paths.items()):
+        source, target = shlex.quote(f"{OBJECTS}/{obj}"), shlex.quote(path)
+        if previous.get(path) == obj and obj not in modified:
+            lines.append(f"[ -e {target} ] || ln {source} {target}")
+        else:
+            lines.append(f"ln -f {source} {target}")
+    lines.append(f"cat > {MANIFEST}.tmp <<'MANIFEST'")
+    lines += [f"{obj} {path}" for path, obj in sorted(manifest.items())]
+    lines.append("MANIFEST")
+    lines.append(f"mv {MANIFEST}.tmp {MANIFEST}")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send run folders to a board, transferring only new content')
+    parser.add_argument('host', help='user@board')
+    parser.add_argument('root', help='Remote root the REMOTE paths are relative to')
+    parser.add_argument('mappings', nargs='+', help='LOCAL=REMOTE file or folder (REMOTE relative to root)')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Parallel hashing threads')
+    parser.add_argument('--prune', action='store_true', help='Remove objects no longer linked from the board')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be sent')
+    parser.add_argument('--no-check-abi', action='store_true', help='Send binaries without checking their ABI (check_abi.py)')
+    args = parser.parse_args()
+
+    files, dirs = [], []
+    prefixes = []
+    for mapping in args.mappings:
+        local, sep, remote = mapping.partition('=')
+        remote = os.path.normpath(remote)
+        if not sep or not os.path.exists(local):
+            parser.error(f"not an existing LOCAL=REMOTE mapping: {mapping}")
+        if os.path.isabs(remote) or remote.split(os.sep)[0] == '..':
+            parser.error(f"REMOTE must be relative to the remote root: {mapping}")
+        mapped_files, mapped_dirs = walk(local, remote)
+        files += mapped_files
+        dirs += mapped_dirs
+        prefixes.append(remote)
+
+    if not args.no_check_abi:
+        # a mis-built binary stops the distribution before anything is hashed or sent
+        from check_abi import check, mapped_binaries
+        binaries = mapped_binaries(files)
+        if check(binaries, args.jobs):
+            sys.exit("Not distributing binaries with a wrong ABI (--no-check-abi sends them anyway)")
+    digests = hash_files([local for local, _, _ in files], args.jobs)
+    paths, contents = {}, {}
+    for local, remote, mode in files:
+        obj = f"{digests[local]}-{mode:o}"
+        paths[remote] = obj
+        contents.setdefault(obj, local)
+
+    board = Board(args.host, args.root)
+    present, modified, previous = board.state()
+    missing = {obj: local for obj, local in contents.items() if obj not in present or obj in modified}
+    removed = {path for path in previous if path not in paths
+               and any(path == prefix or path.startswith(prefix + '/') for prefix in prefixes)}
+    changed = sum(previous.get(path) != obj or obj in modified for path, obj in paths.items())
+    size = sum(os.path.getsize(local) for local in missing.values())
+    print(f"{len(paths)} files, {len(contents)} distinct contents: sending {len(missing)} "
+          f"({size / 2**20:.1f} MiB), relinking {changed}, removing {len(removed)}", file=sys.stderr)
+    if args.dry_run:
+        return
+
+    if missing:
+        board.send(missing, modified & set(missing))
+    manifest = {path: obj for path, obj in {**previous, **paths}.items() if path not in removed}
+    board.run(link_script(args.root, set(dirs), paths, previous, removed, manifest, modified))
+    if args.prune:
+        unused = sorted(present - set(manifest.values()))
+        if unused:
+            board.run(f"cd {shlex.quote(args.root)}/{OBJECTS} || exit 1\n" +
+                      "".join(f"rm -f {obj}\n" for obj in unused))
+        print(f"Pruned {len(unused)} unused objects", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Section sizes of the cross-compiled binaries, read locally.
+
+`speccpu/run/readelf` runs `readelf -W -S | grep | awk` on the board for
+every (benchmark, label, size) and leaves text files that
+figure2-macroscopic-binary-size.py parses again. This module reads the ELF64
+section header table of the binaries on the development machine instead:
+every binary is memory-mapped, its section headers are unpacked in place
+with struct and only the section names are copied out of the mapping, so a
+binary costs a few page faults whatever its size. The binaries of all
+workloads and ABIs are read in parallel, in about a second:
+
+    python3 elf_sections.py [workloads] [--abis ...] [--benchmarks ...]
+
+prints the size of the main sections of every binary relative to its hybrid
+build. --tsv writes every (workload, benchmark, ABI, section, bytes) row, and
+--readelf DIR writes the spec_run_readelf_<bench>_<size>_<label> files of
+`speccpu/run/readelf` for the SPEC binaries.
+
+Binaries are found where the builds leave them: the exe/ folder of the SPEC
+benchmarks (<bench>/run/run_base_<size>_<label>.0000 as a fallback), and
+build-cheribsd-morello-<abi>/[bin/]<name> for the BINARY_NAMES of the other
+workloads' run/base (or their binaries/<name>-<abi> copy). Like the board
+script, only the sections matched by its SECTIONS pattern are kept, unless
+--all is given.
+"""
+
+import argparse
+import csv
+import glob
+import mmap
+import os
+import re
+import struct
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from build_cache import PROJECT_ROOT, SOURCE_VARS, SPEC_LABEL, base_vars
+from build_scheduler import WORKLOADS, spec_benchmarks
+from metric_store import ABIS
+
+# Sections kept by speccpu/run/readelf (grep -E, unanchored)
+SECTIONS = re.compile(
+    r'\.bss|\.comment|\.data|\.data\.rel\.ro|\.debug_abbrev|\.debug_aranges|\.debug_info|\.debug_line|\.debug_loc|'
+    r'\.debug_ranges|\.debug_str|\.dynamic|\.dynstr|\.dynsym|\.eh_frame|\.eh_frame_hdr|\.fini|\.fini_array|\.gnu\.hash|'
+    r'\.gnu\.version|\.gnu\.version_r|\.got|\.got\.plt|\.hash|\.init|\.init_array|\.interp|\.jcr|\.note\.cheri|'
+    r'\.note\.tag|\.plt|\.rela\.dyn|\.rela\.plt|\.rodata|\.shstrtab|\.strtab|\.symtab|\.text')
+# Sections printed by the command line, relative to hybrid
+SUMMARY = ('.text', '.rodata', '.data', '.data.rel.ro', '.got', '.rela.dyn', 'total')
+# Tools SPEC builds next to some benchmarks (525, 538, 638)
+HELPERS = re.compile(r'^(imagevalidate|ldecod)_')
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+SHN_XINDEX = 0xffff
+SHT_NOTE = 7
+SHT_NOBITS = 8
+
+# e_type .. e_shstrndx, after the 16 bytes of e_ident
+HEADER = 'HHIQQQIHHHHHH'
+SECTION_HEADER = 'IIQQQQIIQQ'
+
+Section = namedtuple('Section', 'name type flags addr offset size link info align entsize')
+
+
+class ElfFile:
+    """
+    Read-only, memory-mapped ELF64 file. The header fields are attributes
+    (type, machine, flags, osabi, abiversion, ...) and `sections` lists the
+    section headers in file order, with their names resolved. check_abi.py
+    reads the header flags and notes of the same files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < 64:
+                raise ValueError(f"{path}: not an ELF64 file")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read()
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise ValueError(f"{path}: {e}") from None
+
+    def _read(self):
+        ident = self.map[:16]
+        if ident[:4] != ELF_MAGIC or ident[4] != ELFCLASS64:
+            raise ValueError("not an ELF64 file")
+        self.order = '<' if ident[5] == ELFDATA2LSB else '>'
+        self.osabi, self.abiversion = ident[7], ident[8]
+        (self.type, self.machine, self.version, self.entry, self.phoff, shoff, self.flags, _,
+         self.phentsize, self.phnum, shentsize, shnum, shstrndx) = struct.unpack_from(self.order + HEADER, self.map, 16)
+        self.sections = []
+        if not shoff:
+            return
+        if shentsize != struct.calcsize(SECTION_HEADER):
+            raise ValueError(f"unexpected section header size {shentsize}")
+        first = struct.unpack_from(self.order + SECTION_HEADER, self.map, shoff)
+        # more than 0xff00 sections: the counts are in the null section header
+        shnum = shnum or first[5]
+        shstrndx = first[6] if shstrndx == SHN_XINDEX else shstrndx
+        if shoff + shnum * shentsize > len(self.map):
+            raise ValueError("truncated section header table")
+        with memoryview(self.map) as view:
+            headers = list(struct.iter_unpack(self.order + SECTION_HEADER, view[shoff:shoff + shnum * shentsize]))
+        names = headers[shstrndx][4] if shstrndx < shnum else None
+        self.sections = [Section(self._name(names, header[0]), *header[1:]) for header in headers]
+
+    def _name(self, table, offset):
+        if table is None:
+            return ''
+        start = table + offset
+        end = self.map.find(b'\0', start)
+        return self.map[start:end if end >= 0 else len(self.map)].decode('ascii', 'replace')
+
+    def section(self, name):
+        """The first section called name, or None."""
+        return next((section for section in self.sections if section.name == name), None)
+
+    def data(self, section):
+        """The bytes of a section (empty for NOBITS sections such as .bss)."""
+        if section.type == SHT_NOBITS:
+            return b''
+        return self.map[section.offset:section.offset + section.size]
+
+    def notes(self, section):
+        """[(owner, type, descriptor bytes)] of a SHT_NOTE section."""
+        data, notes, offset = self.data(section), [], 0
+        align = 8 if section.align == 8 else 4
+        while offset + 12 <= len(data):
+            namesz, descsz, kind = struct.unpack_from(self.order + 'III', data, offset)
+            offset += 12
+            name = data[offset:offset + namesz].rstrip(b'\0').decode('ascii', 'replace')
+            offset += -(-namesz // align) * align
+            notes.append((name, kind, data[offset:offset + descsz]))
+            offset += -(-descsz // align) * align
+        return notes
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def section_sizes(path, all_sections=False):
+    """{section name: bytes} of a binary, as parse_readelf_data returns them from the board's files."""
+    sizes = {}
+    with ElfFile(path) as elf:
+        for section in elf.sections[1:]:
+            if section.name and (all_sections or SECTIONS.search(section.name)):
+                sizes[section.name] = sizes.get(section.name, 0) + section.size
+    return sizes
+
+
+def spec_binaries(bench, abi, size='train'):
+    """The binaries of a SPEC benchmark built for abi, without SPEC's helper tools."""
+    spec = base_vars('speccpu')['_SPECCPU_PATH']
+    label = SPEC_LABEL.format(abi=abi)
+    for folder in (os.path.join(spec, bench, 'exe'), os.path.join(spec, bench, 'run', f'run_base_{size}_{label}.0000')):
+        paths = [path for path in sorted(glob.glob(os.path.join(folder, f'*_base.{label}')))
+                 if not HELPERS.match(os.path.basename(path))]
+        if paths:
+            return paths
+    return []
+
+
+def binary_names(workload):
+    """The BINARY_NAMES array of a workload's run/base."""
+    with open(os.path.join(PROJECT_ROOT, workload, 'run', 'base'), 'r') as f:
+        match = re.search(r'^BINARY_NAMES=\((.*?)\)', f.read(), re.M | re.S)
+    return re.findall(r'"([^"]+)"', match.group(1)) if match else []
+
+
+def discover(workloads, abis, benchmarks=None, size='train'):
+    """(workload, benchmark, abi, path) of every binary found, and the (workload, benchmark, abi) missing."""
+    found, missing = [], []
+    for workload in workloads:
+        if workload == 'speccpu':
+            for bench in benchmarks or spec_benchmarks():
+                for abi in abis:
+                    paths = spec_binaries(bench, abi, size)
+                    if not paths:
+                        missing.append((workload, bench, abi))
+                    for path in paths:
+                        name = bench if len(paths) == 1 else f"{bench}:{os.path.basename(path).split('_base.')[0]}"
+                        found.append((workload, name, abi, path))
+            continue
+        tree = base_vars(workload)[SOURCE_VARS[workload]]
+        for name in binary_names(workload):
+            for abi in abis:
+                build = os.path.join(tree, f'build-cheribsd-morello-{abi}')
+                # sqlite-bench keeps prebuilt binaries/<name>-<abi> in the repository
+                candidates = (os.path.join(build, name), os.path.join(build, 'bin', name),
+                              os.path.join(PROJECT_ROOT, workload, 'binaries', f'{name}-{abi}'))
+                path = next((path for path in candidates if os.path.isfile(path)), None)
+                if path:
+                    found.append((workload, name, abi, path))
+                else:
+                    missing.append((workload, name, abi))
+    return found, missing
+
+
+def _read(task):
+    path, all_sections = task
+    try:
+        return section_sizes(path, all_sections), None
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+
+def read_all(paths, all_sections=False, jobs=None):
+    """[(sizes or None, error or None)] of the binaries, read in `jobs` processes."""
+    tasks = [(path, all_sections) for path in paths]
+    if jobs == 1 or len(tasks) < 2:
+        return [_read(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_read, tasks, chunksize=max(1, len(tasks) // (4 * (jobs or os.cpu_count() or 1)))))
+
+
+def binary_sections(benchmarks, size='train', abis=ABIS, jobs=None):
+    """
+    {(benchmark, abi): {section: bytes}} of SPEC benchmarks, read from the
+    local binaries, for figure2-macroscopic-binary-size.py. A missing or
+    unreadable binary raises FileNotFoundError.
+    """
+    found, missing = discover(['speccpu'], abis, benchmarks, size)
+    if missing:
+        raise FileNotFoundError(f"no binary of {', '.join(f'{bench} ({abi})' for _, bench, abi in missing)}")
+    sections = {}
+    for (_, bench, abi, path), (sizes, error) in zip(found, read_all([entry[3] for entry in found], jobs=jobs)):
+        if error:
+            raise FileNotFoundError(error)
+        sections[(bench, abi)] = sizes
+    return sections
+
+
+def summary(sizes):
+    """SUMMARY entries of a {section: bytes} dict, .got* summed."""
+    row = {name: sizes.get(name, 0) for name in SUMMARY}
+    row['.got'] += sizes.get('.got.plt', 0)
+    row['total'] = sum(sizes.values())
+    return row
+
+
+def print_summary(results, abis):
+    by_binary = {}
+    for workload, name, abi, sizes in results:
+        by_binary.setdefault((workload, name), {})[abi] = summary(sizes)
+    base = abis[0]
+    header = ''.join(f"{section:>14}" for section in SUMMARY)
+    print(f"{'binary':<32} {'abi':<18}{header}")
+    for (workload, name), rows in by_binary.items():
+        for abi in abis:
+            if abi not in rows:
+                continue
+            cells = []
+            for section in SUMMARY:
+                value, reference = rows[abi][section], rows.get(base, {}).get(section, 0)
+                if abi == base or not reference:
+                    cells.append(f"{value:>14,}")
+                else:
+                    cells.append(f"{value / reference:>13.2f}x")
+            print(f"{workload + '/' + name:<32} {abi:<18}{''.join(cells)}")
+    if len(abis) > 1:
+        print(f"\n{base} in bytes, other ABIs relative to {base}")
+
+
+def write_readelf(folder, results, size):
+    """The files of speccpu/run/readelf, one `<section> <bytes>` line per section."""
+    os.makedirs(folder, exist_ok=True)
+    for workload, name, abi, sizes in results:
+        if workload != 'speccpu':
+            continue
+        label = SPEC_LABEL.format(abi=abi)
+        with open(os.path.join(folder, f'spec_run_readelf_{name}_{size}_{label}'), 'w') as f:
+            f.writelines(f"{section} {value}\n" for section, value in sizes.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Section sizes of the cross-compiled binaries, read locally')
+    parser.add_argument('workloads', nargs='*', default=list(WORKLOADS), help=f"Workloads (default: {' '.join(WORKLOADS)})")
+    parser.add_argument('--abis', nargs='+', default=list(ABIS), choices=ABIS, help='ABIs, the first one is the reference')
+    parser.add_argument('--benchmarks', nargs='+', help='SPEC benchmarks (default: all of speccpu/cross-compile/compile)')
+    parser.add_argument('--size', default='train', help='Run folder size of SPEC binaries missing from exe/')
+    parser.add_argument('--all', action='store_true', help='Keep every section, not only those of speccpu/run/readelf')
+    parser.add_argument('--tsv', help='Write every (workload, benchmark, abi, section, bytes) row to this file')
+    parser.add_argument('--readelf', metavar='DIR', help='Write the spec_run_readelf_* files of the SPEC binaries to DIR')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Processes reading binaries')
+    args = parser.parse_args()
+
+    found, missing = discover(args.workloads, args.abis, args.benchmarks, args.size)
+    for workload, name, abi in missing:
+        print(f"{workload}/{name} ({abi}): binary not found", file=sys.stderr)
+    results = []
+    for (workload, name, abi, path), (sizes, error) in zip(found, read_all([entry[3] for entry in found], args.all, args.jobs)):
+        if error:
+            print(error, file=sys.stderr)
+            continue
+        results.append((workload, name, abi, sizes))
+    if not results:
+        sys.exit("No binary to read")
+
+    print_summary(results, args.abis)
+    if args.tsv:
+        with open(args.tsv, 'w', newline='') as f:
+            writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+            writer.writerow(['workload', 'benchmark', 'abi', 'section', 'bytes'])
+            for workload, name, abi, sizes in results:
+                writer.writerows([workload, name, abi, section, value] for section, value in sizes.items())
+    if args.readelf:
+        write_readelf(args.readelf, results, args.size)
+
+
+if __name__ == '__main__':
+    main()
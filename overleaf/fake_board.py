@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Morello board, used by `campaign_scheduler.py --fake`.
+
+    fake_board.py ssh HOST COMMAND...   runs COMMAND on this machine
+    fake_board.py scp HOST:PATH... DIR  copies the (glob) paths into DIR
+    fake_board.py time COMMAND...       runs COMMAND, times it as FreeBSD's time
+
+Every host shares the local file system, so --run-dir should point at a
+local copy of the board folders (with _launch_raw etc.), and the workload
+commands must exist here (pmcstat can be a script on PATH). Commands run
+over ssh find the `time` above first on PATH, so that pmcstat.timing.out has
+the `N real N user N sys` line pmcstat_ingest.py reads, whether or not the
+host has a /usr/bin/time. Failures can be injected to exercise retries:
+
+    FAKE_BOARD_DOWN=host,...    every ssh to these hosts fails
+    FAKE_BOARD_FLAKY=0.2        every ssh fails with this probability
+"""
+
+import glob
+import os
+import random
+import resource
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def ssh(host, command):
+    if host in os.environ.get('FAKE_BOARD_DOWN', '').split(','):
+        print(f"ssh: connect to host {host}: Connection refused", file=sys.stderr)
+        return 255
+    if random.random() < float(os.environ.get('FAKE_BOARD_FLAKY', 0)):
+        print(f"ssh: {host}: Connection reset by peer", file=sys.stderr)
+        return 255
+    with tempfile.TemporaryDirectory(prefix='fake-board-') as shims:
+        shim = os.path.join(shims, 'time')
+        with open(shim, 'w') as f:
+            f.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} time "$@"\n')
+        os.chmod(shim, 0o755)
+        env = dict(os.environ, PATH=shims + os.pathsep + os.environ.get('PATH', ''))
+        return subprocess.run(command, env=env).returncode
+
+
+def time_command(command):
+    """Run command and report its real, user and sys times on stderr as FreeBSD's time(1)."""
+    start = time.monotonic()
+    status = subprocess.run(command).returncode
+    real = time.monotonic() - start
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print(f"{real:10.2f} real {usage.ru_utime:10.2f} user {usage.ru_stime:10.2f} sys", file=sys.stderr)
+    return status if status >= 0 else 128 - status
+
+
+def scp(sources, target):
+    status = 0
+    for source in sources:
+        paths = glob.glob(source.split(':', 1)[-1])
+        if not paths:
+            print(f"scp: {source}: No such file or directory", file=sys.stderr)
+            status = 1
+        for path in paths:
+            shutil.copy2(path, target)
+    return status
+
+
+def main():
+    if sys.argv[1:2] == ['time'] and len(sys.argv) > 2:
+        sys.exit(time_command(sys.argv[2:]))
+    if len(sys.argv) < 4 or sys.argv[1] not in ('ssh', 'scp'):
+        sys.exit(f"usage: {sys.argv[0]} ssh HOST COMMAND... | scp HOST:PATH... DIR | time COMMAND...")
+    if sys.argv[1] == 'ssh':
+        sys.exit(ssh(sys.argv[2], sys.argv[3:]))
+    sys.exit(scp(sys.argv[2:-1], sys.argv[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.patches import Patch
 from matplotlib.lines import Line2D
+from campaign_stats import error_bars, load_stats
 
 # Example data structure (replace with your actual data)
 benchmarks = [
@@ -11,6 +12,13 @@ benchmarks = [
 metrics = [
     'Execution Time', 'IPC', 'Branch MR', 'L1I MR', 'L1D MR', 'L2D MR'
 ]
+# The same benchmarks as labelled in macroscopic-performance-stats.txt
+benchmark_keys = [
+    '510.parest_r', '519.lbm_r', '520.omnetpp_r', '523.xalancbmk_r', '531.deepsjeng_r',
+    '541.leela_r', '544.nab_r', '557.xz_r', 'LLaMA.cpp-inference', 'LLaMA.cpp-matmult', 'SQLite-Bench', 'QuickJS'
+]
+# Multi-round confidence intervals (campaign_stats.py), drawn as error bars when present
+stats = load_stats('./macroscopic-performance-stats.txt')
 # Fill this with your actual data, each entry: [Hybrid, Purecap Benchmark, Purecap ABIs]
 data = {
     'Execution Time': [
@@ -104,6 +112,13 @@ for idx, metric in enumerate(metrics):
         # ax.bar(x + (i-1)*width, norm_vals[:, i], width, label=labels[i] if idx == 0 else "", color=colors[i], alpha=0.7)
         area = (40 * norm_vals[:, i])
         ax.scatter(x + (i-1)*width, norm_vals[:, i], s=area,  color=colors[i], alpha=0.7)
+        if stats is not None:
+            # Interval of the mean, normalized to the Hybrid mean like the points
+            hybrid_mean = np.array([stats.get(k, {}).get(metric, {'mean': (0,)})['mean'][0] for k in benchmark_keys])
+            yerr = error_bars(stats, benchmark_keys, metric, i)
+            yerr = np.divide(yerr, hybrid_mean, out=np.zeros_like(yerr), where=hybrid_mean > 0)
+            yerr[:, norm_vals[:, i] == 0] = 0
+            ax.errorbar(x + (i-1)*width, norm_vals[:, i], yerr=yerr, fmt='none', ecolor=colors[i], capsize=2)
         # print(norm_vals[:, i])
         
     ax.set_ylabel(metric.replace('Execution', 'Exec').replace(' ', '\n'), fontsize=20, rotation=0, ha='right', position=(0, -0.2), fontweight='bold')
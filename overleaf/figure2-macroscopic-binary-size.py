@@ -12,8 +12,15 @@ Compares binary sections across different ABIs (hybrid, purecap-benchmark, purec
 .data.rel.ro
 .rela.dyn   Relocations for data and non-PLT code   Global variables, function pointers
 Others
+
+Section sizes are read from the files of speccpu/run/readelf in ../results/readelf,
+or, with --elf, from the cross-compiled binaries on this machine (elf_sections.py):
+
+    python3 figure2-macroscopic-binary-size.py [--elf [--size train] [-j N]]
 """
 
+import argparse
+
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -75,15 +82,31 @@ def classify_sections(sections):
     
     return categories
 
+parser = argparse.ArgumentParser(description='Binary section comparison across ABIs')
+parser.add_argument('--elf', action='store_true', help='Read the sections of the local cross-compiled binaries instead of ../results/readelf')
+parser.add_argument('--size', default='train', help='Size of the readelf files and run folders')
+parser.add_argument('--jobs', '-j', type=int, help='Processes reading binaries with --elf')
+args = parser.parse_args()
+
+benchmark_names = ['510.parest_r', '519.lbm_r', '520.omnetpp_r', '523.xalancbmk_r', '531.deepsjeng_r', '541.leela_r', '544.nab_r', '557.xz_r']
+if args.elf:
+    from elf_sections import binary_sections
+    binary_data = binary_sections(benchmark_names, args.size, jobs=args.jobs)
+
 all_hybrid_values_normalized = []
 all_purecap_benchmark_values_normalized = []
 all_purecap_values_normalized = []
-for benchmark_name in ['510.parest_r', '519.lbm_r', '520.omnetpp_r', '523.xalancbmk_r', '531.deepsjeng_r', '541.leela_r', '544.nab_r', '557.xz_r']:
+for benchmark_name in benchmark_names:
     
-    # Parse data from the three files
-    hybrid_data = parse_readelf_data(f'../results/readelf/spec_run_readelf_{benchmark_name}_train_cheribsd-morello-hybrid-cheribuild_llvm')
-    purecap_benchmark_data = parse_readelf_data(f'../results/readelf/spec_run_readelf_{benchmark_name}_train_cheribsd-morello-purecap-benchmark-cheribuild_llvm')
-    purecap_data = parse_readelf_data(f'../results/readelf/spec_run_readelf_{benchmark_name}_train_cheribsd-morello-purecap-cheribuild_llvm')
+    # Parse data from the three files, or take it from the binaries
+    if args.elf:
+        hybrid_data = binary_data[(benchmark_name, 'hybrid')]
+        purecap_benchmark_data = binary_data[(benchmark_name, 'purecap-benchmark')]
+        purecap_data = binary_data[(benchmark_name, 'purecap')]
+    else:
+        hybrid_data = parse_readelf_data(f'../results/readelf/spec_run_readelf_{benchmark_name}_{args.size}_cheribsd-morello-hybrid-cheribuild_llvm')
+        purecap_benchmark_data = parse_readelf_data(f'../results/readelf/spec_run_readelf_{benchmark_name}_{args.size}_cheribsd-morello-purecap-benchmark-cheribuild_llvm')
+        purecap_data = parse_readelf_data(f'../results/readelf/spec_run_readelf_{benchmark_name}_{args.size}_cheribsd-morello-purecap-cheribuild_llvm')
 
     # Classify sections
     hybrid_categories = classify_sections(hybrid_data)
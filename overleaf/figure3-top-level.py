@@ -1,13 +1,12 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from ast import literal_eval
+from metric_store import load_dict
+from campaign_stats import error_bars, load_stats
 
-def read_data_as_dict(file_path):
-    with open(file_path, "r") as f:
-        content = f.read()
-        return literal_eval(content)
-
-data = read_data_as_dict("./top-down-analysis-data.txt")
+data = load_dict("./top-down-analysis-data.txt")
+# Multi-round confidence intervals (campaign_stats.py), drawn as error bars when present
+stats = load_stats("./top-down-analysis-stats.txt")
+error_kw = dict(ecolor='black', elinewidth=1, capsize=2)
 
 # Example data (replace with your actual data)
 benchmarks = list(data.keys())
@@ -47,16 +46,20 @@ for i, group in enumerate(groups):
     # Stacked bars for each group
     bottom = np.zeros(n)
     ax1.bar(ind + offset, retiring[i], bar_width, bottom=bottom, 
-            label=f'{group} Retiring' if i == 0 else "", color=colors['retiring'][i])
+            label=f'{group} Retiring' if i == 0 else "", color=colors['retiring'][i],
+            yerr=error_bars(stats, benchmarks, 'Retiring', i, 100), error_kw=error_kw)
     bottom += retiring[i]
     ax1.bar(ind + offset, bad_spec[i], bar_width, bottom=bottom,
-            label=f'{group} Bad Spec' if i == 0 else "", color=colors['bad_spec'][i])
+            label=f'{group} Bad Spec' if i == 0 else "", color=colors['bad_spec'][i],
+            yerr=error_bars(stats, benchmarks, 'Bad_Speculation', i, 100), error_kw=error_kw)
     bottom += bad_spec[i]
     ax1.bar(ind + offset, frontend[i], bar_width, bottom=bottom,
-            label=f'{group} Frontend' if i == 0 else "", color=colors['frontend'][i])
+            label=f'{group} Frontend' if i == 0 else "", color=colors['frontend'][i],
+            yerr=error_bars(stats, benchmarks, 'Frontend_Bound', i, 100), error_kw=error_kw)
     bottom += frontend[i]
     ax1.bar(ind + offset, backend[i], bar_width, bottom=bottom,
-            label=f'{group} Backend' if i == 0 else "", color=colors['backend'][i])
+            label=f'{group} Backend' if i == 0 else "", color=colors['backend'][i],
+            yerr=error_bars(stats, benchmarks, 'Backend_Bound', i, 100), error_kw=error_kw)
 
 # Add group labels to x-axis
 group_positions = ind + bar_width * (n_groups - 1) / 2
@@ -96,6 +99,7 @@ handles.extend([
 ax2 = ax1.twinx()
 
 # Plot IPC lines within each group
+ipc_err = [error_bars(stats, list(data.keys()), 'IPC', i) for i in range(n_groups)]
 for j, benchmark in enumerate(benchmarks):
     # First plot the points
     x_positions = []
@@ -110,6 +114,8 @@ for j, benchmark in enumerate(benchmarks):
         # Plot individual points
         ax2.plot(x_pos, ipc[i][j], color='#5dade2', marker='^', linestyle='None', markersize=10,
                 label=f'IPC' if j == 0 and i == 0 else "")
+        if ipc_err[i] is not None:
+            ax2.errorbar(x_pos, ipc[i][j], yerr=ipc_err[i][:, j:j + 1], color='#5dade2', capsize=3)
     
     # Then connect the points with a line
     ax2.plot(x_positions, y_values, color='#5dade2', linestyle='solid', linewidth=2)
@@ -1,13 +1,12 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from ast import literal_eval
+from metric_store import load_dict
+from campaign_stats import error_bars, load_stats
 
-def read_data_as_dict(file_path):
-    with open(file_path, "r") as f:
-        content = f.read()
-        return literal_eval(content)
-
-data = read_data_as_dict("./top-down-analysis-data.txt")
+data = load_dict("./top-down-analysis-data.txt")
+# Multi-round confidence intervals (campaign_stats.py), drawn as error bars when present
+stats = load_stats("./top-down-analysis-stats.txt")
+error_kw = dict(ecolor='black', elinewidth=1, capsize=2)
 
 benchmarks = list(data.keys())
 
@@ -30,16 +29,22 @@ fig, ax = plt.subplots(figsize=(16, 6))
 
 
 # Plot Hybrid
-p1 = ax.bar(x - width, core_bound_1, width, label='Core Bound (Hybrid)', color='#b6d7a8')
-p2 = ax.bar(x - width, memory_bound_1, width, bottom=core_bound_1, label='Memory Bound (Hybrid)', color='#ffe599')
+p1 = ax.bar(x - width, core_bound_1, width, label='Core Bound (Hybrid)', color='#b6d7a8',
+            yerr=error_bars(stats, benchmarks, 'Core_Bound', 0, 100), error_kw=error_kw)
+p2 = ax.bar(x - width, memory_bound_1, width, bottom=core_bound_1, label='Memory Bound (Hybrid)', color='#ffe599',
+            yerr=error_bars(stats, benchmarks, 'Memory_Bound', 0, 100), error_kw=error_kw)
 
 # Plot Benchmark
-p3 = ax.bar(x, core_bound_2, width, label='Core Bound (Benchmark)', color='#8dc63f')
-p4 = ax.bar(x, memory_bound_2, width, bottom=core_bound_2, label='Memory Bound (Benchmark)', color='#f1c232')
+p3 = ax.bar(x, core_bound_2, width, label='Core Bound (Benchmark)', color='#8dc63f',
+            yerr=error_bars(stats, benchmarks, 'Core_Bound', 1, 100), error_kw=error_kw)
+p4 = ax.bar(x, memory_bound_2, width, bottom=core_bound_2, label='Memory Bound (Benchmark)', color='#f1c232',
+            yerr=error_bars(stats, benchmarks, 'Memory_Bound', 1, 100), error_kw=error_kw)
 
 # Plot Purecap
-p5 = ax.bar(x + width, core_bound_3, width, label='Core Bound (Purecap)', color='#6aa84f')
-p6 = ax.bar(x + width, memory_bound_3, width, bottom=core_bound_3, label='Memory Bound (Purecap)', color='#bf9000')
+p5 = ax.bar(x + width, core_bound_3, width, label='Core Bound (Purecap)', color='#6aa84f',
+            yerr=error_bars(stats, benchmarks, 'Core_Bound', 2, 100), error_kw=error_kw)
+p6 = ax.bar(x + width, memory_bound_3, width, bottom=core_bound_3, label='Memory Bound (Purecap)', color='#bf9000',
+            yerr=error_bars(stats, benchmarks, 'Memory_Bound', 2, 100), error_kw=error_kw)
 
 # # Add values at the top of each bar
 # for i in range(len(benchmarks)):
@@ -1,16 +1,12 @@
 #!/usr/bin/env python3
 
-import ast
 from re import A
 import matplotlib.pyplot as plt
 import numpy as np
+from metric_store import load_dict
 
-# Read the raw profiling data
-with open('raw-profiling-pmu-event-data.txt', 'r') as f:
-    data_str = f.read()
-
-# Parse the data (it's in Python dict format)
-data = ast.literal_eval(data_str)
+# Read the raw profiling data (binary store, imported once from the text file)
+data = load_dict('raw-profiling-pmu-event-data.txt')
 
 # ABI labels
 abi_labels = ['Hybrid', 'Purecap Benchmark', 'Purecap']
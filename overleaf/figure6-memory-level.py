@@ -1,13 +1,12 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from ast import literal_eval
+from metric_store import load_dict
+from campaign_stats import error_bars, load_stats
 
-def read_data_as_dict(file_path):
-    with open(file_path, "r") as f:
-        content = f.read()
-        return literal_eval(content)
-
-data = read_data_as_dict("./top-down-analysis-data.txt")
+data = load_dict("./top-down-analysis-data.txt")
+# Multi-round confidence intervals (campaign_stats.py), drawn as error bars when present
+stats = load_stats("./top-down-analysis-stats.txt")
+error_kw = dict(ecolor='black', elinewidth=1, capsize=2)
 
 # Benchmarks (x-axis labels)
 benchmarks = list(data.keys())
@@ -41,15 +40,18 @@ for i, group in enumerate(['Hybrid', 'Benchmark', 'Purecap']):
     
     # Plot each memory level
     ax.bar(ind + offset, [ExtMem_bound[j][i] * 100 for j in range(len(benchmarks))], bar_width,
-           bottom=bottom, label=f'{group} ExtMem' if i == 0 else "", color=colors['ExtMem'][i])
+           bottom=bottom, label=f'{group} ExtMem' if i == 0 else "", color=colors['ExtMem'][i],
+           yerr=error_bars(stats, benchmarks, 'ExtMem_Bound', i, 100), error_kw=error_kw)
     bottom += [ExtMem_bound[j][i] * 100 for j in range(len(benchmarks))]
     
     ax.bar(ind + offset, [L2_bound[j][i] * 100 for j in range(len(benchmarks))], bar_width,
-           bottom=bottom, label=f'{group} L2' if i == 0 else "", color=colors['L2'][i])
+           bottom=bottom, label=f'{group} L2' if i == 0 else "", color=colors['L2'][i],
+           yerr=error_bars(stats, benchmarks, 'L2_Bound', i, 100), error_kw=error_kw)
     bottom += [L2_bound[j][i] * 100 for j in range(len(benchmarks))]
 
     ax.bar(ind + offset, [L1_bound[j][i] * 100 for j in range(len(benchmarks))], bar_width,
-           bottom=bottom, label=f'{group} L1' if i == 0 else "", color=colors['L1'][i])
+           bottom=bottom, label=f'{group} L1' if i == 0 else "", color=colors['L1'][i],
+           yerr=error_bars(stats, benchmarks, 'L1_Bound', i, 100), error_kw=error_kw)
 
 # Add group labels to x-axis
 group_positions = ind + bar_width
@@ -4,47 +4,85 @@ Performance Metrics Correlation Analysis Tool
 
 This program analyzes correlations between different performance metrics across
 multiple benchmarks and configurations (hybrid, purecap, purecap-benchmark).
+
+The plotting and analysis libraries are imported when a chart needs them, so
+--help and argument errors return at once, and sklearn is only loaded for the
+PCA chart. Charts are written with the non-interactive Agg backend (unless
+MPLBACKEND is set) and not shown, --show opens them in a window instead.
+
+The correlation heatmaps can test every metric pair (correlation_stats.py):
+--permutations N adds permutation p-values, --bootstrap N bootstrap intervals,
+and the cells that are not significant (p >= --alpha, or an interval holding 0
+with bootstrap only) are left blank; the statistics of every pair are written
+next to the figure as <figure>-pairs.tsv, with the benchmarks n both metrics
+of a pair are defined on.
 """
 
-import json
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy import stats
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+from __future__ import annotations
+
 import argparse
 import os
 from typing import Dict, List, Tuple, Optional
 
-# Set style for better-looking plots
-plt.style.use('seaborn-v0_8')
-sns.set_palette("husl")
+_pyplot = None
+
+
+def pyplot(show: bool = False):
+    """matplotlib.pyplot and seaborn with the figure style, imported on first use."""
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        if not show and not os.environ.get('MPLBACKEND'):
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        # Set style for better-looking plots
+        plt.style.use('seaborn-v0_8')
+        sns.set_palette("husl")
+        _pyplot = (plt, sns)
+    return _pyplot
+
 
 class MetricCorrelationAnalyzer:
-    def __init__(self, data_file: str = "raw-profiling-pmu-event-data.txt"):
+    def __init__(self, data_file: str = "raw-profiling-pmu-event-data.txt", show: bool = False,
+                 method: str = 'pearson', permutations: int = 0, bootstrap: int = 0,
+                 alpha: float = 0.05, fdr: bool = False, jobs: int = 1):
         """Initialize the analyzer with performance data."""
         self.data_file = data_file
+        self.show = show
+        # Correlation method and significance testing of the heatmaps
+        self.method = method
+        self.permutations = permutations
+        self.bootstrap = bootstrap
+        self.alpha = alpha
+        self.fdr = fdr
+        self.jobs = jobs
         self.configs = ['hybrid', 'purecap', 'purecap-benchmark']  # Define configs first
-        self.data = self._load_data()
-        self.df = self._create_dataframe()
+        # (config, benchmark, metric) array, NaN where a benchmark lacks a metric;
+        # benchmarks and metrics sorted as DataFrame.pivot sorts them
+        self.benchmarks, self.metrics, self.cube = self._load_data()
+
+    def _finish(self, plt) -> None:
+        """Show the saved figure with --show, release it otherwise."""
+        if self.show:
+            plt.show()
+        else:
+            plt.close('all')
         
-    def _load_data(self) -> Dict:
+    def _load_data(self) -> Tuple[List[str], List[str], np.ndarray]:
         """Load performance data from file."""
         if not os.path.exists(self.data_file):
             print(f"Warning: {self.data_file} not found. Using sample data.")
-            return self._get_sample_data()
+            return self._create_cube(self._get_sample_data())
         
         try:
-            with open(self.data_file, 'r') as f:
-                content = f.read()
-                # Convert string representation to actual dict
-                data = eval(content)
-                return data
+            from metric_store import open_store
+            # Binary store, imported once from the text file
+            return self._store_cube(open_store(self.data_file))
         except Exception as e:
             print(f"Error loading data: {e}")
-            return self._get_sample_data()
+            return self._create_cube(self._get_sample_data())
     
     def _get_sample_data(self) -> Dict:
         """Return sample data for testing."""
@@ -60,30 +98,87 @@ class MetricCorrelationAnalyzer:
             }
         }
     
-    def _create_dataframe(self) -> pd.DataFrame:
-        """Convert raw data to pandas DataFrame for analysis."""
-        rows = []
-        
-        for benchmark, metrics in self.data.items():
-            for metric_name, values in metrics.items():
-                for i, config in enumerate(self.configs):
-                    rows.append({
-                        'benchmark': benchmark,
-                        'metric': metric_name,
-                        'config': config,
-                        'value': values[i] if i < len(values) else 0
-                    })
-        
-        return pd.DataFrame(rows)
+    def _store_cube(self, store) -> Tuple[List[str], List[str], np.ndarray]:
+        """Cube of the first round of a metric store, the i-th ABI being self.configs[i]."""
+        import numpy as np
+        present = store.present[:, :, 0, :].any(axis=1)
+        # only the benchmarks and events recorded at least once, in sorted order
+        rows = [i for i in np.argsort(store.benchmarks, kind='stable') if present[i].any()]
+        columns = [i for i in np.argsort(store.events, kind='stable') if present[:, i].any()]
+        cube = np.zeros((len(self.configs), len(rows), len(columns)))
+        n = min(len(self.configs), len(store.abis))
+        cube[:n] = store.values[np.ix_(rows, range(n), [0], columns)][:, :, 0, :].transpose(1, 0, 2)
+        cube[:, ~present[np.ix_(rows, columns)]] = np.nan
+        return [store.benchmarks[i] for i in rows], [store.events[i] for i in columns], cube
+    
+    def _create_cube(self, data: Dict) -> Tuple[List[str], List[str], np.ndarray]:
+        """Cube of the nested {benchmark: {metric: (value per config)}} data."""
+        import numpy as np
+        benchmarks = sorted(benchmark for benchmark, metrics in data.items() if metrics)
+        metrics = sorted({metric for values in data.values() for metric in values})
+        cube = np.full((len(self.configs), len(benchmarks), len(metrics)), np.nan)
+        column = {metric: j for j, metric in enumerate(metrics)}
+        for b, benchmark in enumerate(benchmarks):
+            for metric, values in data[benchmark].items():
+                cube[:, b, column[metric]] = [values[i] if i < len(values) else 0
+                                              for i in range(len(self.configs))]
+        return benchmarks, metrics, cube
+    
+    def frame(self, config: str) -> pd.DataFrame:
+        """Benchmark x metric frame of one configuration, a view of the cube."""
+        import pandas as pd
+        return pd.DataFrame(self.cube[self.configs.index(config)],
+                            index=pd.Index(self.benchmarks, name='benchmark'),
+                            columns=pd.Index(self.metrics, name='metric'), copy=False)
+    
+    def correlation_stats(self, config: str, metrics: List[str]) -> Dict:
+        """Correlation matrix of the given metrics of one configuration, with its p-values and intervals."""
+        from correlation_stats import adjust, correlate
+        columns = [self.metrics.index(m) for m in metrics]
+        stats = correlate(self.cube[self.configs.index(config)][:, columns], self.method,
+                          self.permutations, self.bootstrap, jobs=self.jobs)
+        if self.fdr and 'p' in stats:
+            stats['p'] = adjust(stats['p'])
+        return stats
+    
+    def _tested(self) -> bool:
+        return bool(self.permutations or self.bootstrap)
+    
+    def _insignificant(self, config: str, metrics: List[str], stats: Dict) -> np.ndarray:
+        """Mask of the pairs that are not significant, reported on stdout."""
+        import numpy as np
+        from correlation_stats import significant
+        keep = significant(stats, self.alpha)
+        pairs = np.triu_indices(len(metrics), 1)
+        test = 'permutation' if 'p' in stats else 'bootstrap'
+        n = np.unique(stats['n'][pairs])
+        benchmarks = f"{n[0]}-{n[-1]}" if len(n) > 1 else ''.join(map(str, n))
+        print(f"{config}: {keep[pairs].sum()} of {len(pairs[0])} metric pairs significant "
+              f"({self.method}, {test}, alpha {self.alpha}{', FDR' if self.fdr and 'p' in stats else ''}, "
+              f"{benchmarks} benchmarks)")
+        return ~keep
+    
+    def _write_pairs(self, path: str, tables: List[Tuple[str, List[str], Dict]]) -> None:
+        """Write the statistics of every metric pair of (config, metrics, stats) tables as TSV."""
+        import numpy as np
+        columns = [c for c in ('r', 'p', 'ci_low', 'ci_high') if c in tables[0][2]]
+        with open(path, 'w') as f:
+            f.write('\t'.join(['config', 'metric_a', 'metric_b', 'n'] + columns) + '\n')
+            for config, metrics, stats in tables:
+                for i, j in zip(*np.triu_indices(len(metrics), 1)):
+                    values = [f"{stats[c][i, j]:.6g}" for c in columns]
+                    f.write('\t'.join([config, metrics[i], metrics[j], str(stats['n'][i, j])] + values) + '\n')
+        print(f"Wrote {path}")
     
     def correlation_matrix(self, config: str = 'hybrid', 
                          metrics: Optional[List[str]] = None,
                          save_path: str = "correlation_matrix.png") -> None:
         """Create correlation matrix heatmap for specified configuration."""
+        import numpy as np
+        import pandas as pd
+        plt, sns = pyplot(self.show)
         # Filter data for the specified configuration
-        config_data = self.df[self.df['config'] == config].pivot(
-            index='benchmark', columns='metric', values='value'
-        )
+        config_data = self.frame(config)
         
         # Select specific metrics if provided
         if metrics:
@@ -94,11 +189,16 @@ class MetricCorrelationAnalyzer:
             config_data = config_data[available_metrics]
         
         # Calculate correlation matrix
-        corr_matrix = config_data.corr()
+        metrics = list(config_data.columns)
+        stats = self.correlation_stats(config, metrics)
+        corr_matrix = pd.DataFrame(stats['r'], index=config_data.columns, columns=config_data.columns)
         
         # Create heatmap
         plt.figure(figsize=(12, 10))
         mask = np.triu(np.ones_like(corr_matrix, dtype=bool))
+        if self._tested():
+            mask |= self._insignificant(config, metrics, stats)
+            self._write_pairs(f'{save_path}-{config}-pairs.tsv', [(config, metrics, stats)])
         
         sns.heatmap(corr_matrix, 
                    mask=mask,
@@ -117,7 +217,7 @@ class MetricCorrelationAnalyzer:
         plt.xticks(fontsize=25)
         plt.tight_layout()
         plt.savefig(f'{save_path}-{config}.png', dpi=300, bbox_inches='tight')
-        plt.show()
+        self._finish(plt)
         
         return corr_matrix
     
@@ -125,10 +225,9 @@ class MetricCorrelationAnalyzer:
                            metrics: Optional[List[str]] = None,
                            save_path: str = "scatter_matrix.png") -> None:
         """Create scatter plot matrix for key metrics."""
+        plt, sns = pyplot(self.show)
         # Filter data for the specified configuration
-        config_data = self.df[self.df['config'] == config].pivot(
-            index='benchmark', columns='metric', values='value'
-        )
+        config_data = self.frame(config)
         
         # Select metrics (default to key ones if not specified)
         if not metrics:
@@ -149,17 +248,20 @@ class MetricCorrelationAnalyzer:
         fig.fig.suptitle(f'Scatter Plot Matrix - {config}', y=1.02)
         fig.fig.tight_layout()
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        plt.show()
+        self._finish(plt)
     
     def radar_chart(self, benchmark: str, save_path: str = "radar_chart.png") -> None:
         """Create radar chart comparing configurations for a specific benchmark."""
+        import numpy as np
+        plt, _ = pyplot(self.show)
         # Get data for the benchmark
-        bench_data = self.df[self.df['benchmark'] == benchmark]
+        b = self.benchmarks.index(benchmark) if benchmark in self.benchmarks else None
+        recorded = [m for j, m in enumerate(self.metrics) if b is not None and not np.isnan(self.cube[0, b, j])]
         
         # Select key metrics for visualization
         key_metrics = ['inst_retired', 'cpu_cycles', 'mem_access', 
                       'cap_mem_access_rd', 'cap_mem_access_wr', 'stall_backend']
-        available_metrics = [m for m in key_metrics if m in bench_data['metric'].values]
+        available_metrics = [m for m in key_metrics if m in recorded]
         
         if len(available_metrics) < 3:
             print("Need at least 3 metrics for radar chart")
@@ -173,19 +275,11 @@ class MetricCorrelationAnalyzer:
         
         colors = ['blue', 'red', 'green']
         
+        columns = [self.metrics.index(m) for m in available_metrics]
         for i, config in enumerate(self.configs):
-            config_data = bench_data[bench_data['config'] == config]
-            values = []
-            
-            for metric in available_metrics:
-                metric_data = config_data[config_data['metric'] == metric]
-                if not metric_data.empty:
-                    values.append(metric_data['value'].iloc[0])
-                else:
-                    values.append(0)
+            values = self.cube[i, b, columns]
             
             # Normalize values for better visualization
-            values = np.array(values)
             if values.max() > 0:
                 values = values / values.max()
             
@@ -202,15 +296,18 @@ class MetricCorrelationAnalyzer:
         
         plt.tight_layout()
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        plt.show()
+        self._finish(plt)
     
     def pca_analysis(self, config: str = 'hybrid',
                     save_path: str = "pca_analysis.png") -> None:
         """Perform PCA analysis on performance metrics."""
+        import numpy as np
+        import pandas as pd
+        from sklearn.decomposition import PCA
+        from sklearn.preprocessing import StandardScaler
+        plt, _ = pyplot(self.show)
         # Filter data for the specified configuration
-        config_data = self.df[self.df['config'] == config].pivot(
-            index='benchmark', columns='metric', values='value'
-        )
+        config_data = self.frame(config)
         
         # Remove columns with zero variance
         config_data = config_data.loc[:, config_data.var() > 0]
@@ -252,7 +349,7 @@ class MetricCorrelationAnalyzer:
         
         plt.tight_layout()
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        plt.show()
+        self._finish(plt)
         
         # Print component loadings
         print(f"\nPCA Component Loadings for {config}:")
@@ -266,10 +363,13 @@ class MetricCorrelationAnalyzer:
     def metric_comparison_bar(self, metrics: List[str], 
                             save_path: str = "metric_comparison.png") -> None:
         """Create bar chart comparing metrics across configurations."""
+        import numpy as np
+        import pandas as pd
+        plt, _ = pyplot(self.show)
         # Filter data for specified metrics
-        filtered_data = self.df[self.df['metric'].isin(metrics)]
+        selected = [m for m in self.metrics if m in metrics]
         
-        if filtered_data.empty:
+        if not selected:
             print("No data found for specified metrics")
             return
         
@@ -277,9 +377,12 @@ class MetricCorrelationAnalyzer:
         plt.figure(figsize=(15, 8))
         
         # Pivot data for easier plotting
-        pivot_data = filtered_data.pivot_table(
-            index='metric', columns='config', values='value', aggfunc='mean'
-        )
+        columns = [self.metrics.index(m) for m in selected]
+        pivot_data = pd.DataFrame(
+            np.nanmean(self.cube[:, :, columns], axis=1).T,
+            index=pd.Index(selected, name='metric'),
+            columns=pd.Index(self.configs, name='config')
+        )[sorted(self.configs)]
         
         # Create bar chart
         ax = pivot_data.plot(kind='bar', figsize=(15, 8))
@@ -290,19 +393,17 @@ class MetricCorrelationAnalyzer:
         plt.legend(title='Configuration')
         plt.tight_layout()
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        plt.show()
+        self._finish(plt)
     
     def combined_correlation_matrix(self, 
                                   metrics: Optional[List[str]] = None,
                                   save_path: str = "combined_correlation_matrix.png") -> np.ndarray:
         """Create combined correlation matrix heatmap with hybrid (left triangle) and purecap (right triangle)."""
+        import numpy as np
+        plt, sns = pyplot(self.show)
         # Get data for both configurations
-        hybrid_data = self.df[self.df['config'] == 'hybrid'].pivot(
-            index='benchmark', columns='metric', values='value'
-        )
-        purecap_data = self.df[self.df['config'] == 'purecap'].pivot(
-            index='benchmark', columns='metric', values='value'
-        )
+        hybrid_data = self.frame('hybrid')
+        purecap_data = self.frame('purecap')
         
         # Select specific metrics if provided
         if metrics:
@@ -314,24 +415,20 @@ class MetricCorrelationAnalyzer:
             purecap_data = purecap_data[available_metrics]
         
         # Calculate correlation matrices
-        hybrid_corr = hybrid_data.corr()
-        purecap_corr = purecap_data.corr()
-        
-        # Create combined matrix
-        n_metrics = len(hybrid_corr)
-        combined_matrix = np.zeros((n_metrics, n_metrics))
-        
-        # Fill left triangle (lower triangle) with hybrid correlations
-        # Use proper indexing for lower triangle
-        for i in range(n_metrics):
-            for j in range(i + 1):  # Include diagonal (j <= i)
-                combined_matrix[i, j] = hybrid_corr.iloc[i, j]
-        
-        # Fill right triangle (upper triangle) with purecap correlations
-        # Use proper indexing for upper triangle
-        for i in range(n_metrics):
-            for j in range(i, n_metrics):  # Include diagonal (j >= i)
-                combined_matrix[i, j] = purecap_corr.iloc[i, j]
+        metrics = list(hybrid_data.columns)
+        hybrid_stats = self.correlation_stats('hybrid', metrics)
+        purecap_stats = self.correlation_stats('purecap', metrics)
+        
+        # Create combined matrix: hybrid correlations in the left (lower)
+        # triangle, purecap correlations in the right (upper) one and the diagonal
+        lower = np.tri(len(metrics), k=-1, dtype=bool)
+        combined_matrix = np.where(lower, hybrid_stats['r'], purecap_stats['r'])
+        mask = None
+        if self._tested():
+            mask = np.where(lower, self._insignificant('hybrid', metrics, hybrid_stats),
+                            self._insignificant('purecap', metrics, purecap_stats))
+            self._write_pairs(os.path.splitext(save_path)[0] + '-pairs.tsv',
+                              [('hybrid', metrics, hybrid_stats), ('purecap', metrics, purecap_stats)])
         
         # Create heatmap
         plt.figure(figsize=(12, 10))
@@ -345,14 +442,15 @@ class MetricCorrelationAnalyzer:
         # Create custom mask to show only the relevant triangles
         # We'll show the full matrix but annotate differently
         sns.heatmap(combined_matrix, 
+                   mask=mask,
                    annot=False, 
                    cmap='coolwarm', 
                    center=0,
                    square=True,
                    fmt='.2f',
                    cbar_kws={"shrink": .8,'aspect': 60, 'location': 'top', 'orientation': 'horizontal'},
-                   xticklabels=hybrid_corr.columns,
-                   yticklabels=hybrid_corr.columns)
+                   xticklabels=metrics,
+                   yticklabels=metrics)
         
         # Add text annotations to indicate which triangle is which
         plt.text(0.02, 0.98, 'Hybrid ABI(Lower Triangle)', 
@@ -374,7 +472,7 @@ class MetricCorrelationAnalyzer:
         plt.yticks(fontsize=13)
         plt.tight_layout()
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        plt.show()
+        self._finish(plt)
         
         return combined_matrix
     
@@ -431,7 +529,7 @@ class MetricCorrelationAnalyzer:
                                 save_path=f"pca_analysis_{config}.png")
             
             # Generate radar charts for first few benchmarks
-            benchmarks = list(self.data.keys())[:3]
+            benchmarks = self.benchmarks[:3]
             for benchmark in benchmarks:
                 self.radar_chart(benchmark=benchmark, 
                                save_path=f"radar_chart_{benchmark}.png")
@@ -461,11 +559,37 @@ def main():
     parser.add_argument('--benchmark', help='Benchmark name for radar chart')
     parser.add_argument('--metrics', nargs='+', help='Metrics to analyze')
     parser.add_argument('--output', help='Output file path')
+    parser.add_argument('--show', action='store_true',
+                       help='Show the charts in a window after writing them')
+    parser.add_argument('--method', choices=['pearson', 'spearman'], default='pearson',
+                       help='Correlation of the correlation heatmaps')
+    parser.add_argument('--permutations', type=int, default=0,
+                       help='Permutation resamples testing every metric pair (default: no test)')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                       help='Bootstrap resamples of the confidence interval of every metric pair')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                       help='Significance level, cells above it are left blank')
+    parser.add_argument('--fdr', action='store_true',
+                       help='Benjamini-Hochberg adjust the permutation p-values')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                       help='Processes drawing the resamples')
     
     args = parser.parse_args()
+    if not args.interactive:
+        if not args.chart_type:
+            print("Please specify a chart type or use --interactive")
+            return
+        if args.chart_type == 'radar' and not args.benchmark:
+            print("Benchmark name required for radar chart")
+            return
+        if args.chart_type == 'bar' and not args.metrics:
+            print("Metrics required for bar chart")
+            return
     
     # Initialize analyzer
-    analyzer = MetricCorrelationAnalyzer(args.data_file)
+    analyzer = MetricCorrelationAnalyzer(args.data_file, show=args.show, method=args.method,
+                                         permutations=args.permutations, bootstrap=args.bootstrap,
+                                         alpha=args.alpha, fdr=args.fdr, jobs=args.jobs)
     
     if args.interactive:
         analyzer.interactive_dashboard()
@@ -479,25 +603,17 @@ def main():
                                        metrics=args.metrics,
                                        save_path=args.output or 'metric-scatter_matrix.png')
         elif args.chart_type == 'radar':
-            if not args.benchmark:
-                print("Benchmark name required for radar chart")
-                return
             analyzer.radar_chart(benchmark=args.benchmark,
                                save_path=args.output or 'metric-radar_chart.png')
         elif args.chart_type == 'pca':
             analyzer.pca_analysis(config=args.config,
                                 save_path=args.output or 'metric-pca_analysis.png')
         elif args.chart_type == 'bar':
-            if not args.metrics:
-                print("Metrics required for bar chart")
-                return
             analyzer.metric_comparison_bar(metrics=args.metrics,
                                          save_path=args.output or 'metric_comparison.png')
         elif args.chart_type == 'combined':
             analyzer.combined_correlation_matrix(metrics=args.metrics,
                                                save_path=args.output or 'figure7-metric-correlation.png')
-        else:
-            print("Please specify a chart type or use --interactive")
 
 if __name__ == "__main__":
     main() 
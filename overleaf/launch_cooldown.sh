@@ -0,0 +1,80 @@
+#!/bin/sh
+#
+# Adaptive cool-down between pmcstat passes, run on the board as _launch_cooldown
+# (copied next to the launch scripts by run/setup, see overleaf/pmcstat_groups.py --cooldown).
+#
+#   _launch_cooldown MAX baseline   wait (at most MAX s) for an idle board, then record its
+#                                   temperature and frequency in cooldown.baseline
+#   _launch_cooldown MAX [LABEL]    wait until the board is back at that baseline, at most MAX s
+#
+# The board is back at baseline when, for COOL_STABLE consecutive one-second samples, at most
+# COOL_LOAD % of the CPU time was busy (kern.cp_time), the temperature is within COOL_TEMP
+# degrees of the baseline (dev.cpu.0.temperature or hw.acpi.thermal.tz0.temperature) and the
+# frequency within COOL_FREQ % of it (dev.cpu.0.freq). Sysctls missing on the board are skipped.
+#
+# Every wait is appended to cooldown.log as "LABEL WAITED MAX LOAD TEMP FREQ ready|timeout"
+# and announced on fd 3 for _launch_stream, so the real cost of the pauses reaches the
+# development machine with the results.
+
+COOL_LOAD="${COOL_LOAD:-5}"
+COOL_TEMP="${COOL_TEMP:-2}"
+COOL_FREQ="${COOL_FREQ:-2}"
+COOL_STABLE="${COOL_STABLE:-3}"
+
+max="${1:-60}"
+label="${2:-pause}"
+
+# busy ticks, total ticks, temperature (C) and frequency (MHz), '-' when unavailable
+state() {
+    sysctl -i kern.cp_time dev.cpu.0.temperature hw.acpi.thermal.tz0.temperature dev.cpu.0.freq 2>/dev/null | awk '
+        $1 == "kern.cp_time:" { for (i = 2; i <= NF; i++) total += $i; busy = total - $NF }
+        $1 ~ /temperature:$/ && temp == "" { temp = $2 + 0 }
+        $1 == "dev.cpu.0.freq:" { freq = $2 }
+        END { print busy + 0, total + 0, (temp == "" ? "-" : temp), (freq == "" ? "-" : freq) }'
+}
+
+base_temp=- base_freq=-
+if [ "${label}" != baseline ] && [ -f cooldown.baseline ]; then
+    read -r base_temp base_freq < cooldown.baseline
+fi
+
+start=$(date +%s)
+stable=0
+set -- $(state)
+prev_busy=$1 prev_total=$2
+while :; do
+    sleep 1
+    set -- $(state)
+    verdict=$(echo "${prev_busy} ${prev_total} $* ${base_temp} ${base_freq}" | awk \
+        -v load_max="${COOL_LOAD}" -v temp_margin="${COOL_TEMP}" -v freq_margin="${COOL_FREQ}" '{
+        load = ($4 > $2) ? 100 * ($3 - $1) / ($4 - $2) : 0
+        quiet = load <= load_max
+        if ($5 != "-" && $7 != "-" && $5 > $7 + temp_margin) quiet = 0
+        if ($6 != "-" && $8 != "-" && $6 < $8 * (1 - freq_margin / 100)) quiet = 0
+        printf "%d %.1f\n", quiet, load
+    }')
+    prev_busy=$1 prev_total=$2 temp=$3 freq=$4
+    load=${verdict#* }
+    if [ "${verdict%% *}" = 1 ]; then
+        stable=$((stable + 1))
+    else
+        stable=0
+    fi
+    waited=$(($(date +%s) - start))
+    if [ "${stable}" -ge "${COOL_STABLE}" ]; then
+        status=ready
+        break
+    fi
+    if [ "${waited}" -ge "${max}" ]; then
+        status=timeout
+        break
+    fi
+done
+
+if [ "${label}" = baseline ]; then
+    echo "${temp} ${freq}" > cooldown.baseline
+    echo "# label waited_s max_s load_% temp_C freq_MHz status" > cooldown.log
+fi
+echo "${label} ${waited} ${max} ${load} ${temp} ${freq} ${status}" | tee -a cooldown.log >&2
+{ (echo "$PWD/cooldown.log" >&3) 2>/dev/null || true; }
+exit 0
@@ -0,0 +1,336 @@
+"""
+Binary columnar metric store.
+
+A store is a directory holding one dense array indexed by
+(benchmark, ABI, round, event) plus a presence mask:
+
+    <name>.store/
+        index.json    axis labels, dtype, the legacy source fingerprint and
+                      the manifest of ingested result folders
+        values.bin    C-ordered array of shape (benchmarks, abis, rounds, events)
+        present.bin   uint8 mask of the same shape, 1 where a value was recorded
+
+Raw PMU counters are stored as uint64; derived data (e.g. the top-down
+metrics) as float64, with the metric names on the event axis. Both files are
+opened with np.memmap, so opening a store costs the same however many
+campaigns it holds.
+
+The legacy Python-literal text files produced by `run/verbose-list` and
+`top-down-analysis.py` are imported once and transparently re-imported only
+when the text file changes.
+
+Writers replace the whole directory. open_store, merge_records and
+write_store hold an exclusive flock on the sidecar <name>.store.lock, so
+concurrent importers and ingests are serialized and never open a store
+while it is being swapped.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from ast import literal_eval
+from contextlib import contextmanager
+
+import numpy as np
+
+AXES = ('benchmark', 'abi', 'round', 'event')
+
+# ABI order of the tuples written by run/verbose-list (glob order of the result folders)
+ABIS = ['hybrid', 'purecap-benchmark', 'purecap']
+
+INDEX_FILE = 'index.json'
+VALUES_FILE = 'values.bin'
+PRESENT_FILE = 'present.bin'
+LOCK_SUFFIX = '.lock'
+
+# Lock files held by this process, so that nested store_lock calls do not deadlock on flock
+_held = {}
+
+
+class MetricStore:
+    """Read-only, memory-mapped view of a store directory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), 'r') as f:
+            self.index = json.load(f)
+        self.axes = {axis: list(self.index['axes'][axis]) for axis in AXES}
+        self.shape = tuple(len(self.axes[axis]) for axis in AXES)
+        self.dtype = np.dtype(self.index['dtype'])
+        self.values = _memmap(os.path.join(path, VALUES_FILE), self.dtype, self.shape)
+        self.present = _memmap(os.path.join(path, PRESENT_FILE), np.uint8, self.shape).view(bool)
+
+    @property
+    def benchmarks(self):
+        return self.axes['benchmark']
+
+    @property
+    def abis(self):
+        return self.axes['abi']
+
+    @property
+    def rounds(self):
+        return self.axes['round']
+
+    @property
+    def events(self):
+        return self.axes['event']
+
+    @property
+    def units(self):
+        """Ingestion manifest {unit: fingerprint} of the result folders merged so far."""
+        return self.index.get('units', {})
+
+    def position(self, axis, label):
+        """Index of label along axis."""
+        return self.axes[axis].index(label)
+
+    def take(self, events, dtype=np.float64):
+        """
+        Return a (benchmarks, abis, rounds, len(events)) array of the given
+        events, in that order; events absent from the store are zeros.
+        """
+        out = np.zeros(self.shape[:3] + (len(events),), dtype=dtype)
+        for i, event in enumerate(events):
+            if event in self.axes['event']:
+                out[..., i] = self.values[..., self.position('event', event)]
+        return out
+
+    def to_dict(self, round_index=0):
+        """
+        Legacy nested view {benchmark: {event: (v_abi0, v_abi1, ...)}} for one
+        round. Values never recorded for a benchmark are omitted.
+        """
+        values = self.values[:, :, round_index, :]
+        present = self.present[:, :, round_index, :]
+        data = {}
+        for b, benchmark in enumerate(self.benchmarks):
+            metrics = {}
+            for e, event in enumerate(self.events):
+                if present[b, :, e].any():
+                    metrics[event] = tuple(values[b, :, e].tolist())
+            data[benchmark] = metrics
+        return data
+
+
+def _memmap(path, dtype, shape):
+    if 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+@contextmanager
+def store_lock(path):
+    """
+    Exclusive flock on the sidecar lock file of the store at path, held
+    until the block exits; re-entrant within a process. Without a writable
+    parent directory (a read-only copy) the block runs unlocked.
+    """
+    lock = os.path.abspath(path).rstrip(os.sep) + LOCK_SUFFIX
+    if lock in _held:
+        _held[lock] += 1
+        try:
+            yield
+        finally:
+            _held[lock] -= 1
+        return
+    try:
+        fd = os.open(lock, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError:
+        yield
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        _held[lock] = 1
+        try:
+            yield
+        finally:
+            del _held[lock]
+    finally:
+        os.close(fd)
+
+
+def write_store(path, values, present, axes, dtype, source=None, units=None):
+    """
+    (Re)write the store at path. values and present must have the shape
+    given by the axis labels in axes. units is the ingestion manifest
+    {unit: fingerprint} used to skip unchanged result folders.
+
+    The new store is written to a temporary directory and renamed into
+    place, so a store is never seen half written. Replacing an existing one
+    takes two renames, with a moment in between where path does not exist;
+    the store lock keeps open_store and merge_records out of that window.
+    """
+    shape = tuple(len(axes[axis]) for axis in AXES)
+    values = np.ascontiguousarray(values, dtype=dtype).reshape(shape)
+    present = np.ascontiguousarray(present, dtype=np.uint8).reshape(shape)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    with store_lock(path):
+        tmp = tempfile.mkdtemp(prefix='.store-', dir=parent)
+        try:
+            values.tofile(os.path.join(tmp, VALUES_FILE))
+            present.tofile(os.path.join(tmp, PRESENT_FILE))
+            index = {
+                'dtype': np.dtype(dtype).name,
+                'axes': {axis: list(axes[axis]) for axis in AXES},
+                'source': source,
+                'units': units or {},
+            }
+            with open(os.path.join(tmp, INDEX_FILE), 'w') as f:
+                json.dump(index, f, indent=1)
+            if os.path.exists(path):
+                old = path + '.old'
+                shutil.rmtree(old, ignore_errors=True)
+                os.rename(path, old)
+                os.rename(tmp, path)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.rename(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+
+def merge_records(path, records, dtype=np.uint64, units=None):
+    """
+    Merge (benchmark, abi, round, {event: value}) records into the store at
+    path, creating it if needed. New labels are appended to their axis and
+    every record replaces all the values of its (benchmark, abi, round), so
+    events that a re-parse no longer finds are cleared. units updates the
+    ingestion manifest. The store is locked from read to write, so
+    concurrent merges do not lose each other's records.
+    """
+    with store_lock(path):
+        return _merge(path, records, dtype, units)
+
+
+def _merge(path, records, dtype, units):
+    if os.path.exists(os.path.join(path, INDEX_FILE)):
+        store = MetricStore(path)
+        axes = {axis: list(store.axes[axis]) for axis in AXES}
+        dtype = store.dtype
+        old_values, old_present = np.array(store.values), np.array(store.present)
+        source = store.index.get('source')
+        manifest = dict(store.units)
+    else:
+        axes = {axis: [] for axis in AXES}
+        old_values = old_present = None
+        source = None
+        manifest = {}
+    manifest.update(units or {})
+
+    records = list(records)
+    for benchmark, abi, round_, metrics in records:
+        for axis, label in (('benchmark', benchmark), ('abi', abi), ('round', str(round_))):
+            if label not in axes[axis]:
+                axes[axis].append(label)
+        for event in metrics:
+            if event not in axes['event']:
+                axes['event'].append(event)
+
+    shape = tuple(len(axes[axis]) for axis in AXES)
+    values = np.zeros(shape, dtype=dtype)
+    present = np.zeros(shape, dtype=bool)
+    if old_values is not None:
+        old = tuple(slice(0, n) for n in old_values.shape)
+        values[old] = old_values
+        present[old] = old_present
+
+    for benchmark, abi, round_, metrics in records:
+        b = axes['benchmark'].index(benchmark)
+        a = axes['abi'].index(abi)
+        r = axes['round'].index(str(round_))
+        values[b, a, r] = 0
+        present[b, a, r] = False
+        for event, value in metrics.items():
+            e = axes['event'].index(event)
+            values[b, a, r, e] = value
+            present[b, a, r, e] = True
+
+    write_store(path, values, present, axes, dtype, source=source, units=manifest)
+    return MetricStore(path)
+
+
+def _fingerprint(text_path):
+    stat = os.stat(text_path)
+    return {'path': os.path.basename(text_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def import_legacy(text_path, store_path=None, dtype=None, abis=ABIS, round_label='1'):
+    """
+    One-time import of a legacy text file {benchmark: {event: (hybrid, benchmark, purecap)}}
+    into a store. Integer data becomes uint64, anything else float64.
+    """
+    store_path = store_path or default_store_path(text_path)
+    with open(text_path, 'r') as f:
+        data = literal_eval(f.read())
+
+    benchmarks = list(data.keys())
+    events = []
+    for metrics in data.values():
+        for event in metrics:
+            if event not in events:
+                events.append(event)
+    n_abis = max((len(v) for m in data.values() for v in m.values()), default=0)
+    abis = list(abis[:n_abis]) + [str(i) for i in range(len(abis), n_abis)]
+
+    if dtype is None:
+        integral = all(isinstance(x, int) for m in data.values() for v in m.values() for x in v)
+        dtype = np.uint64 if integral else np.float64
+
+    axes = {'benchmark': benchmarks, 'abi': abis, 'round': [round_label], 'event': events}
+    shape = tuple(len(axes[axis]) for axis in AXES)
+    values = np.zeros(shape, dtype=dtype)
+    present = np.zeros(shape, dtype=bool)
+    for b, benchmark in enumerate(benchmarks):
+        for event, recorded in data[benchmark].items():
+            e = events.index(event)
+            values[b, :len(recorded), 0, e] = recorded
+            present[b, :len(recorded), 0, e] = True
+
+    write_store(store_path, values, present, axes, dtype, source=_fingerprint(text_path))
+    return MetricStore(store_path)
+
+
+def default_store_path(text_path):
+    """raw-profiling-pmu-event-data.txt -> raw-profiling-pmu-event-data.store"""
+    return os.path.splitext(text_path)[0] + '.store'
+
+
+def open_store(path):
+    """
+    Open a store. path may be the store directory itself or a legacy text
+    file, whose store is (re)imported only when the text file has changed.
+    The check and the import run under the store lock: concurrent callers
+    import once and the others open the result.
+    """
+    if os.path.isdir(path):
+        with store_lock(path):
+            return MetricStore(path)
+    store_path = default_store_path(path)
+    with store_lock(store_path):
+        if os.path.exists(os.path.join(store_path, INDEX_FILE)):
+            store = MetricStore(store_path)
+            if not os.path.exists(path) or store.index.get('source') == _fingerprint(path):
+                return store
+        return import_legacy(path, store_path)
+
+
+def load_dict(path, round_index=0):
+    """Drop-in replacement for literal_eval(open(path).read()) backed by the store."""
+    return open_store(path).to_dict(round_index)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Import legacy metric text files into binary stores')
+    parser.add_argument('files', nargs='+', help='Legacy Python-literal data files')
+    args = parser.parse_args()
+
+    for text_path in args.files:
+        store = import_legacy(text_path)
+        print(f"{text_path} -> {store.path}: {dict(zip(AXES, store.shape))} {store.dtype}")
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Off-board decoder of raw pmcstat sampling logs (`pmcstat -O pmcstat.SN.out`).
+
+In sampling mode every pass of `_launch_pmcstat` is followed on the board by
+`pmcstat -R pmcstat.SN.out -G pmcstat.SN.gmon` and a cool-down. With
+`PMC_MODE=raw` (pmcstat_groups.py) the board only records the logs, and this
+script decodes them on the development machine, in parallel:
+
+    python3 pmclog.py <results folder> ... [-j N]
+
+writes a `pmcstat.SN.gmon` next to every `pmcstat.SN.out` that has none, in
+the `@ EVENT [N samples]` layout of `pmcstat -G` (read by pmcstat_ingest.py),
+with a flat profile of the sampled PCs per executable image below each
+header. pmcstat_ingest.py also decodes logs without a .gmon by itself.
+
+The log is the hwpmc(4) record stream of pmclog(3): 16-byte headers (magic
+0xEE, type, length, TSC) followed by the record. Events are named, in order
+of preference, from the `pmcstat.SN.events` file written next to the log
+(the -P events in allocation order), from PMCALLOCATEDYN records, or from
+the ARMv8 common event number of PMCALLOCATE records. Function names are not
+resolved, since the board binaries are not needed here: PCs are reported as
+offsets into the image mapped at that address (PROCEXEC and MAP_IN records).
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+HEADER = struct.Struct('<IIQ')
+MAGIC = 0xEE
+
+# enum pmclog_type of <sys/pmclog.h>
+CLOSELOG = 1
+PCSAMPLE = 5
+PMCALLOCATE = 6
+PROCEXEC = 10
+MAP_IN = 15
+CALLCHAIN = 17
+PMCALLOCATEDYN = 18
+
+PCSAMPLE_BODY = struct.Struct('<IIQII')       # pid, usermode, pc, pmcid, tid
+CALLCHAIN_BODY = struct.Struct('<IIII')       # pid, tid, pmcid, cpuflags, then the PCs
+ALLOCATE_BODY = struct.Struct('<IIII')        # pmcid, event, flags, pad, then rate or name
+PROCEXEC_BODY = struct.Struct('<IIQQ')        # pid, pmcid, base, dynamic base, then path
+MAP_IN_BODY = struct.Struct('<IIQ')           # pid, pad, start, then path
+
+# hwpmc numbers the ARMv8 PMUv3 events from PMC_EV_ARMV8_EVENT_00H
+ARMV8_FIRST = 0x14100
+ARMV8_EVENTS = {
+    0x01: 'l1i_cache_refill', 0x02: 'l1i_tlb_refill', 0x03: 'l1d_cache_refill', 0x04: 'l1d_cache',
+    0x05: 'l1d_tlb_refill', 0x08: 'inst_retired', 0x11: 'cpu_cycles', 0x13: 'mem_access',
+    0x14: 'l1i_cache', 0x16: 'l2d_cache', 0x17: 'l2d_cache_refill', 0x1B: 'inst_spec',
+    0x20: 'l2d_cache_allocate', 0x21: 'br_retired', 0x22: 'br_mis_pred_retired', 0x23: 'stall_frontend',
+    0x24: 'stall_backend', 0x25: 'l1d_tlb', 0x26: 'l1i_tlb', 0x2D: 'l2d_tlb_refill', 0x2F: 'l2d_tlb',
+    0x34: 'dtlb_walk', 0x35: 'itlb_walk', 0x36: 'll_cache_rd', 0x37: 'll_cache_miss_rd',
+    0x40: 'l1d_cache_rd', 0x41: 'l1d_cache_wr', 0x50: 'l2d_cache_rd', 0x51: 'l2d_cache_wr',
+    0x66: 'mem_access_rd', 0x67: 'mem_access_wr', 0x70: 'ld_spec', 0x71: 'st_spec', 0x73: 'dp_spec',
+    0x74: 'ase_spec', 0x75: 'vfp_spec', 0x77: 'crypto_spec', 0x78: 'br_immed_spec',
+    0x79: 'br_return_spec', 0x7A: 'br_indirect_spec',
+}
+
+# Offsets listed per image in the written profile
+TOP_OFFSETS = 10
+# Bytes read at a time by stream()
+CHUNK = 1 << 20
+
+
+def _cstring(data, start, end):
+    text = bytes(data[start:end])
+    return text.split(b'\0', 1)[0].decode(errors='replace')
+
+
+def events_file(path):
+    """Events of the sibling pmcstat.SN.events file of a log, in -P order."""
+    sidecar = path[:-len('.out')] + '.events' if path.endswith('.out') else None
+    if not sidecar or not os.path.exists(sidecar):
+        return []
+    with open(sidecar, 'r') as f:
+        return [event.lower() for event in f.read().split()]
+
+
+def records(data, size, path=''):
+    """
+    Yield (type, tsc, body, end) for every record of a mapped log, up to its
+    CLOSELOG record; the record body is data[body:end].
+    """
+    offset = 0
+    while offset + HEADER.size <= size:
+        header, _, tsc = HEADER.unpack_from(data, offset)
+        kind, length = (header >> 16) & 0xFF, header & 0xFFFF
+        if header >> 24 != MAGIC or length < HEADER.size:
+            raise ValueError(f"{path}: not a pmcstat log record at byte {offset}")
+        yield kind, tsc, offset + HEADER.size, offset + length
+        if kind == CLOSELOG:
+            return
+        offset += length
+
+
+def stream(f, path='', chunk=CHUNK):
+    """
+    records() of a log file read `chunk` bytes at a time, for logs too large
+    to map: yields (type, tsc, buffer, body, end), the body being
+    buffer[body:end].
+    """
+    buffer, offset, position = b'', 0, 0
+    while True:
+        data = f.read(chunk)
+        buffer = buffer[offset:] + data
+        position += offset
+        offset, size = 0, len(buffer)
+        while offset + HEADER.size <= size:
+            header, _, tsc = HEADER.unpack_from(buffer, offset)
+            kind, length = (header >> 16) & 0xFF, header & 0xFFFF
+            if header >> 24 != MAGIC or length < HEADER.size:
+                raise ValueError(f"{path}: not a pmcstat log record at byte {position + offset}")
+            if offset + length > size:
+                break
+            yield kind, tsc, buffer, offset + HEADER.size, offset + length
+            if kind == CLOSELOG:
+                return
+            offset += length
+        if not data:
+            return
+
+
+def sample(kind, data, body):
+    """(pid, pc, pmcid) of a PCSAMPLE or CALLCHAIN record, the PC being the first of the chain."""
+    if kind == PCSAMPLE:
+        pid, _, pc, pmcid, _ = PCSAMPLE_BODY.unpack_from(data, body)
+    else:
+        pid, _, pmcid, _ = CALLCHAIN_BODY.unpack_from(data, body)
+        pc = struct.unpack_from('<Q', data, body + CALLCHAIN_BODY.size)[0]
+    return pid, pc, pmcid
+
+
+def allocation(kind, data, body, end, events, allocated):
+    """(pmcid, event name) of the allocated-th PMCALLOCATE or PMCALLOCATEDYN record of a log."""
+    pmcid, event, _, _ = ALLOCATE_BODY.unpack_from(data, body)
+    if allocated < len(events):
+        return pmcid, events[allocated]
+    if kind == PMCALLOCATEDYN:
+        return pmcid, _cstring(data, body + ALLOCATE_BODY.size, end).lower()
+    return pmcid, ARMV8_EVENTS.get(event - ARMV8_FIRST, f"event_{event:#x}")
+
+
+def decode(path, events=None):
+    """
+    Decode one pmcstat log. Returns ({event: samples}, {event: Counter of
+    (image, offset)}), the sampled PC being the first of each callchain.
+    """
+    events = events if events is not None else events_file(path)
+    names, allocated = {}, 0
+    maps = {}            # pid -> [(start, image)]
+    samples = Counter()  # pmcid -> samples
+    pcs = {}             # pmcid -> Counter((pid, pc))
+
+    size = os.path.getsize(path)
+    if size == 0:
+        return {}, {}
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for kind, _, body, end in records(data, size, path):
+            if kind in (PCSAMPLE, CALLCHAIN):
+                pid, pc, pmcid = sample(kind, data, body)
+                samples[pmcid] += 1
+                pcs.setdefault(pmcid, Counter())[pid, pc] += 1
+            elif kind in (PMCALLOCATE, PMCALLOCATEDYN):
+                pmcid, name = allocation(kind, data, body, end, events, allocated)
+                names[pmcid] = name
+                allocated += 1
+            elif kind == PROCEXEC:
+                pid, _, base, _ = PROCEXEC_BODY.unpack_from(data, body)
+                maps[pid] = [(base, _cstring(data, body + PROCEXEC_BODY.size, end))]
+            elif kind == MAP_IN:
+                pid, _, start = MAP_IN_BODY.unpack_from(data, body)
+                maps.setdefault(pid, []).append((start, _cstring(data, body + MAP_IN_BODY.size, end)))
+
+    for pid in maps:
+        maps[pid].sort()
+    totals, profiles = {}, {}
+    for pmcid, n in samples.items():
+        event = names.get(pmcid, f"pmc_{pmcid:#x}")
+        totals[event] = totals.get(event, 0) + n
+        profile = profiles.setdefault(event, Counter())
+        for (pid, pc), count in pcs[pmcid].items():
+            profile[_locate(maps.get(pid, ()), pc)] += count
+    return totals, profiles
+
+
+def _locate(regions, pc):
+    """(image, offset) of pc among the sorted (start, image) mappings of its process."""
+    image, base = '[unknown]', 0
+    for start, path in regions:
+        if start > pc:
+            break
+        image, base = path, start
+    return image, pc - base
+
+
+def sample_counts(path):
+    """{event: samples} of one log, as pmcstat_ingest.py reads from a .gmon file."""
+    return decode(path)[0]
+
+
+def write_profile(path, totals, profiles, top=TOP_OFFSETS):
+    """Write `@ EVENT [N samples]` sections with a flat per-image profile."""
+    with open(path, 'w') as f:
+        for event, total in totals.items():
+            f.write(f"@ {event.upper()} [{total} samples]\n\n")
+            images = Counter()
+            for (image, _), count in profiles[event].items():
+                images[image] += count
+            for image, count in images.most_common():
+                f.write(f"{100 * count / total:6.2f}%  [{count}]  {image}\n")
+                offsets = [(offset, n) for (name, offset), n in profiles[event].most_common() if name == image]
+                for offset, n in offsets[:top]:
+                    f.write(f"  {100 * n / count:6.2f}%  [{n}]  {offset:#x} @ {image}\n")
+            f.write("\n")
+
+
+def decode_file(path):
+    """Worker: decode one log into the .gmon next to it. Returns (path, samples, error)."""
+    try:
+        totals, profiles = decode(path)
+    except (OSError, ValueError, struct.error) as e:
+        return path, 0, str(e)
+    write_profile(path[:-len('.out')] + '.gmon', totals, profiles)
+    return path, sum(totals.values()), None
+
+
+def find_logs(roots, force=False):
+    """pmcstat.SN.out logs under roots without a .gmon (all of them with force)."""
+    logs = []
+    for root in roots:
+        for folder, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(files):
+                if name.startswith('pmcstat.S') and name.endswith('.out'):
+                    if force or name[:-len('.out')] + '.gmon' not in files:
+                        logs.append(os.path.join(folder, name))
+    return logs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode raw pmcstat logs into pmcstat.SN.gmon profiles')
+    parser.add_argument('roots', nargs='+', help='Result folders searched for pmcstat.SN.out logs')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Parallel decoders (default: all CPUs)')
+    parser.add_argument('--force', action='store_true', help='Decode logs that already have a .gmon')
+    args = parser.parse_args()
+
+    logs = find_logs(args.roots, args.force)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(decode_file, logs))
+    failed = [(path, error) for path, _, error in results if error]
+    print(f"Decoded {len(logs) - len(failed)} of {len(logs)} logs "
+          f"({sum(n for _, n, _ in results)} samples)", file=sys.stderr)
+    for path, error in failed:
+        print(f"  {error}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
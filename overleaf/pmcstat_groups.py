@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+PMU event-group packer for `_launch_pmcstat`.
+
+The Neoverse N1 PMU of Morello has six programmable counters, so the events
+printed by `run/verbose-list` are collected over several pmcstat passes, each
+re-running the whole workload followed by the settle/cool-down sleeps. This
+script packs an event list into the fewest passes that honour
+
+    --counters N        counters available per pass (default 6)
+    --together a,b,...  events that must be counted in the same pass; by
+                        default the numerator/denominator of every derived
+                        rate (CORRELATED), so that rates never mix passes
+    --apart a,b         events that must not share a pass
+    --fixed a,...       events counted by a dedicated counter (e.g. the
+                        PMUv3 cycle counter), which take no programmable slot
+    --anchor EVENT      count EVENT in every pass, so that pmcstat_ingest.py
+                        can rescale the passes to a common anchor
+    --cooldown MAX      replace the fixed sleeps by `_launch_cooldown MAX`
+                        (launch_cooldown.sh), which waits at most MAX s for
+                        the board to return to its idle baseline
+    --resume            skip the passes listed in $DONE (" S1 S2 ... "), the
+                        passes of the campaign journal already measured
+
+prints the pmcstat part of `_launch_pmcstat` on stdout (files pmcstat.S<N>.*,
+as read by pmcstat_ingest.py), and reports on stderr the projected campaign
+time against the fixed S1-S8 layout (LEGACY_GROUPS). The files of every
+finished pass are announced on fd 3 for `_launch_stream` (result_stream.py);
+without fd 3 the announcements do nothing.
+
+Three collection modes are emitted:
+
+    sampling   pmcstat -d -P EVENT -O pmcstat.SN.out, then pmcstat -R -G into
+               pmcstat.SN.gmon (sample counts and per-function callgraphs)
+    counting   pmcstat -p EVENT -o pmcstat.SN.count: exact process-wide
+               totals, no sampling interrupts and no -R/-G post-processing
+    raw        the sampling pass alone: pmcstat.SN.out (plus pmcstat.SN.events,
+               the events in -P order) is decoded off-board by pmclog.py
+"""
+
+import argparse
+import math
+import os
+import sys
+
+# The fixed layout formerly hardcoded in every run/setup
+LEGACY_GROUPS = [
+    ['inst_retired', 'cpu_cycles', 'stall_backend', 'stall_frontend', 'inst_spec', 'ase_spec'],
+    ['br_retired', 'br_mis_pred_retired', 'br_indirect_spec', 'br_return_spec', 'br_immed_spec'],
+    ['itlb_walk', 'l1i_tlb_refill', 'l1i_tlb', 'l1i_cache', 'l1i_cache_refill', 'vfp_spec'],
+    ['dtlb_walk', 'l1d_tlb', 'l1d_tlb_refill', 'l2d_tlb', 'l2d_tlb_refill', 'crypto_spec'],
+    ['l1d_cache', 'l1d_cache_rd', 'l1d_cache_refill', 'l1d_cache_wr', 'll_cache_miss_rd', 'll_cache_rd'],
+    ['l2d_cache', 'l2d_cache_rd', 'l2d_cache_refill', 'l2d_cache_allocate', 'l2d_cache_wr'],
+    ['mem_access', 'mem_access_rd', 'mem_access_wr', 'ld_spec', 'st_spec', 'dp_spec'],
+    ['mem_access_rd_ctag', 'mem_access_wr_ctag', 'cap_mem_access_rd', 'cap_mem_access_wr'],
+]
+
+DEFAULT_EVENTS = [event for group in LEGACY_GROUPS for event in group]
+
+# Events combined by the derived metrics (run/verbose, topdown.py), kept in one pass
+CORRELATED = [
+    ['inst_retired', 'cpu_cycles', 'stall_frontend', 'stall_backend'],   # IPC, Frontend/Backend bound
+    ['br_mis_pred_retired', 'br_retired'],                                # branch misprediction rate
+    ['l1i_cache_refill', 'l1i_cache'],                                    # L1I miss rate
+    ['l1d_cache_refill', 'l1d_cache'],                                    # L1D miss rate
+    ['l2d_cache_refill', 'l2d_cache'],                                    # L2D miss rate
+    ['ll_cache_miss_rd', 'll_cache_rd'],                                  # LLC read miss rate
+    ['itlb_walk', 'l1i_tlb', 'l1i_tlb_refill'],                           # ITLB walk rate
+    ['dtlb_walk', 'l1d_tlb', 'l1d_tlb_refill'],                           # DTLB walk rate
+    ['l2d_tlb_refill', 'l2d_tlb'],
+    ['cap_mem_access_rd', 'ld_spec', 'cap_mem_access_wr', 'st_spec',      # capability densities
+     'mem_access_rd', 'mem_access_wr'],                                   # and traffic share
+    ['mem_access_rd_ctag', 'mem_access_wr_ctag'],                         # tag overhead
+]
+
+# Exhaustive search budget once first-fit-decreasing is above the lower bound
+SEARCH_NODES = 200000
+
+
+def _clusters(events, together):
+    """Union the `together` sets (restricted to events) into clusters, in event order."""
+    parent = {event: event for event in events}
+
+    def find(event):
+        while parent[event] != event:
+            parent[event] = parent[parent[event]]
+            event = parent[event]
+        return event
+
+    for group in together:
+        members = [event for event in group if event in parent]
+        for event in members[1:]:
+            parent[find(event)] = find(members[0])
+
+    clusters = {}
+    for event in events:
+        clusters.setdefault(find(event), []).append(event)
+    return list(clusters.values())
+
+
+def _conflicts(a, b, apart):
+    return any(x in a and y in b or x in b and y in a for x, y in apart)
+
+
+def _first_fit(clusters, counters, apart, size):
+    groups = []
+    for cluster in sorted(clusters, key=size, reverse=True):
+        for group in groups:
+            if size(group) + size(cluster) <= counters and not _conflicts(group, cluster, apart):
+                group.extend(cluster)
+                break
+        else:
+            groups.append(list(cluster))
+    return groups
+
+
+def _search(clusters, counters, apart, size, n_groups):
+    """Depth-first search for a packing into n_groups passes, or None."""
+    clusters = sorted(clusters, key=size, reverse=True)
+    groups = [[] for _ in range(n_groups)]
+    budget = [SEARCH_NODES]
+
+    def place(i):
+        if i == len(clusters):
+            return True
+        budget[0] -= 1
+        if budget[0] < 0:
+            return False
+        tried = set()
+        for group in groups:
+            # Passes with the same fill are interchangeable, try one of them
+            if size(group) in tried or size(group) + size(clusters[i]) > counters:
+                continue
+            if _conflicts(group, clusters[i], apart):
+                continue
+            tried.add(size(group))
+            group.extend(clusters[i])
+            if place(i + 1):
+                return True
+            del group[-len(clusters[i]):]
+        return False
+
+    return [group for group in groups if group] if place(0) else None
+
+
+def pack(events, counters=6, together=CORRELATED, apart=(), fixed=(), anchor=None, strict=True):
+    """
+    Pack events into the fewest passes of at most `counters` programmable
+    events (`fixed` events are free) such that every `together` set shares a
+    pass and no `apart` pair does. Passes are returned in the order of their
+    first event in `events`, events in input order. An `anchor` event is
+    added first to every pass. Raises ValueError when the constraints cannot
+    be met; with strict=False, `together` sets that make a cluster too large
+    are dropped (last first) instead.
+    """
+    if anchor:
+        if any(anchor in pair for pair in apart):
+            raise ValueError(f"anchor {anchor} is counted in every pass and cannot be kept apart")
+        groups = pack(
+            [event for event in events if event != anchor],
+            counters - (anchor not in fixed),
+            [[event for event in group if event != anchor] for group in together],
+            apart, fixed, strict=strict,
+        )
+        return [[anchor] + group for group in groups]
+
+    events = list(dict.fromkeys(events))
+    size = lambda group: sum(event not in fixed for event in group)
+    together = list(together)
+    clusters = _clusters(events, together)
+    while not strict and together and any(size(cluster) > counters for cluster in clusters):
+        together.pop()
+        clusters = _clusters(events, together)
+    for cluster in clusters:
+        if size(cluster) > counters:
+            raise ValueError(f"{len(cluster)} events must share a pass but only {counters} counters: {cluster}")
+        for x, y in apart:
+            if x in cluster and y in cluster:
+                raise ValueError(f"{x} and {y} are both required together and apart")
+
+    groups = _first_fit(clusters, counters, apart, size)
+    for n_groups in range(max(1, math.ceil(size(events) / counters)), len(groups)):
+        found = _search(clusters, counters, apart, size, n_groups)
+        if found is not None:
+            groups = found
+            break
+
+    order = {event: i for i, event in enumerate(events)}
+    groups = [sorted(group, key=order.get) for group in groups]
+    return sorted(groups, key=lambda group: order[group[0]])
+
+
+def announce(*names):
+    """
+    Command announcing finished result files on fd 3, placed before the
+    settle/cool-down sleeps so that they are sent while the board is idle.
+    Always succeeds, and does nothing when fd 3 is closed.
+    """
+    echoes = "; ".join(f'echo "$PWD/{name}" >&3' for name in names)
+    return f"{{ ({echoes}) 2>/dev/null || true; }}"
+
+
+def pause(seconds, label, cooldown=0):
+    """A fixed sleep, or with cooldown the adaptive wait of _launch_cooldown (at most cooldown s)."""
+    return f"./_launch_cooldown {cooldown} {label}" if cooldown else f"sleep {seconds}"
+
+
+def skip_done(label):
+    """Guard skipping a pass listed in $DONE (campaign_journal.py)."""
+    return f'[ "${{DONE#* {label} }}" = "${{DONE}}" ] && \\'
+
+
+def launch_script(groups, command='./_launch_raw', settle=15, cool=10, mode='sampling', cooldown=0, resume=False):
+    """The pmcstat passes of `_launch_pmcstat`, one pmcstat block per group."""
+    lines = []
+    for n, group in enumerate(groups, 1):
+        settled = pause(settle, f"pmcstat.S{n}.settle", cooldown)
+        if resume:
+            lines.append(skip_done(f"S{n}"))
+        if mode == 'counting':
+            lines.append(f"pmcstat -p {group[0].upper()} \\")
+            lines.extend(f"  -p {event.upper()} \\" for event in group[1:])
+            lines.append(f"  -o pmcstat.S{n}.count -- {command} && {announce(f'pmcstat.S{n}.count')} && {settled}")
+        elif mode == 'raw':
+            lines.append(f"echo {' '.join(event.upper() for event in group)} > pmcstat.S{n}.events && \\")
+            lines.append(f"pmcstat -d -P {group[0].upper()} \\")
+            lines.extend(f"  -P {event.upper()} \\" for event in group[1:])
+            lines.append(f"  -O pmcstat.S{n}.out -- {command} && "
+                         f"{announce(f'pmcstat.S{n}.events', f'pmcstat.S{n}.out')} && {settled}")
+        else:
+            lines.append(f"pmcstat -d -P {group[0].upper()} \\")
+            lines.extend(f"  -P {event.upper()} \\" for event in group[1:])
+            lines.append(f"  -O pmcstat.S{n}.out -- {command} && {settled} && \\")
+            lines.append(f"  pmcstat -R pmcstat.S{n}.out -G pmcstat.S{n}.gmon && "
+                         f"{announce(f'pmcstat.S{n}.out', f'pmcstat.S{n}.gmon')} && "
+                         f"{pause(cool, f'pmcstat.S{n}.cool', cooldown)}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def campaign_seconds(workload_seconds, n_groups, settle=15, cool=10, decode=0.0, mode='sampling'):
+    """
+    Timing pass plus one workload run and settle per group, and in sampling
+    mode the -R/-G decode and cool-down (done off-board in raw mode).
+    """
+    per_group = workload_seconds + settle
+    if mode == 'sampling':
+        per_group += decode + cool
+    return (workload_seconds + settle) + n_groups * per_group
+
+
+def split_pairs(groups):
+    """Correlated pairs that a layout counts in different passes."""
+    counted = {event for group in groups for event in group}
+    split = []
+    for together in CORRELATED:
+        members = [event for event in together if event in counted]
+        if not any(all(event in group for event in members) for group in groups):
+            split.append(members)
+    return split
+
+
+def workload_seconds_from_store(path):
+    """{benchmark/abi: mean seconds} from the time_real_ms recorded in a metric store."""
+    from metric_store import open_store
+
+    store = open_store(path)
+    if 'time_real_ms' not in store.events:
+        return {}
+    e = store.position('event', 'time_real_ms')
+    seconds = {}
+    for b, benchmark in enumerate(store.benchmarks):
+        for a, abi in enumerate(store.abis):
+            recorded = store.present[b, a, :, e]
+            if recorded.any():
+                seconds[f"{benchmark}/{abi}"] = float(store.values[b, a, recorded, e].mean()) / 1000
+    return seconds
+
+
+def report(groups, counters, workloads, settle=15, cool=10, decode=0.0, mode='sampling', file=sys.stderr):
+    legacy = len(LEGACY_GROUPS)
+    print(f"Packed {sum(map(len, groups))} events into {len(groups)} {mode} passes of {counters} counters "
+          f"(fixed layout: {legacy} sampling passes)", file=file)
+    for n, group in enumerate(groups, 1):
+        print(f"  S{n}: {' '.join(group)}", file=file)
+    print(f"  correlated sets split across passes: {len(split_pairs(groups))} "
+          f"(fixed layout: {len(split_pairs(LEGACY_GROUPS))})", file=file)
+
+    if not workloads:
+        return
+    total_legacy = sum(campaign_seconds(t, legacy, settle, cool, decode) for t in workloads.values())
+    total_packed = sum(campaign_seconds(t, len(groups), settle, cool, decode, mode) for t in workloads.values())
+    saved = total_legacy - total_packed
+    share = 100 * saved / total_legacy if total_legacy else 0.0
+    print(f"Projected campaign time over {len(workloads)} runs: {total_packed / 3600:.2f} h "
+          f"(fixed layout {total_legacy / 3600:.2f} h, saved {saved / 3600:.2f} h = {share:.1f}%)", file=file)
+
+
+def _event_list(text):
+    return [event.strip().lower() for event in text.split(',') if event.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack PMU events into pmcstat passes and emit _launch_pmcstat')
+    parser.add_argument('--events', type=_event_list, default=DEFAULT_EVENTS,
+                        help='Comma-separated events (default: the events of run/verbose-list)')
+    parser.add_argument('--counters', type=int, default=6, help='Counters per pass (default: 6)')
+    parser.add_argument('--together', type=_event_list, action='append', default=None,
+                        help='Events that must share a pass (repeatable, replaces the correlated defaults)')
+    parser.add_argument('--apart', type=_event_list, action='append', default=[],
+                        help='Two events that must not share a pass (repeatable)')
+    parser.add_argument('--fixed', type=_event_list, default=[],
+                        help='Comma-separated events on dedicated counters (e.g. cpu_cycles)')
+    parser.add_argument('--anchor', type=str.lower, default=None,
+                        help='Event counted in every pass for cross-pass normalization (e.g. inst_retired)')
+    parser.add_argument('--layout', choices=['packed', 'fixed'], default='packed',
+                        help='packed (default) or the fixed S1-S8 layout')
+    parser.add_argument('--mode', choices=['sampling', 'counting', 'raw'], default='sampling',
+                        help='sampling (-P, gmon callgraphs, default), counting (-p, exact totals) '
+                             'or raw (-P logs decoded off-board by pmclog.py)')
+    parser.add_argument('--command', default='./_launch_raw', help='Workload command (default: ./_launch_raw)')
+    parser.add_argument('--settle', type=int, default=15, help='Sleep after each pass (s)')
+    parser.add_argument('--cool', type=int, default=10, help='Sleep after each decode (s)')
+    parser.add_argument('--cooldown', type=int, default=0,
+                        help='Wait at most this long (s) for an idle board instead of the sleeps (0: sleeps)')
+    parser.add_argument('--resume', action='store_true', help='Skip the passes listed in $DONE')
+    parser.add_argument('--seconds', type=float, default=None, help='Workload time (s) for the projection')
+    parser.add_argument('--store', help='Metric store whose time_real_ms drives the projection')
+    parser.add_argument('--decode', type=float, default=0.0, help='pmcstat -R -G time per pass (s)')
+    args = parser.parse_args()
+
+    if any(len(pair) != 2 for pair in args.apart):
+        parser.error('--apart takes exactly two events')
+    if args.layout == 'fixed':
+        if args.anchor:
+            parser.error('--anchor needs the packed layout, the fixed layout has no free counter')
+        groups = [[e for e in group if e in args.events] for group in LEGACY_GROUPS]
+        groups = [group for group in groups if group]
+    else:
+        try:
+            groups = pack(args.events, args.counters, args.together or CORRELATED, args.apart, args.fixed,
+                          args.anchor, strict=args.together is not None)
+        except ValueError as e:
+            parser.error(str(e))
+
+    print(launch_script(groups, args.command, args.settle, args.cool, args.mode, args.cooldown, args.resume))
+
+    workloads = {}
+    if args.store and os.path.exists(args.store):
+        workloads = workload_seconds_from_store(args.store)
+    if args.seconds is not None:
+        workloads = {'workload': args.seconds}
+    report(groups, args.counters, workloads, args.settle, args.cool, args.decode, args.mode)
+
+
+if __name__ == '__main__':
+    main()
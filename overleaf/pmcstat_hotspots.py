@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Per-function hotspots of pmcstat callgraphs, and their ABI differences.
+
+`run/verbose` and pmcstat_ingest.py only read the `@ EVENT [N samples]`
+headers of the `pmcstat -G` callgraph files. Below each header pmcstat lists
+every sampled function with its callers:
+
+    @ CPU_CYCLES [1234 samples]
+
+    40.52%  [500]      foo @ /usr/bin/bench
+     60.00%  [300]       bar
+      100.0%  [300]        main
+
+(each caller one level deeper, the image printed only when it changes).
+This script reads the whole tree into, for every event, the samples of each
+function (self: sampled in it, inclusive: sampled in it or below it) and of
+each callchain. Raw sampling logs (`pmcstat.SN.out`) are decoded with
+pmclog.py only for the passes without a callgraph (PMC_MODE=raw), as in
+pmcstat_ingest.py. Their PCs are not resolved to functions, and the builds
+of two ABIs lay out their code differently, so their samples are added up
+per image (`[raw] @ image`) and listed apart from the functions. The passes
+of a run folder are combined as pmcstat_ingest.py does, scaled to the
+median of their anchor event.
+
+    python3 pmcstat_hotspots.py <results folder> ... [--abi purecap] [--base hybrid] [--top N]
+
+ranks, for every benchmark and event of DIFF_EVENTS, the functions by their
+share of the increase from the base ABI to the other one; --hotspots lists
+the top functions of every ABI instead, --chains ranks callchains, and
+--tsv writes every row.
+"""
+
+import argparse
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from metric_store import ABIS
+from pmclog import decode
+from pmcstat_ingest import discover, find_anchor
+
+# Events whose purecap increase is attributed by default
+DIFF_EVENTS = [
+    'cpu_cycles',
+    'l1d_cache_refill',
+    'cap_mem_access_rd',
+    'cap_mem_access_wr',
+    'mem_access_rd_ctag',
+    'mem_access_wr_ctag',
+]
+
+TOP = 10
+
+SECTION = re.compile(r'^@ (\S+) \[(\d+) samples\]')
+NODE = re.compile(r'^( *)(\d+(?:\.\d+)?)% +\[(\d+)\]( +)(\S.*)$')
+# The ABI in SPEC binary names (<bench>_base.cheribsd-morello-<abi>-cheribuild_llvm)
+IMAGE_ABI = re.compile(r'cheribsd-morello-(?:hybrid|purecap-benchmark|purecap)')
+
+
+# Sample counters of a Profile
+COUNTERS = ('self', 'inclusive', 'chains', 'images')
+
+
+class Profile:
+    """
+    Samples of one event: total, per function (self and inclusive), per
+    callchain, and per image for the raw samples of unresolved PCs.
+    """
+
+    def __init__(self, total=0):
+        self.total = total
+        self.self = Counter()
+        self.inclusive = Counter()
+        self.chains = Counter()  # (function, caller, caller's caller, ...) -> samples
+        self.images = Counter()  # `[raw] @ image` -> samples
+
+    def add_chain(self, chain, count):
+        self.self[chain[0]] += count
+        self.chains[chain] += count
+        for function in set(chain):
+            self.inclusive[function] += count
+
+    def scaled(self, factor):
+        profile = Profile(self.total * factor)
+        for name in COUNTERS:
+            getattr(profile, name).update({key: value * factor for key, value in getattr(self, name).items()})
+        return profile
+
+
+def function_key(name, image):
+    """`name @ image`, the image by its file name without the ABI so that ABIs match."""
+    return f"{name} @ {IMAGE_ABI.sub('cheribsd-morello-<abi>', os.path.basename(image))}"
+
+
+def _depth(indent, spacing, count):
+    """
+    Depth of a callgraph node: its indentation, or else the blanks between
+    its `[count]` and its name, where pmcstat pads ` [count] ` to 12
+    characters and then adds one blank per level.
+    """
+    return indent if indent else max(0, spacing - 1 - max(8 - len(count), 1))
+
+
+def parse_callgraph(path):
+    """{event: Profile} of one pmcstat -G callgraph file, read line by line."""
+    profiles = {}
+    profile, stack, image = None, [], '[unknown]'
+
+    def pop(depth):
+        # chains ending at the nodes deeper than depth: their samples not passed on to callers
+        while len(stack) > depth:
+            count, below = stack[-1][1], stack[-1][2]
+            if count > below:
+                profile.add_chain(tuple(key for key, _, _ in stack), count - below)
+            stack.pop()
+
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            section = SECTION.match(line)
+            if section:
+                if profile:
+                    pop(0)
+                event = section.group(1).lower()
+                profile = profiles.setdefault(event, Profile())
+                profile.total += int(section.group(2))
+                stack = []
+                continue
+            node = NODE.match(line.rstrip('\n'))
+            if not node or profile is None:
+                continue
+            count, text = int(node.group(3)), node.group(5)
+            depth = min(_depth(len(node.group(1)), len(node.group(4)), node.group(3)), len(stack))
+            if ' @ ' in text:
+                text, image = text.rsplit(' @ ', 1)
+            pop(depth)
+            if stack:
+                stack[-1][2] += count
+            stack.append([function_key(text.strip(), image), count, 0])
+    if profile:
+        pop(0)
+    return profiles
+
+
+def parse_log(path):
+    """{event: Profile} of a raw sampling log, its samples added up per image (`[raw] @ image`)."""
+    totals, pcs = decode(path)
+    profiles = {}
+    for event, total in totals.items():
+        profile = profiles[event] = Profile(total)
+        for (image, _), count in pcs[event].items():
+            profile.images[function_key('[raw]', image)] += count
+    return profiles
+
+
+def run_profiles(run_dir, anchor='auto'):
+    """
+    {event: Profile} of one run folder: every pass read from its callgraph, or
+    its raw log when it has none, and scaled to the median anchor; events
+    sampled by several passes are averaged.
+    """
+    names = set(os.listdir(run_dir))
+    groups = {}
+    for name in sorted(names):
+        if not name.startswith('pmcstat.S'):
+            continue
+        group, kind = name[len('pmcstat.'):].rsplit('.', 1)
+        path = os.path.join(run_dir, name)
+        if kind == 'gmon':
+            groups[group] = parse_callgraph(path)
+        elif kind == 'out' and f'pmcstat.{group}.gmon' not in names:
+            groups[group] = parse_log(path)
+
+    totals = {group: {event: profile.total for event, profile in profiles.items()} for group, profiles in groups.items()}
+    anchor = find_anchor(totals, anchor)
+    anchors = sorted(events[anchor] for events in totals.values() if anchor and events.get(anchor, 0) > 0)
+    reference = None
+    if anchors:
+        mid = len(anchors) // 2
+        reference = anchors[mid] if len(anchors) % 2 else (anchors[mid - 1] + anchors[mid]) / 2
+
+    merged, passes = {}, Counter()
+    for group, profiles in groups.items():
+        scale = reference / totals[group][anchor] if reference and totals[group].get(anchor, 0) > 0 else 1.0
+        for event, profile in profiles.items():
+            passes[event] += 1
+            profile = profile.scaled(scale)
+            if event not in merged:
+                merged[event] = profile
+                continue
+            merged[event].total += profile.total
+            for name in COUNTERS:
+                getattr(merged[event], name).update(getattr(profile, name))
+    return {event: profile.scaled(1.0 / passes[event]) if passes[event] > 1 else profile
+            for event, profile in merged.items()}
+
+
+def run_unit(unit):
+    """Worker: (benchmark, abi, round, {event: Profile} or None, error)."""
+    benchmark, abi, round_, folder, anchor = unit
+    try:
+        return benchmark, abi, round_, run_profiles(folder, anchor), None
+    except (OSError, ValueError) as e:
+        return benchmark, abi, round_, None, f"{folder}: {e}"
+
+
+def counts(profile, view):
+    """Samples per key of a profile: 'self' or 'inclusive' per function, 'chains', or raw 'images'."""
+    if view == 'chains':
+        return {' <- '.join(chain): value for chain, value in profile.chains.items()}
+    return getattr(profile, view)
+
+
+def diff(base, other, view='self'):
+    """
+    [(key, base samples, other samples, change)] of every function (or
+    chain) of two profiles of one event, the largest increase first.
+    """
+    a, b = counts(base, view), counts(other, view)
+    rows = [(key, a.get(key, 0), b.get(key, 0), b.get(key, 0) - a.get(key, 0)) for key in set(a) | set(b)]
+    return sorted(rows, key=lambda row: (-row[3], row[0]))
+
+
+def print_diff(benchmark, event, base_abi, abi, base, other, rows, top, raw=()):
+    change = other.total - base.total
+    relative = f" ({100 * change / base.total:+.1f}%)" if base.total else ''
+    print(f"{benchmark} {event}: {base_abi} {base.total:.0f}, {abi} {other.total:.0f} samples{relative}")
+    width = max(12, len(base_abi), len(abi))
+    print(f"  {'change':>10} {'share':>7} {base_abi:>{width}} {abi:>{width}}  function")
+    for key, a, b, delta in list(rows[:top]) + list(raw[:top]):
+        share = f"{100 * delta / change:6.1f}%" if change > 0 else f"{'-':>7}"
+        print(f"  {delta:+10.0f} {share} {a:{width}.0f} {b:{width}.0f}  {key}")
+
+
+def print_hotspots(benchmark, abi, event, profile, view, top):
+    print(f"{benchmark} {abi} {event}: {profile.total:.0f} samples")
+    for key, value in Counter(counts(profile, view)).most_common(top) + profile.images.most_common(top):
+        print(f"  {100 * value / profile.total if profile.total else 0:6.2f}%  {value:12.0f}  {key}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-function pmcstat hotspots and their ABI differences')
+    parser.add_argument('roots', nargs='+', help='Results folders, e.g. results/speccpu-train-round-1')
+    parser.add_argument('--abi', default='purecap', choices=ABIS, help='ABI whose increase is attributed')
+    parser.add_argument('--base', default='hybrid', choices=ABIS, help='ABI it is compared with')
+    parser.add_argument('--event', nargs='+', help=f"Events (default: {' '.join(DIFF_EVENTS)})")
+    parser.add_argument('--benchmark', action='append', help='Only these benchmarks')
+    parser.add_argument('--size', help='Only SPEC run folders of this size (test/train/ref)')
+    parser.add_argument('--name', help='Benchmark name prefix for non-SPEC layouts, e.g. sqlite-bench')
+    parser.add_argument('--top', type=int, default=TOP, help=f'Rows per table (default: {TOP})')
+    parser.add_argument('--inclusive', action='store_true', help='Rank functions with the samples below them')
+    parser.add_argument('--chains', action='store_true', help='Rank callchains instead of functions')
+    parser.add_argument('--hotspots', action='store_true', help='List the top functions of every ABI instead')
+    parser.add_argument('--anchor', default='auto',
+                        help="Anchor event scaling the passes ('auto' or 'none', default: auto)")
+    parser.add_argument('--tsv', help='Write every row to this file')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Worker processes (default: all CPUs)')
+    args = parser.parse_args()
+
+    view = 'chains' if args.chains else 'inclusive' if args.inclusive else 'self'
+    events = [event.lower() for event in args.event] if args.event else DIFF_EVENTS
+    anchor = None if args.anchor == 'none' else args.anchor.lower()
+    units = [unit + (anchor,) for root in args.roots for unit in discover(root, args.name, args.size)
+             if not args.benchmark or unit[0] in args.benchmark]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(run_unit, units))
+
+    runs = {}
+    for benchmark, abi, round_, profiles, error in results:
+        if error:
+            print(f"  skipped {error}", file=sys.stderr)
+            continue
+        runs.setdefault((benchmark, round_), {})[abi] = profiles
+
+    tsv = []
+    for (benchmark, round_), abis in runs.items():
+        label = benchmark if len({r for _, r in runs}) == 1 else f"{benchmark} round {round_}"
+        for event in events:
+            if args.hotspots:
+                for abi, profiles in abis.items():
+                    if event in profiles:
+                        print_hotspots(label, abi, event, profiles[event], view, args.top)
+                        samples = list(counts(profiles[event], view).items()) + list(profiles[event].images.items())
+                        tsv += [(label, event, abi, key, value) for key, value in samples]
+                continue
+            if event not in abis.get(args.base, {}) or event not in abis.get(args.abi, {}):
+                continue
+            base, other = abis[args.base][event], abis[args.abi][event]
+            rows, raw = diff(base, other, view), diff(base, other, 'images')
+            print_diff(label, event, args.base, args.abi, base, other, rows, args.top, raw)
+            tsv += [(label, event, key, a, b, delta) for key, a, b, delta in rows + raw]
+    if args.tsv:
+        with open(args.tsv, 'w') as f:
+            header = ['benchmark', 'event', 'abi', 'key', 'samples'] if args.hotspots else \
+                ['benchmark', 'event', 'key', args.base, args.abi, 'change']
+            f.write('\t'.join(header) + '\n')
+            for row in tsv:
+                f.write('\t'.join(value if isinstance(value, str) else f"{value:.0f}" for value in row) + '\n')
+    if not runs:
+        print("No pmcstat callgraphs found", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+Single-pass pmcstat result ingester.
+
+Replaces the grep/sed/eval loops of the `run/verbose` and `run/verbose-list`
+scripts: every `pmcstat.S*.gmon` callgraph file is scanned once for its
+`@ event [N samples]` headers, `pmcstat.timing.out` for the real/user/sys
+times, and the totals are merged into a metric store (see metric_store.py).
+
+Both collection modes of pmcstat_groups.py are understood: sampling-mode
+`pmcstat.SN.gmon` files (sample counts) and counting-mode `pmcstat.SN.count`
+files (exact totals, header `# p/EVENT ...` followed by the counts). When a
+group has both, the exact totals win. The two modes differ in scale, so
+campaigns that are compared with each other should use the same mode.
+Raw-mode logs (`pmcstat.SN.out` without a .gmon) are decoded with pmclog.py.
+
+Every group is a separate run of the workload. When one event is counted in
+every group (`pmcstat_groups.py --anchor`), each group is rescaled so that
+its anchor matches the median anchor of the folder, and the per-group drift
+(anchor / median - 1) is kept in the store manifest and reported.
+
+Each (benchmark, ABI, round) result folder is one unit of work: units are
+parsed in parallel over a process pool, and units whose pmcstat files are
+unchanged since the last run (same size and mtime, or same SHA-256 when
+those differ) are skipped using the manifest kept in the store.
+
+Result layouts understood (ABI taken from the `cheribsd-morello-*` folder):
+    speccpu:      <root>/<bench>/run_base_<size>_cheribsd-morello-<abi>-cheribuild_llvm.0000/
+    sqlite/qjs:   <root>/build-cheribsd-morello-<abi>/results/
+    llama.cpp:    <root>/build-cheribsd-morello-<abi>/results_<type>/
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from metric_store import ABIS, INDEX_FILE, MetricStore, merge_records, store_lock
+from pmclog import sample_counts
+
+# PMU events in the order printed by run/verbose-list
+PMU_EVENTS = [
+    'inst_retired',
+    'cpu_cycles',
+    'stall_backend',
+    'stall_frontend',
+    'inst_spec',
+    'ase_spec',
+    'br_retired',
+    'br_mis_pred_retired',
+    'br_indirect_spec',
+    'br_return_spec',
+    'br_immed_spec',
+    'itlb_walk',
+    'l1i_tlb_refill',
+    'l1i_tlb',
+    'l1i_cache',
+    'l1i_cache_refill',
+    'vfp_spec',
+    'dtlb_walk',
+    'l1d_tlb',
+    'l1d_tlb_refill',
+    'l2d_tlb',
+    'l2d_tlb_refill',
+    'crypto_spec',
+    'l1d_cache',
+    'l1d_cache_rd',
+    'l1d_cache_refill',
+    'l1d_cache_wr',
+    'll_cache_miss_rd',
+    'll_cache_rd',
+    'l2d_cache',
+    'l2d_cache_rd',
+    'l2d_cache_refill',
+    'l2d_cache_allocate',
+    'l2d_cache_wr',
+    'mem_access',
+    'mem_access_rd',
+    'mem_access_wr',
+    'ld_spec',
+    'st_spec',
+    'dp_spec',
+    'mem_access_rd_ctag',
+    'mem_access_wr_ctag',
+    'cap_mem_access_rd',
+    'cap_mem_access_wr',
+]
+
+# Wall-clock times from pmcstat.timing.out, stored as integer milliseconds
+TIME_EVENTS = ['time_real_ms', 'time_user_ms', 'time_sys_ms']
+
+GMON_HEADER = re.compile(rb'^@ (\S+) \[(\d+) samples\]', re.MULTILINE)
+TIMING = re.compile(r'([0-9.]+)\s+(real|user|sys)\b')
+ABI_DIR = re.compile(r'cheribsd-morello-(hybrid|purecap-benchmark|purecap)(?:-cheribuild_llvm)?(?:\.\d+)?$')
+RUN_DIR = re.compile(r'^run_base_(\w+?)_cheribsd-morello-')
+ROUND_DIR = re.compile(r'round-(\d+)')
+
+# Anchors picked first when several events are counted in every group
+ANCHOR_PREFERENCE = ['inst_retired', 'cpu_cycles']
+# Groups whose anchor deviates more than this from the median are listed
+DRIFT_THRESHOLD = 0.02
+
+
+def parse_gmon(path):
+    """Return {event: samples} from the headers of one pmcstat -G callgraph file."""
+    counts = {}
+    if os.path.getsize(path) == 0:
+        return counts
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for match in GMON_HEADER.finditer(data):
+            event = match.group(1).decode().lower()
+            counts[event] = counts.get(event, 0) + int(match.group(2))
+    return counts
+
+
+def parse_counts(path):
+    """Return {event: total} from a pmcstat -p ... -o counting-mode file."""
+    events, totals = [], {}
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if line.lstrip().startswith('#'):
+                events = [field.rsplit('/', 1)[-1].lower() for field in line.lstrip()[1:].split()]
+            elif events and all(field.isdigit() for field in fields):
+                # One line at exit, or one delta line per interval with -w
+                for event, value in zip(events, fields):
+                    totals[event] = totals.get(event, 0) + int(value)
+    return totals
+
+
+def parse_timing(path):
+    """Return {time_real_ms, time_user_ms, time_sys_ms} from a `time` report."""
+    with open(path, 'r', errors='replace') as f:
+        text = f.read()
+    times = {}
+    for value, kind in TIMING.findall(text):
+        times[f'time_{kind}_ms'] = int(round(float(value) * 1000))
+    return times
+
+
+def read_groups(run_dir):
+    """{group: {event: value}} of one run folder, e.g. {'S1': {...}, ...}."""
+    groups = {}
+    names = result_files(run_dir)
+    counted = {name[:-len('.count')] for name in names if name.endswith('.count')}
+    for name in names:
+        group = name[len('pmcstat.'):].rsplit('.', 1)[0]
+        if name.endswith('.count'):
+            groups[group] = parse_counts(os.path.join(run_dir, name))
+        elif name.endswith('.gmon') and name[:-len('.gmon')] not in counted:
+            groups[group] = parse_gmon(os.path.join(run_dir, name))
+        elif name.startswith('pmcstat.S') and name.endswith('.out'):
+            groups[group] = sample_counts(os.path.join(run_dir, name))
+    return groups
+
+
+def find_anchor(groups, anchor='auto'):
+    """
+    The anchor event of a folder: `anchor` if it is counted in several
+    groups, or with 'auto' an event counted in every group (None if none).
+    """
+    counted = [set(events) for events in groups.values() if events]
+    if len(counted) < 2 or not anchor:
+        return None
+    if anchor != 'auto':
+        return anchor if sum(anchor in events for events in counted) > 1 else None
+    common = set.intersection(*counted)
+    for event in ANCHOR_PREFERENCE:
+        if event in common:
+            return event
+    return min(common) if common else None
+
+
+def normalize(groups, anchor):
+    """
+    Merge the groups of one folder into {event: value}, an event measured by
+    several groups (e.g. STALL_BACKEND in two passes of the legacy layout)
+    being their mean. With an anchor, every group is first scaled by
+    median / anchor and {group: drift} is returned alongside.
+
+    >>> normalize({'S1': {'stall_backend': 300, 'cpu_cycles': 900}, 'S2': {'stall_backend': 310}}, None)
+    ({'stall_backend': 305, 'cpu_cycles': 900}, {})
+    """
+    sums, passes, drift = {}, {}, {}
+    reference = None
+    if anchor:
+        anchors = sorted(events[anchor] for events in groups.values() if events.get(anchor, 0) > 0)
+        if anchors:
+            mid = len(anchors) // 2
+            reference = anchors[mid] if len(anchors) % 2 else (anchors[mid - 1] + anchors[mid]) / 2
+    for group, events in groups.items():
+        scale = 1.0
+        if reference and events.get(anchor, 0) > 0:
+            drift[group] = events[anchor] / reference - 1
+            scale = reference / events[anchor]
+        for event, value in events.items():
+            if reference and event == anchor:
+                continue
+            sums[event] = sums.get(event, 0) + (value * scale if scale != 1.0 else value)
+            passes[event] = passes.get(event, 0) + 1
+    metrics = {}
+    for event, total in sums.items():
+        value = total / passes[event] if passes[event] > 1 else total
+        metrics[event] = int(round(value)) if isinstance(value, float) else value
+    if reference:
+        metrics[anchor] = int(round(reference))
+    return metrics, drift
+
+
+def ingest_dir(run_dir, anchor='auto'):
+    """
+    Read every pmcstat result file of one (benchmark, ABI) run folder once.
+    Returns ({event: value}, {group: anchor drift}).
+    """
+    groups = read_groups(run_dir)
+    metrics, drift = normalize(groups, find_anchor(groups, anchor))
+    timing = os.path.join(run_dir, 'pmcstat.timing.out')
+    if os.path.exists(timing):
+        metrics.update(parse_timing(timing))
+    return metrics, drift
+
+
+def unit_key(benchmark, abi, round_):
+    return f"{round_}/{benchmark}/{abi}"
+
+
+def result_files(run_dir):
+    """
+    The pmcstat files read by ingest_dir: raw sampling logs (and their
+    .events) only for the groups that have neither a .gmon nor a .count.
+    """
+    names = [name for name in os.listdir(run_dir) if name.startswith('pmcstat.')]
+    decoded = {name.rsplit('.', 1)[0] for name in names if name.endswith(('.gmon', '.count'))}
+    return sorted(
+        name for name in names
+        if name.endswith(('.gmon', '.count')) or name == 'pmcstat.timing.out'
+        or name.startswith('pmcstat.S') and name.endswith(('.out', '.events'))
+        and name.rsplit('.', 1)[0] not in decoded
+    )
+
+
+def stat_fingerprint(run_dir):
+    """{file: [size, mtime_ns]} of the pmcstat files of one result folder."""
+    fingerprint = {}
+    for name in result_files(run_dir):
+        stat = os.stat(os.path.join(run_dir, name))
+        fingerprint[name] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def content_digest(run_dir):
+    """SHA-256 over the names and contents of the pmcstat files of one result folder."""
+    digest = hashlib.sha256()
+    for name in result_files(run_dir):
+        digest.update(name.encode() + b'\0')
+        with open(os.path.join(run_dir, name), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ingest_unit(folder, known_digest=None, anchor='auto'):
+    """
+    Worker: hash one result folder and parse it unless its content matches
+    known_digest. Returns (sha256, metrics or None, drift or None, error or
+    None); a folder that cannot be read, e.g. with a truncated raw log, has
+    an error and no metrics.
+    """
+    try:
+        digest = content_digest(folder)
+        if digest == known_digest:
+            return digest, None, None, None
+        return (digest,) + ingest_dir(folder, anchor) + (None,)
+    except (OSError, ValueError, struct.error) as e:
+        return None, None, None, f"{type(e).__name__}: {e}"
+
+
+def abi_of(path):
+    """ABI label of a result folder, or None."""
+    for part in reversed(os.path.normpath(path).split(os.sep)):
+        match = ABI_DIR.search(part)
+        if match:
+            return match.group(1)
+    return None
+
+
+def benchmark_of(rel_path, name=None):
+    """
+    Benchmark label of a result folder relative to the results root:
+    speccpu folders keep the SPEC name, `results_<type>` folders add the type.
+    """
+    parts = []
+    for part in os.path.normpath(rel_path).split(os.sep):
+        if ABI_DIR.search(part) or part in ('.', 'results'):
+            continue
+        parts.append(part[len('results_'):] if part.startswith('results_') else part)
+    if name:
+        parts.insert(0, name)
+    return '-'.join(parts) if parts else os.path.basename(rel_path)
+
+
+def round_of(root, default='1'):
+    match = ROUND_DIR.search(os.path.basename(os.path.normpath(root)))
+    return match.group(1) if match else default
+
+
+def discover(root, name=None, size=None, round_=None):
+    """Yield (benchmark, abi, round, folder) for every result folder under root."""
+    round_ = round_ or round_of(root)
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        if not any(f.startswith('pmcstat.') for f in files):
+            continue
+        abi = abi_of(folder)
+        if abi is None:
+            continue
+        run = RUN_DIR.match(os.path.basename(folder))
+        if size and run and run.group(1) != size:
+            continue
+        yield benchmark_of(os.path.relpath(folder, root), name), abi, round_, folder
+
+
+def _stored_metrics(store, benchmark, abi, round_):
+    """Metrics of one unit as previously merged into store."""
+    b = store.position('benchmark', benchmark)
+    a = store.position('abi', abi)
+    r = store.position('round', str(round_))
+    values, present = store.values[b, a, r], store.present[b, a, r]
+    return {event: int(values[e]) for e, event in enumerate(store.events) if present[e]}
+
+
+def ingest(roots, store=None, name=None, size=None, round_=None, benchmarks=None, jobs=None, force=False,
+           anchor='auto', drift_threshold=DRIFT_THRESHOLD):
+    """
+    Ingest one or more results trees, merge new or changed units into store
+    (if given) and return the records of every unit, in discovery order.
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+    units = [
+        unit
+        for root in roots
+        for unit in discover(root, name, size, round_)
+        if not benchmarks or unit[0] in benchmarks
+    ]
+
+    stored = None
+    if store:
+        with store_lock(store):
+            stored = MetricStore(store) if os.path.exists(os.path.join(store, INDEX_FILE)) else None
+    known = {} if stored is None or force else stored.units
+
+    # Units whose files kept their size and mtime are skipped without being read
+    manifest, todo = {}, []
+    for benchmark, abi, round_label, folder in units:
+        key = unit_key(benchmark, abi, round_label)
+        files = stat_fingerprint(folder)
+        entry = known.get(key, {}) if known.get(key, {}).get('anchor', 'auto') == anchor else {}
+        manifest[key] = {'files': files, 'sha256': entry.get('sha256'), 'anchor': anchor,
+                         'drift': entry.get('drift', {})}
+        if entry.get('files') != files:
+            todo.append((key, folder))
+
+    folders = [folder for _, folder in todo]
+    digests = [manifest[key]['sha256'] for key, _ in todo]
+    anchors = [anchor] * len(todo)
+    if jobs == 1 or len(todo) <= 1:
+        results = list(map(ingest_unit, folders, digests, anchors))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(ingest_unit, folders, digests, anchors))
+
+    parsed, failed = {}, set()
+    for (key, folder), (digest, metrics, drift, error) in zip(todo, results):
+        if error:
+            # Left out of the manifest, so the folder is read again next time
+            print(f"{folder}: {error}, skipped", file=sys.stderr)
+            failed.add(key)
+            del manifest[key]
+            continue
+        manifest[key]['sha256'] = digest
+        if metrics is not None:
+            parsed[key] = metrics
+            manifest[key]['drift'] = drift
+
+    records = []
+    for benchmark, abi, round_label, folder in units:
+        key = unit_key(benchmark, abi, round_label)
+        if key in parsed:
+            metrics = parsed[key]
+        elif key in failed:
+            continue
+        elif stored is not None:
+            metrics = _stored_metrics(stored, benchmark, abi, round_label)
+        else:
+            metrics = ingest_dir(folder, anchor)[0]
+        records.append((benchmark, abi, round_label, metrics))
+
+    if store:
+        merge_records(store, [r for r in records if unit_key(*r[:3]) in parsed], units=manifest)
+    print(f"Parsed {len(parsed)} of {len(units)} result folders "
+          f"({len(units) - len(parsed) - len(failed)} unchanged, {len(failed)} failed)", file=sys.stderr)
+    keys = [unit_key(*unit[:3]) for unit in units]
+    print_drift({key: manifest[key]['drift'] for key in keys if key in manifest}, drift_threshold)
+    return records
+
+
+def print_drift(drifts, threshold=DRIFT_THRESHOLD, file=sys.stderr):
+    """Summarize the per-group anchor drift of every unit, listing those above threshold."""
+    anchored = {key: drift for key, drift in drifts.items() if drift}
+    if not anchored:
+        return
+    worst = max(abs(d) for drift in anchored.values() for d in drift.values())
+    print(f"Anchor drift: {len(anchored)} folders normalized, max |drift| {100 * worst:.2f}%", file=file)
+    for key, drift in anchored.items():
+        if any(abs(d) > threshold for d in drift.values()):
+            groups = ", ".join(f"{group} {100 * d:+.2f}%" for group, d in sorted(drift.items()))
+            print(f"  {key}: {groups}", file=file)
+
+
+def as_legacy(records):
+    """
+    {benchmark: {event: (hybrid, purecap-benchmark, purecap)}} as printed by
+    verbose-list. With several rounds each value is the (rounded) mean.
+    """
+    data, rounds = {}, {}
+    for benchmark, abi, _, metrics in records:
+        values = data.setdefault(benchmark, {})
+        counts = rounds.setdefault(benchmark, [0] * len(ABIS))
+        counts[ABIS.index(abi)] += 1
+        for event in PMU_EVENTS + [e for e in metrics if e not in PMU_EVENTS]:
+            row = values.setdefault(event, [0] * len(ABIS))
+            row[ABIS.index(abi)] += metrics.get(event, 0)
+    for benchmark, values in data.items():
+        counts = rounds[benchmark]
+        for row in values.values():
+            row[:] = [round(v / n) if n > 1 else v for v, n in zip(row, counts)]
+    return data
+
+
+def print_legacy(data, file=sys.stdout):
+    print("{", file=file)
+    for benchmark, metrics in data.items():
+        print(f"'{benchmark}': {{", file=file)
+        for event in PMU_EVENTS:
+            print(f"'{event}': {tuple(metrics.get(event, [0] * len(ABIS)))},", file=file)
+        print("},", file=file)
+    print("}", file=file)
+
+
+def _rate(num, den, scale=100.0):
+    return [round(scale * n / d, 2) if d else 0.0 for n, d in zip(num, den)]
+
+
+def print_report(data, file=sys.stdout):
+    """Derived rates formerly computed with bc in run/verbose."""
+    zero = [0] * len(ABIS)
+    for benchmark, m in data.items():
+        g = lambda event: m.get(event, zero)
+        print(f"--------------{benchmark}----------------", file=file)
+        print(" ".join(ABIS), file=file)
+        print(",".join(f"{t / 1000:.2f}" for t in g('time_real_ms')), file=file)
+        rows = [
+            ("IPC:", [round(n / d, 3) if d else 0.0 for n, d in zip(g('inst_retired'), g('cpu_cycles'))]),
+            ("Branch Misprediction Rate (%):", _rate(g('br_mis_pred_retired'), g('br_retired'))),
+            ("L1I Cache Miss Rate (%):", _rate(g('l1i_cache_refill'), g('l1i_cache'))),
+            ("L1D Cache Miss Rate (%):", _rate(g('l1d_cache_refill'), g('l1d_cache'))),
+            ("L2D Cache Miss Rate (%):", _rate(g('l2d_cache_refill'), g('l2d_cache'))),
+            ("LLC Read MR (%):", _rate(g('ll_cache_miss_rd'), g('ll_cache_rd'))),
+            ("ITLB Page Walk Rate (%):", _rate(g('itlb_walk'), g('l1i_tlb'))),
+            ("DTLB Page Walk Rate (%):", _rate(g('dtlb_walk'), g('l1d_tlb'))),
+            ("Capability Load Density (%):", _rate(g('cap_mem_access_rd'), g('ld_spec'))),
+            ("Capability Store Density (%):", _rate(g('cap_mem_access_wr'), g('st_spec'))),
+            ("Capability Traffic Share (%):", _rate(
+                [a + b for a, b in zip(g('cap_mem_access_rd'), g('cap_mem_access_wr'))],
+                [a + b for a, b in zip(g('mem_access_rd'), g('mem_access_wr'))])),
+            ("Capability Tag Overhead (%):", _rate(
+                [a + b for a, b in zip(g('mem_access_rd_ctag'), g('mem_access_wr_ctag'))],
+                [a + b for a, b in zip(g('mem_access_rd'), g('mem_access_wr'))])),
+        ]
+        for title, values in rows:
+            print(" , ".join([title] + [str(v) for v in values]), file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest pmcstat results into the metric store')
+    parser.add_argument('roots', nargs='+', help='Results folders, e.g. results/speccpu-train-round-*')
+    parser.add_argument('--store', help='Metric store to merge into (created if missing)')
+    parser.add_argument('--name', help='Benchmark name prefix for non-SPEC layouts, e.g. sqlite-bench')
+    parser.add_argument('--size', help='Only ingest SPEC run folders of this size (test/train/ref)')
+    parser.add_argument('--round', dest='round_', help='Round label (default: from "round-N" in root, else 1)')
+    parser.add_argument('--benchmark', action='append', help='Only ingest these benchmarks')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Worker processes (default: all CPUs)')
+    parser.add_argument('--force', action='store_true', help='Re-parse every folder, ignoring the manifest')
+    parser.add_argument('--anchor', default='auto',
+                        help="Anchor event for cross-group normalization ('auto' or 'none', default: auto)")
+    parser.add_argument('--drift-threshold', type=float, default=DRIFT_THRESHOLD,
+                        help='List groups whose anchor drifts more than this fraction (default: 0.02)')
+    parser.add_argument('--print', dest='print_', action='store_true', help='Print the verbose-list dict')
+    parser.add_argument('--report', action='store_true', help='Print times and derived rates')
+    args = parser.parse_args()
+
+    records = ingest(args.roots, args.store, args.name, args.size, args.round_, args.benchmark,
+                     jobs=args.jobs, force=args.force,
+                     anchor=None if args.anchor == 'none' else args.anchor.lower(),
+                     drift_threshold=args.drift_threshold)
+    data = as_legacy(records)
+    if args.print_:
+        print_legacy(data)
+    if args.report:
+        print_report(data)
+
+
+if __name__ == '__main__':
+    main()
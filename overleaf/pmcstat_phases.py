@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Time-resolved phase analysis of raw pmcstat sampling logs.
+
+The ingested metrics are one total per event and run, which hides a
+benchmark that is slower in only one part of its execution. The sampling
+logs of `pmcstat -P` (`pmcstat.SN.out`, see pmclog.py) keep the TSC of every
+sample, so for every (benchmark, ABI) run folder this script
+
+  1. streams each pass log once, a chunk at a time, into per-event sample
+     counts over fixed TSC intervals (OVERSAMPLING per output interval). The
+     interval width doubles, merging neighbouring intervals, whenever the log
+     outgrows twice that many, so memory stays O(intervals x events)
+     whatever the log size;
+  2. aligns the passes, which are separate runs of the workload, on progress:
+     the cumulative share of the anchor event (PMC_ANCHOR, e.g. inst_retired)
+     when a pass samples it, the elapsed share of the log otherwise. Every
+     pass is resampled onto --intervals common intervals and, with an
+     anchor, scaled to the median anchor total as pmcstat_ingest.py does;
+  3. splits the intervals into contiguous phases: the least-squares optimal
+     segmentation of the event mix (variance-stabilized sample counts in
+     units of their noise level), with the number of phases (at most
+     --max-phases) chosen by BIC, so that a stationary log is one phase;
+  4. sums every phase's counters and runs them through the top-down engine
+     (topdown.py) when the passes sampled all of its events.
+
+    python3 pmcstat_phases.py <run folder> ... [--intervals N] [--max-phases K] [--tsv series.tsv] [-j N]
+"""
+
+import argparse
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pmclog import CALLCHAIN, PCSAMPLE, PMCALLOCATE, PMCALLOCATEDYN, allocation, events_file, sample, stream
+from pmcstat_ingest import find_anchor
+from topdown import TOPDOWN_EVENTS, TOPDOWN_METRICS, top_down_matrix
+
+# Common intervals of the aligned time series
+INTERVALS = 100
+MAX_PHASES = 6
+# TSC intervals decoded per common interval, so that resampling barely blurs phase changes
+OVERSAMPLING = 8
+# Shortest phase, in intervals
+MIN_LENGTH = 5
+# Noise level (in Poisson units) below which a variance-stabilized column is taken as noise-free
+NOISE_FLOOR = 1e-6
+
+# Top-down metrics printed per phase
+PHASE_METRICS = ['IPC', 'Retiring', 'Frontend_Bound', 'Backend_Bound', 'Bad_Speculation', 'Memory_Bound']
+
+
+def timeline(path, intervals=INTERVALS, events=None):
+    """
+    Stream one pmcstat log into samples per fixed TSC interval. Returns
+    (first TSC, last TSC, interval width in TSC ticks, {event: counts}), the
+    counts covering between `intervals` and 2 x `intervals` intervals once
+    the log is long enough.
+    """
+    events = events if events is not None else events_file(path)
+    names, allocated = {}, 0
+    counts = {}  # pmcid -> samples per interval
+    limit = 2 * intervals
+    start, last, width, used = None, 0, 1, 0
+
+    with open(path, 'rb') as f:
+        for kind, tsc, data, body, end in stream(f, path):
+            if kind in (PCSAMPLE, CALLCHAIN):
+                if start is None:
+                    start = tsc
+                last = max(last, tsc)
+                index = max(tsc - start, 0) // width
+                while index >= limit:
+                    # coarsen: merge neighbouring intervals and double the width
+                    width *= 2
+                    index //= 2
+                    used = (used + 1) // 2
+                    for series in counts.values():
+                        series[:] = [a + b for a, b in zip(series[0::2], series[1::2])] + [0] * intervals
+                pmcid = sample(kind, data, body)[2]
+                series = counts.get(pmcid)
+                if series is None:
+                    series = counts[pmcid] = [0] * limit
+                series[index] += 1
+                used = max(used, index + 1)
+            elif kind in (PMCALLOCATE, PMCALLOCATEDYN):
+                pmcid, name = allocation(kind, data, body, end, events, allocated)
+                names[pmcid] = name
+                allocated += 1
+
+    series = {}
+    for pmcid, values in counts.items():
+        event = names.get(pmcid, f"pmc_{pmcid:#x}")
+        series[event] = series.get(event, 0) + np.array(values[:used], dtype=np.float64)
+    return start or 0, last, width, series
+
+
+def timeline_file(path, intervals=INTERVALS):
+    """Worker: (path, timeline, error) of one log, decoded at OVERSAMPLING x intervals."""
+    try:
+        return path, timeline(path, OVERSAMPLING * intervals), None
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+    except struct.error as e:
+        # a sample record cut short at the end of the log, the message does not name the log
+        return path, None, f"{path}: truncated record ({e})"
+
+
+def align(timelines, intervals=INTERVALS, anchor='auto'):
+    """
+    Resample the {pass: timeline} of one run folder onto `intervals` common
+    progress intervals. Returns (events, (intervals, events) matrix, anchor);
+    an event sampled by several passes is their mean.
+    """
+    totals = {group: {event: values.sum() for event, values in series.items()}
+              for group, (_, _, _, series) in timelines.items()}
+    anchor = find_anchor(totals, anchor)
+    references = [events[anchor] for events in totals.values() if anchor and events.get(anchor, 0) > 0]
+    reference = np.median(references) if references else None
+
+    grid = np.linspace(0.0, 1.0, intervals + 1)
+    sums, passes = {}, {}
+    for group, (start, last, width, series) in sorted(timelines.items()):
+        if not series:
+            continue
+        length = len(next(iter(series.values())))
+        if anchor in series and series[anchor].sum() > 0:
+            progress = np.concatenate([[0.0], np.cumsum(series[anchor])]) / series[anchor].sum()
+        elif last > start:
+            # the last interval ends past the last sample
+            progress = np.minimum(np.arange(length + 1) * width / (last + 1 - start), 1.0)
+        else:
+            progress = np.linspace(0.0, 1.0, length + 1)
+        scale = reference / totals[group][anchor] if reference and totals[group].get(anchor, 0) > 0 else 1.0
+        for event, values in series.items():
+            cumulative = np.concatenate([[0.0], np.cumsum(values)])
+            resampled = np.diff(np.interp(grid, progress, cumulative)) * scale
+            sums[event] = sums.get(event, 0) + resampled
+            passes[event] = passes.get(event, 0) + 1
+    events = sorted(sums)
+    matrix = np.stack([sums[event] / passes[event] for event in events], axis=1) if events else np.zeros((intervals, 0))
+    return events, matrix, anchor
+
+
+def _segment_costs(features, min_length):
+    """
+    (n + 1, n + 1) squared error around their mean of the rows of every
+    segment [i, j), inf for segments shorter than min_length.
+    """
+    n = len(features)
+    s1 = np.concatenate([np.zeros((1, features.shape[1])), np.cumsum(features, axis=0)])
+    s2 = np.concatenate([[0.0], np.cumsum((features * features).sum(axis=1))])
+    i, j = np.triu_indices(n + 1, 1)
+    costs = np.full((n + 1, n + 1), np.inf)
+    costs[i, j] = s2[j] - s2[i] - ((s1[j] - s1[i]) ** 2).sum(axis=1) / (j - i)
+    costs[np.arange(n + 1)[None, :] - np.arange(n + 1)[:, None] < min_length] = np.inf
+    return costs
+
+
+def segment(matrix, max_phases=MAX_PHASES, min_length=MIN_LENGTH):
+    """
+    Split the intervals (rows of matrix) into contiguous phases; returns the
+    phase boundaries [0, ..., n]. Each column is variance-stabilized
+    (2 sqrt(x + 3/8), unit variance for Poisson sample counts) and divided by
+    its noise level, as the passes are averaged and rescaled and real counts
+    are overdispersed: MAD(first differences) / sqrt(2), which the few phase
+    changes barely move. Every number of phases is segmented optimally by
+    dynamic programming, and the number of phases minimizing
+    SSE + (phases - 1)(columns + 1) log n (BIC, SSE in noise variances) is kept.
+    """
+    n = len(matrix)
+    features = 2.0 * np.sqrt(np.maximum(matrix, 0.0) + 0.375)
+    if n > 1:
+        noise = 1.4826 * np.median(np.abs(np.diff(features, axis=0)), axis=0) / np.sqrt(2)
+        # columns without noise, such as the anchor the passes are aligned on, keep the Poisson unit
+        features = features / np.where(noise > NOISE_FLOOR, noise, 1.0)
+    costs = _segment_costs(features, min_length)
+    best = costs[0].copy()  # best[j]: least error of rows [0, j) in k phases
+    back = []               # back[k - 2][j]: end of the first k - 1 phases of that split
+    results = [(best[n], [0, n])]
+    for _ in range(2, min(max_phases, n // max(min_length, 1)) + 1):
+        total = best[:, None] + costs  # total[i, j]: first k - 1 phases end at i, the last is [i, j)
+        ends = np.argmin(total, axis=0)
+        best = total[ends, np.arange(n + 1)]
+        back.append(ends)
+        if not np.isfinite(best[n]):
+            break
+        bounds = [n]
+        for ends in reversed(back):
+            bounds.append(int(ends[bounds[-1]]))
+        results.append((best[n], [0] + bounds[::-1]))
+    penalty = (features.shape[1] + 1) * np.log(max(n, 2))
+    scores = [error + (len(bounds) - 2) * penalty for error, bounds in results]
+    return results[int(np.argmin(scores))][1]
+
+
+def phases(events, matrix, bounds):
+    """[(start, end, {event: count}, {metric: value})] of every phase, the metrics being top-down when possible."""
+    out = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        counters = matrix[start:end].sum(axis=0)
+        values = dict(zip(events, counters))
+        metrics = {}
+        if all(event in values for event in TOPDOWN_EVENTS):
+            row = top_down_matrix([values[event] for event in TOPDOWN_EVENTS], verbose=False)
+            metrics = dict(zip(TOPDOWN_METRICS, row.tolist()))
+        elif values.get('cpu_cycles', 0) > 0 and 'inst_retired' in values:
+            metrics['IPC'] = values['inst_retired'] / values['cpu_cycles']
+        out.append((start, end, values, metrics))
+    return out
+
+
+def find_runs(roots):
+    """{run folder: [pmcstat.SN.out logs]} under roots."""
+    runs = {}
+    for root in roots:
+        for folder, dirs, files in os.walk(root):
+            dirs.sort()
+            logs = [os.path.join(folder, name) for name in sorted(files)
+                    if name.startswith('pmcstat.S') and name.endswith('.out')]
+            if logs:
+                runs[folder] = logs
+    return runs
+
+
+def print_phases(run, events, matrix, anchor, bounds, passes):
+    intervals = len(matrix)
+    print(f"{run}: {passes} passes, {len(events)} events, {intervals} intervals of "
+          f"{'the ' + anchor + ' progress' if anchor else 'elapsed time'}, {len(bounds) - 1} phases")
+    cycles = matrix[:, events.index('cpu_cycles')].sum() if 'cpu_cycles' in events else 0
+    columns = PHASE_METRICS
+    print(f"  {'phase':<6} {'progress':<12} {'cycles':>7} " + ' '.join(f"{m:>{max(len(m), 8)}}" for m in columns))
+    for number, (start, end, values, metrics) in enumerate(phases(events, matrix, bounds), 1):
+        share = f"{100 * values['cpu_cycles'] / cycles:6.1f}%" if cycles else f"{'-':>7}"
+        cells = ' '.join(f"{metrics[m]:{max(len(m), 8)}.3f}" if m in metrics else f"{'-':>{max(len(m), 8)}}"
+                         for m in columns)
+        print(f"  {number:<6} {start / intervals:.2f}-{end / intervals:.2f}    {share} {cells}")
+
+
+def write_series(path, series):
+    """Write the aligned time series and phase of every interval as TSV."""
+    with open(path, 'w') as f:
+        f.write("run\tinterval\tprogress\tphase\tevent\tsamples\n")
+        for run, events, matrix, bounds in series:
+            phase = np.searchsorted(bounds, np.arange(len(matrix)), side='right')
+            for i, row in enumerate(matrix):
+                for event, value in zip(events, row):
+                    f.write(f"{run}\t{i}\t{i / len(matrix):.4f}\t{phase[i]}\t{event}\t{value:.3f}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time series and phases of raw pmcstat sampling logs')
+    parser.add_argument('roots', nargs='+', help='Run folders, or folders searched for them')
+    parser.add_argument('--intervals', type=int, default=INTERVALS, help=f'Progress intervals (default: {INTERVALS})')
+    parser.add_argument('--max-phases', type=int, default=MAX_PHASES, help=f'Most phases per run (default: {MAX_PHASES})')
+    parser.add_argument('--min-length', type=int, default=MIN_LENGTH,
+                        help=f'Shortest phase, in intervals (default: {MIN_LENGTH})')
+    parser.add_argument('--anchor', default='auto',
+                        help="Event aligning the passes ('auto' or 'none', default: auto)")
+    parser.add_argument('--tsv', help='Write the per-interval series and phases to this file')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Parallel decoders (default: all CPUs)')
+    args = parser.parse_args()
+
+    runs = find_runs(args.roots)
+    logs = [log for run_logs in runs.values() for log in run_logs]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = {path: (timeline, error) for path, timeline, error in
+                   pool.map(timeline_file, logs, [args.intervals] * len(logs))}
+
+    series, failed = [], []
+    for run, run_logs in runs.items():
+        failed += [(log, results[log][1]) for log in run_logs if results[log][1]]
+        timelines = {os.path.basename(log)[len('pmcstat.'):-len('.out')]: results[log][0]
+                     for log in run_logs if results[log][0]}
+        if not timelines:
+            continue
+        events, matrix, anchor = align(timelines, args.intervals, None if args.anchor == 'none' else args.anchor.lower())
+        if not events:
+            continue
+        bounds = segment(matrix, args.max_phases, args.min_length)
+        print_phases(run, events, matrix, anchor, bounds, len(timelines))
+        series.append((run, events, matrix, bounds))
+    if args.tsv:
+        write_series(args.tsv, series)
+    for path, error in failed:
+        print(f"  skipped {error}", file=sys.stderr)
+    if not series:
+        print("No pmcstat sampling logs decoded", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Make-style rendering of the figures and the top-down analysis.
+
+Every target below lists its command, the data files it reads and the files
+it writes; the script and the local modules it imports (metric_store.py,
+campaign_stats.py, ...) are added to its inputs automatically. A target is
+stale when the SHA-256 of its command and inputs differs from its last
+successful render (recorded in .render/state.json) or one of its outputs is
+missing; only stale targets are run, in parallel processes (-j), and a target
+reading another target's output runs after it. The data files are imported
+into their metric stores once, before the targets start.
+
+    python ./render.py [-j N] [--force] [--dry-run] [target ...]
+
+The targets' output goes to .render/<target>.log (top-down-analysis.out for
+the analysis). Figures 3, 4 and 6 draw top-down-analysis-data.txt, the
+full-precision top-down metrics with their manual edits, which render reports
+as out of date once top-down-analysis.py has written newer metrics.
+"""
+
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from distribute import hash_files
+from metric_store import open_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = os.path.join(HERE, '.render')
+STATE_FILE = os.path.join(STATE_DIR, 'state.json')
+
+RAW_DATA = 'raw-profiling-pmu-event-data.txt'
+TOPDOWN_DATA = 'top-down-analysis-data.txt'
+TOPDOWN_FULL = 'top-down-analysis-data-full.txt'
+
+
+@dataclass
+class Target:
+    name: str
+    command: list  # script and arguments, run in this folder
+    inputs: list = field(default_factory=list)  # data files or glob patterns
+    outputs: list = field(default_factory=list)
+    stdout: str = None  # file receiving the output instead of the log
+    stores: list = field(default_factory=list)  # data files read through metric_store.py
+
+
+TARGETS = [
+    Target('top-down-analysis', ['top-down-analysis.py'], [RAW_DATA], [TOPDOWN_FULL],
+           stdout='top-down-analysis.out', stores=[RAW_DATA]),
+    Target('figure1', ['figure1-macroscopic-performance.py'], ['macroscopic-performance-stats.txt'],
+           ['figure1-macroscopic-performance.png']),
+    Target('figure2', ['figure2-macroscopic-binary-size.py'], ['../results/readelf/spec_run_readelf_*'],
+           ['figure2-macroscopic-binary-size.png']),
+    Target('figure3', ['figure3-top-level.py'], [TOPDOWN_DATA, 'top-down-analysis-stats.txt'],
+           ['figure3-top-level.png'], stores=[TOPDOWN_DATA]),
+    Target('figure4', ['figure4-backend-level.py'], [TOPDOWN_DATA, 'top-down-analysis-stats.txt'],
+           ['figure4-backend-level.png'], stores=[TOPDOWN_DATA]),
+    Target('figure5', ['figure5-spec-instructions-ratio-boxplot.py'], [RAW_DATA],
+           ['figure5-spec-instructions-ratio-boxplot.png'], stores=[RAW_DATA]),
+    Target('figure6', ['figure6-memory-level.py'], [TOPDOWN_DATA, 'top-down-analysis-stats.txt'],
+           ['figure6-memory-level.png'], stores=[TOPDOWN_DATA]),
+    Target('figure7', ['figure7-metric-correlation.py', '--chart-type', 'combined'], [RAW_DATA],
+           ['figure7-metric-correlation.png'], stores=[RAW_DATA]),
+    Target('figure8', ['figure8-optimization-impact.py'], [], ['figure8-optimization-impact.png']),
+]
+
+
+def local_modules(script, seen=None):
+    """The modules of this folder imported by script, recursively."""
+    seen = set() if seen is None else seen
+    with open(os.path.join(HERE, script), 'r') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            module = name.split('.')[0] + '.py'
+            if module not in seen and os.path.exists(os.path.join(HERE, module)):
+                seen.add(module)
+                local_modules(module, seen)
+    return seen
+
+
+def input_files(target):
+    """The files a target depends on: its script, local modules and data files."""
+    files = [target.command[0]] + sorted(local_modules(target.command[0]))
+    for pattern in target.inputs:
+        matches = sorted(os.path.relpath(path, HERE) for path in glob.glob(os.path.join(HERE, pattern)))
+        files += matches or [pattern]
+    return files
+
+
+def target_key(target):
+    """SHA-256 of a target's command and the contents of its input files (missing ones included)."""
+    files = input_files(target)
+    paths = [os.path.join(HERE, name) for name in files]
+    digests = hash_files([path for path in paths if os.path.isfile(path)])
+    digest = hashlib.sha256(json.dumps(target.command).encode())
+    for name, path in zip(files, paths):
+        digest.update(f"{name}\0{digests.get(path, 'missing')}\n".encode())
+    return digest.hexdigest()
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(STATE_FILE + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(STATE_FILE + '.tmp', STATE_FILE)
+
+
+def stale(target, key, state):
+    return state.get(target.name) != key or \
+        not all(os.path.exists(os.path.join(HERE, output)) for output in target.outputs)
+
+
+def dependencies(targets):
+    """{target: [targets writing one of its inputs]}."""
+    writers = {output: target.name for target in targets for output in target.outputs}
+    return {target.name: sorted({writers[name] for name in target.inputs if name in writers} - {target.name})
+            for target in targets}
+
+
+def render(target):
+    """Run a target; (ok, seconds)."""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    log = os.path.join(HERE, target.stdout) if target.stdout else os.path.join(STATE_DIR, target.name + '.log')
+    env = {**os.environ, 'MPLBACKEND': os.environ.get('MPLBACKEND', 'Agg')}
+    start = time.time()
+    with open(log, 'w') as f:
+        returncode = subprocess.run([sys.executable] + target.command, cwd=HERE, env=env, stdout=f,
+                                    stderr=f if not target.stdout else None).returncode
+    return returncode == 0, time.time() - start
+
+
+def main():
+    names = [target.name for target in TARGETS]
+    parser = argparse.ArgumentParser(description='Render the stale figures and analyses in parallel')
+    parser.add_argument('targets', nargs='*', help=f"Targets and the ones they depend on (default: all of {' '.join(names)})")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Targets rendered at the same time')
+    parser.add_argument('--force', action='store_true', help='Render the targets even when up to date')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the stale targets')
+    args = parser.parse_args()
+
+    by_name = {target.name: target for target in TARGETS}
+    after = dependencies(TARGETS)
+    wanted, todo = [], list(args.targets or names)
+    while todo:
+        name = todo.pop()
+        if name not in by_name:
+            parser.error(f"unknown target {name}")
+        if name not in wanted:
+            wanted.append(name)
+            todo += after[name]
+    targets = [target for target in TARGETS if target.name in wanted]
+
+    state = load_state()
+    if args.dry_run:
+        for target in targets:
+            status = 'stale' if args.force or stale(target, target_key(target), state) else 'up to date'
+            print(f"{target.name:<20} {status:<11} {' '.join(input_files(target))}")
+        return
+
+    # import each data file into its store once, instead of once per figure process
+    for path in sorted({store for target in targets for store in target.stores}):
+        if os.path.exists(os.path.join(HERE, path)):
+            open_store(os.path.join(HERE, path))
+
+    status, running, rendered, failed = {}, {}, [], []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        while True:
+            for target in targets:
+                if target.name in status or any(status.get(name) in (None, 'running') for name in after[target.name]):
+                    continue
+                if any(status[name] == 'failed' for name in after[target.name]):
+                    status[target.name] = 'failed'
+                    failed.append(target.name)
+                    continue
+                key = target_key(target)
+                if not args.force and not stale(target, key, state):
+                    status[target.name] = 'up to date'
+                    continue
+                status[target.name] = 'running'
+                running[pool.submit(render, target)] = (target, key)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                target, key = running.pop(future)
+                ok, seconds = future.result()
+                status[target.name] = 'ok' if ok else 'failed'
+                print(f"  {target.name:<20} {'rendered' if ok else 'FAILED':<9} {seconds:6.1f} s", file=sys.stderr)
+                if ok:
+                    state[target.name] = key
+                    save_state(state)
+                    rendered.append(target.name)
+                else:
+                    failed.append(target.name)
+
+    print(f"{len(rendered)} rendered, {sum(s == 'up to date' for s in status.values())} up to date "
+          f"in {time.time() - start:.1f} s", file=sys.stderr)
+    full, curated = os.path.join(HERE, TOPDOWN_FULL), os.path.join(HERE, TOPDOWN_DATA)
+    if 'top-down-analysis' in rendered and os.path.exists(curated) and os.path.getmtime(full) > os.path.getmtime(curated):
+        print(f"  note: {TOPDOWN_DATA} (figures 3, 4, 6) predates the new {TOPDOWN_FULL}", file=sys.stderr)
+    for name in failed:
+        target = by_name[name]
+        print(f"  failed: {name} (see {target.stdout or os.path.relpath(os.path.join(STATE_DIR, name + '.log'), HERE)})",
+              file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
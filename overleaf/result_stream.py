@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Receiver of the result stream of `_launch_stream` (generated by run/setup).
+
+On the board, `_launch_stream <launch script>` runs the pmcstat launch script
+and, every time the script announces a finished file on fd 3 (the timing
+pass, then each pmcstat.SN.* pass), writes that file to stdout as a
+gzip-compressed tar. A folder announced at the end is sent whole, without the
+files already streamed. run/launch pipes the ssh session into
+
+    python3 result_stream.py <local results folder>
+
+which extracts every file as soon as its tar arrives, so the results of the
+first passes are on the development machine while later passes still run,
+and nothing is left to copy once the launch script returns. Files are
+written under a temporary name and renamed when complete, so pmcstat_ingest.py
+never reads a partial file. With --journal, every pass is entered in the
+campaign journal (campaign_journal.py) as soon as its files are complete.
+"""
+
+import argparse
+import os
+import sys
+import tarfile
+import time
+import zlib
+
+from campaign_journal import Journal, PassTracker
+
+# Bytes read from the ssh pipe at once; smaller reads return as soon as data arrives
+CHUNK = 1 << 16
+
+
+class GzipMembers:
+    """
+    Readable decompressed view of a pipe of concatenated gzip members. Unlike
+    gzip.GzipFile, read() returns whatever is available instead of waiting for
+    a full buffer, so every file is extracted as soon as its tar arrives.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.inflate = zlib.decompressobj(wbits=31)
+        self.pending = b''
+
+    def read(self, size=-1):
+        while not self.pending:
+            data = self.inflate.unused_data or os.read(self.fd, CHUNK)
+            if not data:
+                return b''
+            if self.inflate.eof:
+                self.inflate = zlib.decompressobj(wbits=31)
+            self.pending = self.inflate.decompress(data)
+        size = len(self.pending) if size is None or size < 0 else size
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def _target(dest, name):
+    """Path of a member under dest, or None for names escaping it."""
+    path = os.path.normpath(os.path.join(dest, name))
+    if os.path.isabs(name) or not path.startswith(os.path.normpath(dest) + os.sep):
+        return None
+    return path
+
+
+def receive(fd, dest, verbose=True, tracker=None):
+    """
+    Extract the concatenated, gzip-compressed tars read from fd into dest;
+    returns {name: bytes}. Received files are reported to tracker (PassTracker).
+    """
+    os.makedirs(dest, exist_ok=True)
+    received = {}
+    start = time.time()
+    # Every file is its own gzip member holding its own tar, hence ignore_zeros
+    with tarfile.open(fileobj=GzipMembers(fd), mode='r|', ignore_zeros=True) as tar:
+        for member in tar:
+            path = _target(dest, member.name)
+            if path is None or not (member.isfile() or member.isdir()):
+                continue
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.partial")
+            with tar.extractfile(member) as src, open(partial, 'wb') as dst:
+                while True:
+                    chunk = src.read(1 << 20)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            os.utime(partial, (member.mtime, member.mtime))
+            os.replace(partial, path)
+            received[member.name] = member.size
+            if verbose:
+                print(f"  |..... {time.time() - start:7.1f} s  {os.path.normpath(member.name)} "
+                      f"({member.size} bytes)", file=sys.stderr)
+            if tracker:
+                tracker.received_file(os.path.normpath(member.name))
+    return received
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract the result stream of _launch_stream from stdin')
+    parser.add_argument('dest', help='Local results folder')
+    parser.add_argument('--quiet', action='store_true', help='Do not list the received files')
+    parser.add_argument('--journal', help='Campaign journal of the results root above dest')
+    args = parser.parse_args()
+
+    tracker = None
+    if args.journal:
+        journal = Journal(args.journal)
+        tracker = PassTracker(journal, os.path.relpath(os.path.abspath(args.dest), journal.root))
+    try:
+        received = receive(sys.stdin.fileno(), args.dest, verbose=not args.quiet, tracker=tracker)
+    except (EOFError, OSError, zlib.error, tarfile.TarError) as e:
+        sys.exit(f"Result stream into {args.dest} broken: {e}")
+    if not received:
+        sys.exit(f"No results received into {args.dest}")
+    print(f"Received {len(received)} files ({sum(received.values())} bytes) into {args.dest}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Vectorized top-down engine.
+
+Evaluates the top-down methodology of `top-down-analysis.py` over a whole
+counters matrix (rows x events) at once, so every benchmark, ABI, round and
+interval is handled in a single NumPy pass instead of one Python call per row.
+"""
+
+import numpy as np
+
+# Architectural constants
+ISSUE_WIDTH = 4  # Neoverse-N1 & Morello theoretical maximum
+# Reasonable latency values that work well with instruction mix validation
+L1_LAT = 2    # 2 cycles (pipelined, hit under miss)
+L2_LAT = 6    # 6 cycles (good prefetching)
+LL_LAT = 50   # 50 cycles (modern memory hierarchy)
+
+# Input events, in the positional order of `top_down_analysis(...)`
+TOPDOWN_EVENTS = [
+    'cpu_cycles',
+    'inst_retired',
+    'stall_frontend',
+    'stall_backend',
+    'l1d_cache_refill',
+    'l2d_cache_refill',
+    'll_cache_miss_rd',
+    'mem_access_rd',
+    'mem_access_wr',
+    'inst_spec',
+    'ld_spec',
+    'st_spec',
+    'dp_spec',
+    'ase_spec',
+    'br_indirect_spec',
+    'br_return_spec',
+    'br_immed_spec',
+    'vfp_spec',
+    'mem_access_rd_ctag',
+    'mem_access_wr_ctag',
+    'cap_mem_access_rd',
+    'cap_mem_access_wr',
+]
+
+# Output columns, in the order returned by `top_down_analysis(...)`
+TOPDOWN_METRICS = [
+    'Retiring',
+    'Frontend_Bound',
+    'Backend_Bound',
+    'Bad_Speculation',
+    'Memory_Bound',
+    'Core_Bound',
+    'L1_Bound',
+    'L2_Bound',
+    'ExtMem_Bound',
+    'IPC',
+    'Cap_Load_Density',
+    'Cap_Store_Density',
+    'Cap_Traffic_Share',
+    'Cap_Tag_Overhead',
+    'Mem_Intensity',
+]
+
+# Instruction classes whose sum is the denominator of Retiring
+SPEC_EVENTS = [
+    'inst_spec', 'ld_spec', 'st_spec', 'dp_spec', 'ase_spec',
+    'br_indirect_spec', 'br_return_spec', 'br_immed_spec', 'vfp_spec',
+]
+
+
+def _div(num, den, where=None):
+    """Element-wise num / den, 0.0 where den <= 0 (or where `where` is False)."""
+    out = np.zeros(np.broadcast(num, den).shape)
+    np.divide(num, den, out=out, where=(den > 0) if where is None else where)
+    return out
+
+
+def _warn(mask, message, labels=None):
+    """Print one warning for all rows selected by mask."""
+    count = int(np.count_nonzero(mask))
+    if count == 0:
+        return
+    if labels is None:
+        print(f"WARNING: {message} ({count} rows)")
+        return
+    selected = [str(label) for label in np.asarray(labels, dtype=object)[mask]]
+    shown = ", ".join(selected[:8]) + (", ..." if count > 8 else "")
+    print(f"WARNING: {message} ({count} rows: {shown})")
+
+
+def top_down_matrix(counters, events=TOPDOWN_EVENTS, labels=None, verbose=True):
+    """
+    Top-down analysis following standard methodology, for every row at once.
+
+    counters is an array-like of shape (..., len(events)) whose last axis is
+    indexed by `events`; every event of TOPDOWN_EVENTS must be present.
+    Returns a float64 array of shape (..., 15) whose last axis follows
+    TOPDOWN_METRICS. Rows with non-positive cpu_cycles or inst_retired are
+    all zeros, as in the scalar version.
+    """
+    counters = np.asarray(counters, dtype=np.float64)
+    events = list(events)
+    missing = [e for e in TOPDOWN_EVENTS if e not in events]
+    if missing:
+        raise KeyError(f"Missing top-down events: {missing}")
+
+    shape = counters.shape[:-1]
+    flat = counters.reshape(-1, counters.shape[-1])
+    c = {e: flat[:, events.index(e)] for e in TOPDOWN_EVENTS}
+    if labels is not None:
+        labels = np.asarray(labels, dtype=object).reshape(-1)
+
+    cpu_cycles = c['cpu_cycles']
+    inst_retired = c['inst_retired']
+
+    # Input validation
+    invalid = (cpu_cycles <= 0) | (inst_retired <= 0)
+
+    if verbose:
+        _warn(invalid, "Invalid input - cpu_cycles and inst_retired must be positive", labels)
+        _warn((c['stall_frontend'] < 0) | (c['stall_backend'] < 0),
+              "Negative stall counters detected, clamping to 0", labels)
+        _warn(inst_retired > cpu_cycles * ISSUE_WIDTH,
+              "inst_retired > cpu_cycles * ISSUE_WIDTH - this is impossible", labels)
+        _warn(c['stall_frontend'] + c['stall_backend'] > cpu_cycles,
+              "Total stalls > cpu_cycles - counters may overlap", labels)
+
+    stall_frontend = np.maximum(c['stall_frontend'], 0)
+    stall_backend = np.maximum(c['stall_backend'], 0)
+    inst_spec = c['inst_spec']
+    ld_spec = c['ld_spec']
+    st_spec = c['st_spec']
+    dp_spec = c['dp_spec']
+
+    # ---------- Overall ----------
+    IPC = _div(inst_retired, cpu_cycles)
+
+    # ---------- 1st-level metrics (normalized as fractions of total slots) ----------
+    total_spec = sum(c[e] for e in SPEC_EVENTS)
+    Retiring = _div(inst_spec, total_spec, where=total_spec != 0)
+    Frontend_Bound = _div(stall_frontend, cpu_cycles)
+    Backend_Bound = _div(stall_backend, cpu_cycles)
+    Bad_Speculation = np.maximum(0.0, 1.0 - (Retiring + Frontend_Bound + Backend_Bound))
+
+    # ---------- 2nd-level backend split using instruction mix validation ----------
+    L1_Stall_Cycles = np.maximum(c['l1d_cache_refill'] * L1_LAT, 0)
+    L2_Stall_Cycles = np.maximum(c['l2d_cache_refill'] * L2_LAT, 0)
+    LL_Stall_Cycles = np.maximum(c['ll_cache_miss_rd'] * LL_LAT, 0)
+    Mem_Stall_Cycles = np.maximum(
+        c['l1d_cache_refill'] * L1_LAT
+        + c['l2d_cache_refill'] * L2_LAT
+        + c['ll_cache_miss_rd'] * LL_LAT,
+        0,
+    )
+
+    # Instruction mix split (rows with inst_spec > 0)
+    mix = inst_spec > 0
+    mem_inst_ratio = _div(ld_spec + st_spec, inst_spec)
+    core_inst_ratio = _div(dp_spec, inst_spec)
+    total_inst_ratio = mem_inst_ratio + core_inst_ratio
+    over = mix & (total_inst_ratio > 1.0)
+    if verbose:
+        _warn(over & ~invalid, "Instruction mix ratios sum > 1.0, normalizing", labels)
+    mem_inst_ratio = np.where(over, _div(mem_inst_ratio, total_inst_ratio), mem_inst_ratio)
+    core_inst_ratio = np.where(over, _div(core_inst_ratio, total_inst_ratio), core_inst_ratio)
+
+    stalled = stall_backend > 0
+    mix_memory = np.where(stalled, Backend_Bound * mem_inst_ratio, 0.0)
+    mix_core = np.where(stalled, Backend_Bound * core_inst_ratio, Backend_Bound)
+
+    # Normalize the split so that it sums to Backend_Bound
+    total_backend = mix_memory + mix_core
+    unbalanced = np.abs(total_backend - Backend_Bound) > 0.001
+    if verbose:
+        _warn(mix & unbalanced & ~invalid, "Memory_Bound + Core_Bound != Backend_Bound", labels)
+    positive = total_backend > 0
+    mix_memory = np.where(unbalanced, np.where(positive, _div(mix_memory * Backend_Bound, total_backend), 0.0), mix_memory)
+    mix_core = np.where(unbalanced, np.where(positive, _div(mix_core * Backend_Bound, total_backend), Backend_Bound), mix_core)
+
+    # Fallback to latency-based approach if no instruction mix data
+    memory_ratio = _div(Mem_Stall_Cycles, stall_backend)
+    lat_memory = np.where(
+        memory_ratio >= 1.0, Backend_Bound,
+        np.where(memory_ratio >= 0.5, Backend_Bound * memory_ratio,
+                 Backend_Bound * np.minimum(memory_ratio, 0.8)),
+    )
+    lat_memory = np.where(stalled, lat_memory, 0.0)
+    lat_core = Backend_Bound - lat_memory
+
+    Memory_Bound = np.where(mix, mix_memory, lat_memory)
+    Core_Bound = np.where(mix, mix_core, lat_core)
+
+    # ---------- 3rd-level memory breakdown ----------
+    split = (Mem_Stall_Cycles > 0) & (Memory_Bound > 0)
+    L1_Bound = np.where(split, Memory_Bound * _div(L1_Stall_Cycles, Mem_Stall_Cycles), 0.0)
+    L2_Bound = np.where(split, Memory_Bound * _div(L2_Stall_Cycles, Mem_Stall_Cycles), 0.0)
+    ExtMem_Bound = np.maximum(0.0, Memory_Bound - (L1_Bound + L2_Bound))
+
+    # ---------- CHERI metrics (ratios, not normalized) ----------
+    ld_spec = np.maximum(ld_spec, 0)
+    st_spec = np.maximum(st_spec, 0)
+    inst_spec = np.maximum(inst_spec, 0)
+    mem_access_rd = np.maximum(c['mem_access_rd'], 0)
+    mem_access_wr = np.maximum(c['mem_access_wr'], 0)
+    total_mem_access = mem_access_rd + mem_access_wr
+
+    Cap_Load_Density = _div(c['cap_mem_access_rd'], ld_spec)
+    Cap_Store_Density = _div(c['cap_mem_access_wr'], st_spec)
+    Cap_Traffic_Share = _div(c['cap_mem_access_rd'] + c['cap_mem_access_wr'], total_mem_access)
+    Cap_Tag_Overhead = _div(c['mem_access_rd_ctag'] + c['mem_access_wr_ctag'], total_mem_access)
+
+    # ---------- Memory Intensity ----------
+    Mem_Intensity = _div(ld_spec + st_spec, inst_spec)
+
+    out = np.stack([
+        Retiring,
+        Frontend_Bound,
+        Backend_Bound,
+        Bad_Speculation,
+        Memory_Bound,
+        Core_Bound,
+        L1_Bound,
+        L2_Bound,
+        ExtMem_Bound,
+        IPC,
+        Cap_Load_Density,
+        Cap_Store_Density,
+        Cap_Traffic_Share,
+        Cap_Tag_Overhead,
+        Mem_Intensity,
+    ], axis=-1)
+    out[invalid] = 0.0
+    return out.reshape(shape + (len(TOPDOWN_METRICS),))